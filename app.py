@@ -3,10 +3,11 @@ import requests
 import io
 import os
 import datetime
-import json
+import time
 
 # Import client-side face authentication helper
 import client_face_auth
+import face_codec
 
 st.set_page_config(
     page_title="AetherSecure - Multi-Layer Crypto Vault",
@@ -16,6 +17,9 @@ st.set_page_config(
 
 # --- ALAMAT API SERVER ---
 API_BASE_URL = "https://chp.fyuko.app"
+INBOX_PAGE_SIZE = 20
+# Jumlah foto wajah terakhir yang diproses bersama (satu batch DNN)
+FACE_MAX_FRAMES = 5
 
 # --- CSS KUSTOM (Diperbarui untuk tampilan lebih profesional) ---
 custom_css = """
@@ -173,8 +177,12 @@ if 'username' not in st.session_state:
     st.session_state['username'] = None
 if 'access_token' not in st.session_state:
     st.session_state['access_token'] = None
-if 'face_encoding_json' not in st.session_state: # Disimpan untuk verifikasi
-    st.session_state['face_encoding_json'] = None
+if 'refresh_token' not in st.session_state: # Untuk memperbarui access token
+    st.session_state['refresh_token'] = None
+if 'token_expires_at' not in st.session_state:
+    st.session_state['token_expires_at'] = None
+if 'face_encoding' not in st.session_state: # Disimpan untuk verifikasi (base64 biner)
+    st.session_state['face_encoding'] = None
     
 if 'login_step' not in st.session_state:
     st.session_state['login_step'] = 1
@@ -184,6 +192,10 @@ if 'reg_username' not in st.session_state:
     st.session_state['reg_username'] = ""
 if 'reg_password' not in st.session_state:
     st.session_state['reg_password'] = ""
+if 'reg_frames' not in st.session_state: # Foto wajah untuk template registrasi
+    st.session_state['reg_frames'] = []
+if 'login_frames' not in st.session_state: # Foto wajah percobaan login
+    st.session_state['login_frames'] = []
 
 if 'page' not in st.session_state:
     st.session_state['page'] = "Crypto Tools"
@@ -191,6 +203,11 @@ if 'selected_message_id' not in st.session_state:
     st.session_state['selected_message_id'] = None
 if 'current_message_blob' not in st.session_state:
     st.session_state['current_message_blob'] = None
+# Paginasi kotak masuk: cursor untuk setiap halaman yang sudah dibuka
+if 'inbox_cursors' not in st.session_state:
+    st.session_state['inbox_cursors'] = [None]
+if 'inbox_page' not in st.session_state:
+    st.session_state['inbox_page'] = 0
 
 # --- Bagian 1: Fungsi Tampilan Login & Logout (Diperbarui) ---
 
@@ -229,18 +246,25 @@ def login_form():
                                         
                                         # 2. Panggil /users/me untuk mengambil data wajah
                                         headers = {"Authorization": f"Bearer {temp_token}"}
-                                        user_data_resp = requests.get(f"{API_BASE_URL}/users/me", headers=headers)
+                                        user_data_resp = requests.get(
+                                            f"{API_BASE_URL}/users/me",
+                                            params={"face_encoding_format": "base64"},
+                                            headers=headers
+                                        )
                                         
                                         if user_data_resp.status_code == 200:
                                             user_data = user_data_resp.json()
-                                            st.session_state['access_token'] = temp_token
+                                            store_tokens(token_data)
                                             st.session_state['username'] = user_data['username']
-                                            st.session_state['face_encoding_json'] = user_data['face_encoding_json']
+                                            st.session_state['face_encoding'] = user_data.get('face_encoding_b64')
                                             st.session_state['login_step'] = 2
                                             st.success("Password benar. Lanjut ke verifikasi wajah.", icon="✅")
                                             st.rerun()
                                         else:
                                             st.error("Gagal mengambil data pengguna setelah login.", icon="🚨")
+                                    elif response.status_code == 429:
+                                        wait = response.headers.get("Retry-After", "beberapa")
+                                        st.error(f"Terlalu banyak percobaan login. Coba lagi dalam {wait} detik.", icon="⏳")
                                     else:
                                         st.error("Login Gagal: Username atau Password salah.", icon="🚨")
                                 except requests.ConnectionError:
@@ -252,17 +276,21 @@ def login_form():
                 login_face_image = st.camera_input("Ambil foto untuk verifikasi login", key="login_cam")
                 
                 if login_face_image:
+                    # Foto dari percobaan sebelumnya ikut dinilai; yang dipakai
+                    # adalah kecocokan terbaik
+                    login_frames = remember_face_frame('login_frames', login_face_image)
                     with st.spinner("Memverifikasi wajah (secara lokal)..."):
                         # Panggil fungsi verifikasi LOKAL
-                        is_match, message = client_face_auth.compare_faces(
-                            st.session_state['face_encoding_json'], 
-                            login_face_image
+                        is_match, message = client_face_auth.compare_faces_multi(
+                            st.session_state['face_encoding'], 
+                            login_frames
                         )
                     
                     if is_match:
                         st.success(f"Login Berhasil! Wajah cocok. Selamat datang.", icon="✅")
                         st.session_state['logged_in'] = True
                         st.session_state['login_step'] = 1 # Reset
+                        st.session_state['login_frames'] = []
                         st.session_state['page'] = "Crypto Tools"
                         st.rerun() 
                     else:
@@ -273,7 +301,10 @@ def login_form():
                     st.session_state['login_step'] = 1
                     st.session_state['username'] = None
                     st.session_state['access_token'] = None
-                    st.session_state['face_encoding_json'] = None
+                    st.session_state['refresh_token'] = None
+                    st.session_state['token_expires_at'] = None
+                    st.session_state['face_encoding'] = None
+                    st.session_state['login_frames'] = []
                     st.rerun()
 
         with tab_register:
@@ -302,19 +333,21 @@ def login_form():
                 register_face_image = st.camera_input("Ambil foto untuk registrasi biometrik", key="reg_cam")
                 
                 if register_face_image:
+                    reg_frames = remember_face_frame('reg_frames', register_face_image)
+                    st.caption(f"{len(reg_frames)}/{FACE_MAX_FRAMES} foto terkumpul. Ambil beberapa foto (sedikit beda sudut) untuk template yang lebih andal.")
                     if st.button("Daftar 👤", use_container_width=True, type="primary"):
                         with st.spinner("Memproses gambar wajah (secara lokal)..."):
-                            # Panggil fungsi encoding LOKAL
-                            encoding, message = client_face_auth.get_face_encoding(register_face_image)
+                            # Panggil fungsi encoding LOKAL (template rata-rata semua foto)
+                            encoding, message = client_face_auth.get_enrollment_template(reg_frames)
                         
                         if encoding is not None:
-                            face_encoding_json = json.dumps(encoding.tolist())
+                            face_encoding_b64 = face_codec.to_b64(face_codec.encode(encoding))
                             with st.spinner("Mengirim data registrasi ke server..."):
                                 try:
                                     payload = {
                                         "username": st.session_state['reg_username'],
                                         "password": st.session_state['reg_password'],
-                                        "face_encoding_json": face_encoding_json
+                                        "face_encoding_b64": face_encoding_b64
                                     }
                                     response = requests.post(f"{API_BASE_URL}/register", json=payload)
                                     
@@ -323,6 +356,7 @@ def login_form():
                                         st.session_state['register_step'] = 1
                                         st.session_state['reg_username'] = ""
                                         st.session_state['reg_password'] = ""
+                                        st.session_state['reg_frames'] = []
                                     else:
                                         st.error(f"Registrasi Gagal (Server): {response.json().get('detail', 'Error')}", icon="🚨")
                                 except requests.ConnectionError:
@@ -334,24 +368,81 @@ def login_form():
                     st.session_state['register_step'] = 1
                     st.session_state['reg_username'] = ""
                     st.session_state['reg_password'] = ""
+                    st.session_state['reg_frames'] = []
                     st.rerun()
 
+def remember_face_frame(state_key, image_file):
+    """
+    Menyimpan foto kamera terbaru (tanpa duplikat saat Streamlit rerun) dan
+    mengembalikan hingga FACE_MAX_FRAMES foto terakhir sebagai BytesIO.
+    """
+    frames = st.session_state[state_key]
+    frame_bytes = image_file.getvalue()
+    if not frames or frames[-1] != frame_bytes:
+        frames.append(frame_bytes)
+        del frames[:-FACE_MAX_FRAMES]
+    return [io.BytesIO(frame) for frame in frames]
+
+def store_tokens(token_data):
+    """Menyimpan access/refresh token dari respons /token atau /token/refresh."""
+    st.session_state['access_token'] = token_data['access_token']
+    st.session_state['refresh_token'] = token_data.get('refresh_token')
+    expires_in = token_data.get('expires_in')
+    st.session_state['token_expires_at'] = time.time() + expires_in if expires_in else None
+
 def logout():
+    token = st.session_state.get('access_token')
+    if token:
+        # Cabut token di server (best effort, sesi lokal tetap dibersihkan)
+        try:
+            requests.post(
+                f"{API_BASE_URL}/logout",
+                json={"refresh_token": st.session_state.get('refresh_token')},
+                headers={"Authorization": f"Bearer {token}"},
+                timeout=5
+            )
+        except requests.RequestException:
+            pass
     st.session_state['logged_in'] = False
     st.session_state['username'] = None
     st.session_state['access_token'] = None
-    st.session_state['face_encoding_json'] = None
+    st.session_state['refresh_token'] = None
+    st.session_state['token_expires_at'] = None
+    st.session_state['face_encoding'] = None
+    st.session_state['login_frames'] = []
     st.session_state['login_step'] = 1
     st.session_state['register_step'] = 1
     st.session_state['page'] = "Crypto Tools"
     st.session_state['selected_message_id'] = None
+    st.session_state['inbox_cursors'] = [None]
+    st.session_state['inbox_page'] = 0
     st.success("Anda telah keluar.", icon="👋")
 
 
 # --- Bagian 2: Tampilan Konten Utama (API-driven) ---
 
+def refresh_access_token_if_needed():
+    """Memperbarui access token (umurnya pendek) sesaat sebelum kedaluwarsa."""
+    expires_at = st.session_state.get('token_expires_at')
+    refresh_token = st.session_state.get('refresh_token')
+    if not refresh_token or expires_at is None or time.time() < expires_at - 60:
+        return
+    try:
+        response = requests.post(
+            f"{API_BASE_URL}/token/refresh",
+            json={"refresh_token": refresh_token}
+        )
+    except requests.ConnectionError:
+        return
+    if response.status_code == 200:
+        store_tokens(response.json())
+    else:
+        st.session_state['access_token'] = None
+        st.session_state['refresh_token'] = None
+
 def get_auth_headers():
     """Helper untuk mendapatkan header otentikasi."""
+    refresh_access_token_if_needed()
     token = st.session_state.get('access_token')
     if not token:
         st.error("Sesi Anda telah berakhir. Silakan logout dan login kembali.", icon="🚨")
@@ -430,6 +521,8 @@ def render_crypto_tools_page():
                     st.subheader("Input 📝")
                     image_file = st.file_uploader("Upload Gambar Penampung (Cover Image)", type=["png"])
                     message_to_hide = st.text_area("Pesan Rahasia", height=150, placeholder="Masukkan pesan rahasia...")
+                    bits_per_channel = st.select_slider("Bit per Kanal (kapasitas vs. ketidaktampakan)", options=[1, 2, 3, 4], value=1)
+                    use_alpha = st.checkbox("Gunakan juga kanal alpha (transparansi)")
             with col2:
                 with st.container(border=True):
                     st.subheader("Output 💡")
@@ -437,7 +530,7 @@ def render_crypto_tools_page():
                         if image_file and message_to_hide:
                             with st.spinner("Mengirim gambar ke server untuk diproses..."):
                                 files = {"image": (image_file.name, image_file, "image/png")}
-                                data = {"message": message_to_hide}
+                                data = {"message": message_to_hide, "bits_per_channel": bits_per_channel, "use_alpha": use_alpha}
                                 try:
                                     response = requests.post(f"{API_BASE_URL}/crypto/image/hide", files=files, data=data, headers=headers)
                                     if response.status_code == 200:
@@ -620,10 +713,18 @@ def render_messaging_page():
         st.divider()
         st.subheader("Daftar Pesan:")
         
+        page = st.session_state['inbox_page']
+        params = {"limit": INBOX_PAGE_SIZE}
+        if st.session_state['inbox_cursors'][page]:
+            params["before"] = st.session_state['inbox_cursors'][page]
+        
+        next_cursor = None
         try:
-            response = requests.get(f"{API_BASE_URL}/messages/inbox", headers=headers)
+            response = requests.get(f"{API_BASE_URL}/messages/inbox", params=params, headers=headers)
             if response.status_code == 200:
-                my_messages = response.json()
+                inbox_page = response.json()
+                my_messages = inbox_page['messages']
+                next_cursor = inbox_page['next_cursor']
             else:
                 my_messages = []
                 st.error("Gagal memuat kotak masuk.", icon="🚨")
@@ -658,6 +759,19 @@ def render_messaging_page():
                 with col3:
                     st.button("Buka & Dekripsi 🔑", key=f"open_{msg_id}", use_container_width=True, on_click=lambda mid=msg_id: st.session_state.update(selected_message_id=mid, current_message_blob=None))
 
+        # Navigasi halaman (cursor halaman berikutnya disimpan agar bisa kembali)
+        def go_to_next_page(cursor=next_cursor):
+            st.session_state['inbox_cursors'] = st.session_state['inbox_cursors'][:page + 1] + [cursor]
+            st.session_state['inbox_page'] = page + 1
+        
+        nav_prev, nav_info, nav_next = st.columns([1, 2, 1])
+        with nav_prev:
+            st.button("⬅️ Lebih Baru", key="inbox_prev", use_container_width=True, disabled=page == 0, on_click=lambda: st.session_state.update(inbox_page=page - 1))
+        with nav_info:
+            st.caption(f"Halaman {page + 1}")
+        with nav_next:
+            st.button("Lebih Lama ➡️", key="inbox_next", use_container_width=True, disabled=next_cursor is None, on_click=go_to_next_page)
+
 def render_message_detail(message_id, headers):
     """Menampilkan UI dekripsi untuk pesan yang dipilih."""
     
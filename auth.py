@@ -4,6 +4,9 @@ from jose import JWTError, jwt
 from passlib.context import CryptContext
 from datetime import datetime, timedelta, timezone
 from typing import Optional
+import threading
+import time
+import uuid
 import models # Import your pydantic models
 import database # Import your database functions
 
@@ -11,7 +14,18 @@ import database # Import your database functions
 # !! IN A REAL APP, LOAD THIS FROM .env FILE !!
 SECRET_KEY = "YOUR_SUPER_SECRET_KEY_CHANGE_THIS"
 ALGORITHM = "HS256"
-ACCESS_TOKEN_EXPIRE_MINUTES = 60
+# Access tokens are short-lived and checked without touching the users
+# table; refresh tokens are long-lived and exchanged at /token/refresh
+ACCESS_TOKEN_EXPIRE_MINUTES = 15
+REFRESH_TOKEN_EXPIRE_DAYS = 7
+# How often each API process re-reads the revocation tables (from a
+# background thread, see main.py), so a logout handled by another worker
+# process takes effect here too
+REVOCATION_RELOAD_SECONDS = 30
+# Why a refresh token was revoked: reuse of a rotated one means it was
+# copied and revokes the whole subject, reuse after logout does not
+REFRESH_ROTATED = "rotated"
+REFRESH_LOGGED_OUT = "logout"
 
 # --- Password Hashing ---
 # We use the one from crypto.py, but passlib is also standard
@@ -26,39 +40,141 @@ oauth2_scheme = OAuth2PasswordBearer(tokenUrl="token")
 
 def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
     to_encode = data.copy()
+    now = datetime.now(timezone.utc)
     if expires_delta:
-        expire = datetime.now(timezone.utc) + expires_delta
+        expire = now + expires_delta
     else:
-        expire = datetime.now(timezone.utc) + timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
-    to_encode.update({"exp": expire})
+        expire = now + timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
+    # Fractional iat so a revocation and a new login in the same second
+    # are still ordered correctly
+    to_encode.setdefault("type", "access")
+    to_encode.update({"exp": expire, "iat": now.timestamp(), "jti": uuid.uuid4().hex})
     encoded_jwt = jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
     return encoded_jwt
 
-# --- Dependency ---
+def create_refresh_token(username: str):
+    return create_access_token(
+        data={"sub": username, "type": "refresh"},
+        expires_delta=timedelta(days=REFRESH_TOKEN_EXPIRE_DAYS)
+    )
 
-def get_current_user(token: str = Depends(oauth2_scheme)):
+# --- Revocation ---
+# Revoked access-token ids and per-user "revoked before" times are kept in
+# memory (checked on every request) and persisted in SQLite; load_revocations
+# runs at startup and then every REVOCATION_RELOAD_SECONDS from a background
+# thread, never on the request path. Revoked refresh tokens live in their own
+# table and are only looked up when one is presented, so the in-memory set
+# holds just the short-lived access tokens.
+
+_revocation_lock = threading.Lock()
+_revoked_jtis = {} # jti -> exp
+_revoked_before = {} # username -> timestamp
+
+def load_revocations():
+    """Purges expired records and reloads the in-memory revocation state."""
+    global _revoked_jtis, _revoked_before
+    jtis, subjects = database.load_revocations(
+        time.time(), timedelta(days=REFRESH_TOKEN_EXPIRE_DAYS).total_seconds()
+    )
+    with _revocation_lock:
+        _revoked_jtis = jtis
+        _revoked_before = subjects
+
+def is_subject_revoked(payload: dict):
+    """True if all tokens of the subject issued up to this token's iat were revoked."""
+    with _revocation_lock:
+        revoked_before = _revoked_before.get(payload.get("sub"))
+    # Tokens without iat predate revocation support: treat as oldest
+    return revoked_before is not None and payload.get("iat", 0) <= revoked_before
+
+def is_revoked(payload: dict):
+    if payload.get("type") == "refresh":
+        if database.refresh_token_revocation(payload.get("jti")) is not None:
+            return True
+    else:
+        with _revocation_lock:
+            if payload.get("jti") in _revoked_jtis:
+                return True
+    return is_subject_revoked(payload)
+
+def revoke_token(payload: dict):
+    """Revokes a single decoded access token until it expires."""
+    jti = payload.get("jti")
+    if jti is None:
+        return
+    database.revoke_token(jti, payload["exp"])
+    with _revocation_lock:
+        _revoked_jtis[jti] = payload["exp"]
+
+def revoke_refresh_token(payload: dict, reason: str = REFRESH_LOGGED_OUT):
     """
-    Dependency to get the current user from a JWT.
-    This protects endpoints.
+    Revokes a decoded refresh token until it expires. Returns None if this
+    call revoked it, otherwise the reason it had already been revoked (by
+    this or any other process). The database insert is the atomic claim
+    used by refresh rotation.
     """
-    credentials_exception = HTTPException(
+    jti = payload.get("jti")
+    if jti is None:
+        return REFRESH_LOGGED_OUT
+    return database.revoke_refresh_token(jti, payload["exp"], reason)
+
+def revoke_subject(username: str):
+    """Revokes every token issued to `username` up to now."""
+    revoked_before = time.time()
+    database.revoke_subject(username, revoked_before)
+    with _revocation_lock:
+        _revoked_before[username] = max(_revoked_before.get(username, 0), revoked_before)
+
+def revocation_stats():
+    with _revocation_lock:
+        return {"revoked_access_tokens": len(_revoked_jtis), "revoked_subjects": len(_revoked_before)}
+
+# --- Dependency ---
+
+def _credentials_exception():
+    return HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
         detail="Could not validate credentials",
         headers={"WWW-Authenticate": "Bearer"},
     )
+
+def decode_token(token: str, token_type: str = "access", check_revoked: bool = True):
+    """
+    Verifies signature, expiry, type and revocation; returns the claims.
+    Tokens issued before refresh support have no type and count as access.
+    `check_revoked=False` is for callers doing their own (atomic) check.
+    """
     try:
         payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
-        username: str = payload.get("sub")
-        if username is None:
-            raise credentials_exception
-        token_data = models.TokenData(username=username)
+        token_data = models.TokenData(username=payload.get("sub"))
     except JWTError:
-        raise credentials_exception
+        raise _credentials_exception()
+    if token_data.username is None or payload.get("type", "access") != token_type:
+        raise _credentials_exception()
+    if check_revoked and is_revoked(payload):
+        raise _credentials_exception()
+    return payload
+
+def get_current_user(token: str = Depends(oauth2_scheme)):
+    """
+    Dependency to get the current user from a JWT.
+    This protects endpoints.
+    """
+    payload = decode_token(token)
     
-    # Get user data from database
-    user = database.get_user_details(token_data.username)
+    # Get user data from database (cached briefly, see database.py)
+    user = database.get_user_details(payload["sub"])
     if user is None:
-        raise credentials_exception
+        raise _credentials_exception()
     
-    # Return as a dictionary matching UserInDB model
-    return {"username": user['username'], "face_encoding_json": user['face_encoding_json']}
\ No newline at end of file
+    # Binary face encoding; endpoints format it for the response
+    return {"username": user['username'], "face_encoding": user['face_encoding']}
+
+def get_current_principal(token: str = Depends(oauth2_scheme)):
+    """
+    Like get_current_user, but validates the token alone (signature, expiry,
+    revocation) and returns {"username"} without reading the users table.
+    Deleted accounts are cut off through revoke_subject.
+    """
+    payload = decode_token(token)
+    return {"username": payload["sub"]}
@@ -0,0 +1,334 @@
+import argparse
+import itertools
+import json
+import os
+import platform
+import sys
+import time
+import tracemalloc
+
+import cv2
+import numpy as np
+
+import face_pipeline
+
+# --- Face Pipeline Benchmark ---
+# Times each stage of face_pipeline.encode_frames separately, over a
+# directory of images or synthetic frames at several resolutions, for every
+# combination of OpenCV DNN backend / target / thread count:
+#
+#   python bench_face.py --resolutions 640x480,1920x1080 --threads 1,4 --json bench.json
+#   python bench_face.py --images photos/ --backends opencv --targets cpu,opencl
+#
+# Latency is measured without tracing; memory comes from one extra pass per
+# configuration under tracemalloc (peak Python/NumPy bytes each stage allocates)
+# plus the process peak RSS (not reported on Windows). Model weights must be
+# present in models/.
+
+STAGES = (
+    "decode",
+    "detector_preprocess",
+    "detector_forward",
+    "postprocess",
+    "encoder_preprocess",
+    "encoder_forward",
+    "total",
+)
+
+BACKENDS = {
+    name: getattr(cv2.dnn, const) for name, const in (
+        ("default", "DNN_BACKEND_DEFAULT"),
+        ("opencv", "DNN_BACKEND_OPENCV"),
+        ("inference_engine", "DNN_BACKEND_INFERENCE_ENGINE"),
+        ("cuda", "DNN_BACKEND_CUDA"),
+    ) if hasattr(cv2.dnn, const)
+}
+
+TARGETS = {
+    name: getattr(cv2.dnn, const) for name, const in (
+        ("cpu", "DNN_TARGET_CPU"),
+        ("opencl", "DNN_TARGET_OPENCL"),
+        ("opencl_fp16", "DNN_TARGET_OPENCL_FP16"),
+        ("cuda", "DNN_TARGET_CUDA"),
+        ("cuda_fp16", "DNN_TARGET_CUDA_FP16"),
+    ) if hasattr(cv2.dnn, const)
+}
+
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png", ".bmp", ".webp")
+
+
+def _csv(value, cast=str):
+    return [cast(item.strip()) for item in value.split(",") if item.strip()]
+
+
+def _resolution(value):
+    width, _, height = value.lower().partition("x")
+    return int(width), int(height)
+
+
+def _encode_jpeg(image, quality):
+    ok, buf = cv2.imencode(".jpg", image, [cv2.IMWRITE_JPEG_QUALITY, quality])
+    if not ok:
+        raise RuntimeError("cv2.imencode failed")
+    return buf.tobytes()
+
+
+def synthetic_frames(width, height, count, quality=90, seed=0):
+    """
+    JPEG frames of smooth noise plus a bright ellipse, so decode and
+    crop/sharpness costs resemble a camera frame. The detector will usually
+    find no face in them; the encoder is then timed on a centre crop.
+    """
+    rng = np.random.RandomState(seed)
+    frames = []
+    for _ in range(count):
+        small = rng.randint(0, 255, (max(1, height // 16), max(1, width // 16), 3), dtype=np.uint8)
+        image = cv2.resize(small, (width, height), interpolation=cv2.INTER_CUBIC)
+        cv2.ellipse(image, (width // 2, height // 2), (width // 6, height // 4), 0, 0, 360,
+                    (180, 200, 220), -1)
+        frames.append(_encode_jpeg(image, quality))
+    return frames
+
+
+def load_image_dir(path, resolution=None, quality=90):
+    """Image bytes from `path`; re-encoded at `resolution` (w, h) if given."""
+    frames = []
+    for name in sorted(os.listdir(path)):
+        if not name.lower().endswith(IMAGE_EXTENSIONS):
+            continue
+        with open(os.path.join(path, name), "rb") as f:
+            data = f.read()
+        if resolution is not None:
+            image = face_pipeline.decode_frame(data)
+            if image is None:
+                continue
+            data = _encode_jpeg(cv2.resize(image, resolution), quality)
+        frames.append(data)
+    return frames
+
+
+def _fallback_faces(images):
+    """Centre crops, so the encoder is still measured on frames without a detection."""
+    faces = []
+    for image in images:
+        h, w = image.shape[:2]
+        side = max(face_pipeline.MIN_FACE_SIZE, min(h, w) // 2)
+        top, left = (h - side) // 2, (w - side) // 2
+        faces.append(image[top:top + side, left:left + side])
+    return faces
+
+
+def run_batch(detector_net, encoder_net, frames, timings=None, memory=None):
+    """
+    One pass of the encode_frames pipeline over `frames`, stage by stage.
+    Appends seconds per stage to `timings` and, when tracemalloc is on,
+    the peak bytes each stage allocated on top of what was already live to
+    `memory`. Returns the number of faces the detector accepted.
+    """
+    clock = time.perf_counter
+    marks = {}
+
+    def stage(name, fn, *args):
+        if memory is not None:
+            tracemalloc.reset_peak()
+            live = tracemalloc.get_traced_memory()[0]
+        started = clock()
+        result = fn(*args)
+        marks[name] = clock() - started
+        if memory is not None:
+            memory.setdefault(name, []).append(tracemalloc.get_traced_memory()[1] - live)
+        return result
+
+    def forward(net, blob):
+        net.setInput(blob)
+        return net.forward()
+
+    started = clock()
+    images = stage("decode", lambda: [
+        image for image in map(face_pipeline.decode_frame, frames) if image is not None
+    ])
+    if not images:
+        raise ValueError("None of the frames could be decoded.")
+    blob = stage("detector_preprocess", face_pipeline.detector_blob, images)
+    detections = stage("detector_forward", forward, detector_net, blob)
+    faces, _, _ = stage("postprocess", lambda: face_pipeline.crop_faces(
+        images, face_pipeline.best_detections(detections, images)
+    ))
+    detected = len(faces)
+    if not faces:
+        faces = _fallback_faces(images)
+    face_blob = stage("encoder_preprocess", face_pipeline.encoder_blob, faces)
+    stage("encoder_forward", forward, encoder_net, face_blob)
+    marks["total"] = clock() - started
+
+    if timings is not None:
+        for name, seconds in marks.items():
+            timings.setdefault(name, []).append(seconds)
+    return detected
+
+
+def _latency_summary(samples):
+    ms = np.asarray(samples, dtype=np.float64) * 1000
+    p50, p95, p99 = np.percentile(ms, [50, 95, 99])
+    return {
+        "p50_ms": round(float(p50), 3),
+        "p95_ms": round(float(p95), 3),
+        "p99_ms": round(float(p99), 3),
+        "mean_ms": round(float(ms.mean()), 3),
+    }
+
+
+def _peak_rss_bytes():
+    """Process peak RSS, or None where the resource module is missing (Windows)."""
+    if sys.platform == "win32":
+        return None
+    import resource
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == "darwin" else peak * 1024 # Linux reports KiB
+
+
+def _configure(detector_net, encoder_net, backend, target, threads):
+    """Applies a backend/target/thread setting; returns a skip reason or None."""
+    backend_id, target_id = BACKENDS[backend], TARGETS[target]
+    if backend != "default":
+        available = cv2.dnn.getAvailableTargets(backend_id)
+        if target_id not in available:
+            return f"target {target} not available for backend {backend}"
+    for net in (detector_net, encoder_net):
+        net.setPreferableBackend(backend_id)
+        net.setPreferableTarget(target_id)
+    cv2.setNumThreads(threads)
+    return None
+
+
+def bench_config(detector_net, encoder_net, frames, batch, iterations, warmup):
+    batches = itertools.cycle([frames[i:i + batch] for i in range(0, len(frames), batch)])
+
+    for _ in range(warmup): # Also absorbs backend re-initialisation after a switch
+        run_batch(detector_net, encoder_net, next(batches))
+
+    timings, detected, processed = {}, 0, 0
+    for _ in range(iterations):
+        frames_batch = next(batches)
+        detected += run_batch(detector_net, encoder_net, frames_batch, timings=timings)
+        processed += len(frames_batch)
+
+    memory = {}
+    tracemalloc.start()
+    try:
+        run_batch(detector_net, encoder_net, next(batches), memory=memory)
+    finally:
+        tracemalloc.stop()
+
+    return {
+        "frames_per_iteration": batch,
+        "faces_detected_per_frame": round(detected / processed, 3),
+        "stages": {name: _latency_summary(timings[name]) for name in STAGES},
+        "memory": {
+            "stage_peak_alloc_bytes": {name: max(memory[name]) for name in STAGES if name in memory},
+            "peak_rss_bytes": _peak_rss_bytes(),
+        },
+    }
+
+
+def _print_result(result):
+    label = f"{result['input']} {result['backend']}/{result['target']} threads={result['threads']}"
+    if "skipped" in result:
+        print(f"{label}: skipped ({result['skipped']})")
+        return
+    print(f"{label} (faces/frame {result['faces_detected_per_frame']}):")
+    for name in STAGES:
+        s = result["stages"][name]
+        peak = result["memory"]["stage_peak_alloc_bytes"].get(name)
+        peak = f"{peak / 1024:10.1f} KiB" if peak is not None else ""
+        print(f"  {name:<20} p50 {s['p50_ms']:9.3f}  p95 {s['p95_ms']:9.3f}  p99 {s['p99_ms']:9.3f} ms  {peak}")
+    peak_rss = result["memory"]["peak_rss_bytes"]
+    if peak_rss is not None:
+        print(f"  peak RSS {peak_rss / 2**20:.1f} MiB")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Per-stage latency/memory benchmark of the face pipeline.")
+    parser.add_argument("--images", help="directory of JPEG/PNG frames (default: synthetic frames)")
+    parser.add_argument("--resolutions", type=lambda v: _csv(v, _resolution),
+                        help="WxH list, e.g. 640x480,1920x1080; resizes --images, "
+                             "default for synthetic frames: 640x480,1280x720,1920x1080")
+    parser.add_argument("--synthetic-count", type=int, default=8, help="synthetic frames per resolution")
+    parser.add_argument("--backends", type=_csv, default=["opencv"], help=f"any of {', '.join(BACKENDS)}")
+    parser.add_argument("--targets", type=_csv, default=["cpu"], help=f"any of {', '.join(TARGETS)}")
+    parser.add_argument("--threads", type=lambda v: _csv(v, int), default=[cv2.getNumThreads()],
+                        help="cv2.setNumThreads values, e.g. 1,2,4")
+    parser.add_argument("--batch", type=int, default=1, help="frames per pipeline call")
+    parser.add_argument("--iterations", type=int, default=50)
+    parser.add_argument("--warmup", type=int, default=5)
+    parser.add_argument("--json", dest="json_path", help="write results as JSON to this path ('-' for stdout)")
+    args = parser.parse_args(argv)
+
+    for name in args.backends:
+        if name not in BACKENDS:
+            parser.error(f"unknown backend {name!r}")
+    for name in args.targets:
+        if name not in TARGETS:
+            parser.error(f"unknown target {name!r}")
+
+    inputs = []
+    if args.images:
+        for resolution in args.resolutions or [None]:
+            label = os.path.basename(os.path.normpath(args.images))
+            if resolution is not None:
+                label += f"@{resolution[0]}x{resolution[1]}"
+            inputs.append((label, load_image_dir(args.images, resolution)))
+    else:
+        for width, height in args.resolutions or [(640, 480), (1280, 720), (1920, 1080)]:
+            inputs.append((f"synthetic@{width}x{height}", synthetic_frames(width, height, args.synthetic_count)))
+    for label, frames in inputs:
+        if not frames:
+            parser.error(f"no readable images for {label}")
+
+    detector_net, encoder_net = face_pipeline.load_nets()
+    original_threads = cv2.getNumThreads()
+    results = []
+    try:
+        for backend, target, threads in itertools.product(args.backends, args.targets, args.threads):
+            skipped = _configure(detector_net, encoder_net, backend, target, threads)
+            for label, frames in inputs:
+                result = {"input": label, "backend": backend, "target": target, "threads": threads}
+                if skipped is None:
+                    try:
+                        result.update(bench_config(detector_net, encoder_net, frames,
+                                                   args.batch, args.iterations, args.warmup))
+                    except cv2.error as e:
+                        result["skipped"] = f"cv2.error: {e}"
+                else:
+                    result["skipped"] = skipped
+                results.append(result)
+                if args.json_path != "-":
+                    _print_result(result)
+    finally:
+        cv2.setNumThreads(original_threads)
+
+    if args.json_path:
+        report = {
+            "meta": {
+                "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+                "python": platform.python_version(),
+                "platform": platform.platform(),
+                "cpu_count": os.cpu_count(),
+                "opencv": cv2.__version__,
+                "numpy": np.__version__,
+                "batch": args.batch,
+                "iterations": args.iterations,
+                "warmup": args.warmup,
+            },
+            "results": results,
+        }
+        if args.json_path == "-":
+            json.dump(report, sys.stdout, indent=2)
+            print()
+        else:
+            with open(args.json_path, "w") as f:
+                json.dump(report, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,211 @@
+import abc
+import hashlib
+import io
+import os
+import tempfile
+import time
+import uuid
+
+# --- Content-Addressed Blob Store ---
+# Message payloads (AES files, stego PNGs) live outside SQLite so the
+# database only holds metadata. Blobs are named by their SHA-256, so
+# identical payloads are stored once.
+
+COPY_CHUNK_SIZE = 1024 * 1024
+
+
+class BlobStore(abc.ABC):
+    """
+    Interface for payload storage. `put_*` return (sha256_hex, size, key);
+    `key` is what the messages table stores in `storage_key`. A backend
+    missing any abstract method fails when it is instantiated.
+    """
+
+    @abc.abstractmethod
+    def put_fileobj(self, file_obj):
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def put_bytes(self, data):
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def put_path(self, path):
+        raise NotImplementedError
+
+    def local_path(self, key):
+        """Filesystem path of a blob (for FileResponse), or None."""
+        return None
+
+    @abc.abstractmethod
+    def open(self, key):
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def size(self, key):
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def delete(self, key):
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def delete_unreferenced(self, key, older_than, is_referenced):
+        """
+        Deletes `key` if it is older than `older_than` seconds and
+        `is_referenced()` is False, safely against concurrent `put_*` of
+        the same content. Returns True if the blob was deleted.
+        """
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def iter_keys(self, older_than=None):
+        raise NotImplementedError
+
+
+def _fsync_dir(path):
+    try:
+        fd = os.open(path, os.O_RDONLY)
+    except OSError:
+        return # e.g. Windows cannot open directories
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+class FileSystemBlobStore(BlobStore):
+    """
+    Stores blobs as files under `root/<aa>/<bb>/<sha256>`. Writes go to a
+    temp file which is fsynced and then atomically renamed into place, so
+    a blob is either complete or absent, never partial.
+
+    Pruning never unlinks a blob in place: the candidate is first renamed
+    into tmp/ (atomic, so a concurrent put either sees it gone and writes
+    its own copy, or has already refreshed its mtime), then its mtime and
+    references are re-checked and it is either unlinked or restored.
+    """
+
+    _PRUNE_SUFFIX = ".prune"
+
+    def __init__(self, root):
+        self.root = root
+        self._tmp_dir = os.path.join(root, "tmp")
+        os.makedirs(self._tmp_dir, exist_ok=True)
+        self._restore_interrupted_prunes()
+
+    def _restore_interrupted_prunes(self):
+        """Puts back prune candidates left in tmp/ by a crash mid-prune."""
+        for name in os.listdir(self._tmp_dir):
+            if not name.endswith(self._PRUNE_SUFFIX):
+                continue
+            key = name.split(".", 1)[0]
+            try:
+                self._restore(os.path.join(self._tmp_dir, name), key)
+            except (OSError, ValueError):
+                pass
+
+    def _restore(self, trash_path, key):
+        final_path = self._path(key)
+        if os.path.exists(final_path):
+            os.remove(trash_path) # A put stored the same content meanwhile
+        else:
+            os.makedirs(os.path.dirname(final_path), exist_ok=True)
+            os.replace(trash_path, final_path)
+
+    def _path(self, key):
+        if len(key) != 64 or not all(c in "0123456789abcdef" for c in key):
+            raise ValueError(f"Invalid blob key: {key!r}")
+        return os.path.join(self.root, key[:2], key[2:4], key)
+
+    def _commit(self, tmp_path, digest, size):
+        final_path = self._path(digest)
+        if os.path.exists(final_path):
+            # Same content already stored; refresh mtime before the caller
+            # references it, so delete_unreferenced keeps (or restores) it
+            try:
+                os.utime(final_path)
+                os.remove(tmp_path)
+                return digest, size, digest
+            except FileNotFoundError:
+                pass # Taken by a concurrent prune: store our copy instead
+        final_dir = os.path.dirname(final_path)
+        os.makedirs(final_dir, exist_ok=True)
+        os.replace(tmp_path, final_path)
+        _fsync_dir(final_dir)
+        return digest, size, digest
+
+    def put_fileobj(self, file_obj):
+        sha256 = hashlib.sha256()
+        size = 0
+        fd, tmp_path = tempfile.mkstemp(dir=self._tmp_dir)
+        try:
+            with os.fdopen(fd, "wb") as out:
+                while True:
+                    chunk = file_obj.read(COPY_CHUNK_SIZE)
+                    if not chunk:
+                        break
+                    sha256.update(chunk)
+                    out.write(chunk)
+                    size += len(chunk)
+                out.flush()
+                os.fsync(out.fileno())
+            return self._commit(tmp_path, sha256.hexdigest(), size)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+
+    def put_bytes(self, data):
+        return self.put_fileobj(io.BytesIO(data))
+
+    def put_path(self, path):
+        with open(path, "rb") as src:
+            return self.put_fileobj(src)
+
+    def local_path(self, key):
+        return self._path(key)
+
+    def open(self, key):
+        return open(self._path(key), "rb")
+
+    def size(self, key):
+        return os.path.getsize(self._path(key))
+
+    def delete(self, key):
+        try:
+            os.remove(self._path(key))
+        except FileNotFoundError:
+            pass
+
+    def delete_unreferenced(self, key, older_than, is_referenced):
+        final_path = self._path(key)
+        trash_path = os.path.join(
+            self._tmp_dir, f"{key}.{uuid.uuid4().hex}{self._PRUNE_SUFFIX}"
+        )
+        try:
+            os.rename(final_path, trash_path)
+        except FileNotFoundError:
+            return False
+        # Checked after the rename: a put that refreshed the mtime (and may
+        # be about to insert a reference) did so before the blob moved
+        cutoff = time.time() - older_than
+        if os.path.getmtime(trash_path) > cutoff or is_referenced():
+            self._restore(trash_path, key)
+            return False
+        os.remove(trash_path)
+        return True
+
+    def iter_keys(self, older_than=None):
+        """Yields stored keys, optionally only files older than `older_than` seconds."""
+        cutoff = time.time() - older_than if older_than is not None else None
+        for dirpath, dirnames, filenames in os.walk(self.root):
+            if os.path.abspath(dirpath) == os.path.abspath(self._tmp_dir):
+                dirnames[:] = []
+                continue
+            for name in filenames:
+                if len(name) != 64:
+                    continue
+                if cutoff is not None and os.path.getmtime(os.path.join(dirpath, name)) > cutoff:
+                    continue
+                yield name
@@ -1,114 +1,144 @@
 # client_face_auth.py
 import cv2
 import numpy as np
-import json
 import streamlit as st
-import io
+import os
+import threading
 
-# --- 1. DEFINISI DAN PEMUATAN MODEL OpenCV (DNN) ---
-# Pastikan file-file ini ada di dalam folder 'models'
-DETECTOR_PROTO = 'models/deploy.prototxt'
-DETECTOR_MODEL = 'models/res10_300x300_ssd_iter_140000.caffemodel'
-ENCODER_MODEL = 'models/openface.nn4.small2.v1.t7'
+import face_codec
+import face_pipeline
+import face_service
+
+# --- 1. PEMUATAN MODEL OpenCV (DNN) / FACE SERVICE ---
+# Jika FACE_SERVICE_ADDRESS diisi (mis. "127.0.0.1:8765"), inferensi dijalankan
+# oleh face_service.py (model dimuat sekali, di luar thread UI). Jika service
+# tidak bisa dihubungi atau sedang penuh, model lokal dipakai sebagai cadangan.
+# Kunci autentikasinya sama dengan milik service: FACE_SERVICE_AUTHKEY, atau
+# file kunci yang dibuat service (lihat face_service.load_authkey).
+FACE_SERVICE_ADDRESS = os.environ.get("FACE_SERVICE_ADDRESS")
+
+# Konstanta pipeline ada di face_pipeline.py
+MATCH_THRESHOLD = face_pipeline.MATCH_THRESHOLD
 
 @st.cache_resource
 def load_models():
     """Memuat model DNN menggunakan cache Streamlit."""
     print("Loading DNN models...")
     try:
-        detector_net = cv2.dnn.readNetFromCaffe(DETECTOR_PROTO, DETECTOR_MODEL)
-        encoder_net = cv2.dnn.readNetFromTorch(ENCODER_MODEL)
-        return detector_net, encoder_net
+        return face_pipeline.load_nets()
     except cv2.error as e:
         st.error(f"Error: Gagal memuat model DNN. Pastikan file model ada di folder 'models'. Error: {e}")
         return None, None
 
+# Satu koneksi ke service per thread script Streamlit (per sesi)
+_service_clients = threading.local()
+
+def _face_service_client():
+    client = getattr(_service_clients, 'client', None)
+    if client is None:
+        client = face_service.FaceServiceClient(FACE_SERVICE_ADDRESS)
+        _service_clients.client = client
+    return client
+
+# --- 2. ENCODING (BANYAK FRAME SEKALIGUS) ---
+
+def _session_tracker():
+    """
+    FaceTracker per sesi Streamlit: posisi wajah dari foto sebelumnya,
+    sehingga foto berikutnya cukup dideteksi di sekitar posisi itu.
+    """
+    if 'face_tracker' not in st.session_state:
+        st.session_state['face_tracker'] = face_pipeline.FaceTracker()
+    return st.session_state['face_tracker']
+
+def _read_frame(image_file):
+    """Objek file (BytesIO, st.camera_input) -> bytes gambar."""
+    if hasattr(image_file, 'seek'):
+        image_file.seek(0) # Pastikan file pointer di awal
+    return image_file.read()
+
+def get_face_encodings(image_files):
+    """
+    Mendapatkan encoding wajah dari beberapa frame sekaligus.
+    Mengembalikan (encodings, qualities, pesan): encodings berbentuk (k, 128)
+    untuk frame yang berisi wajah layak, diurutkan dari kualitas terbaik
+    (confidence deteksi x ketajaman). encodings None jika tidak ada.
+    """
+    try:
+        frames = [_read_frame(image_file) for image_file in image_files]
+        tracker = _session_tracker()
+
+        if FACE_SERVICE_ADDRESS:
+            try:
+                return _face_service_client().encode(frames, tracker)
+            except (OSError, EOFError, face_service.FaceServiceBusy) as e:
+                print(f"Face service tidak tersedia ({e}), memakai model lokal.")
+
+        detector_net, encoder_net = load_models()
+        if detector_net is None or encoder_net is None:
+            print("Model DNN tidak dimuat.")
+            return None, [], "Model DNN tidak dimuat."
+        return face_pipeline.encode_frames(detector_net, encoder_net, frames, tracker)
+
+    except Exception as e:
+        print(f"Error saat memproses gambar OpenCV: {e}")
+        return None, [], f"Error internal: {e}"
+
+def get_enrollment_template(image_files):
+    """
+    Template registrasi dari beberapa frame: rata-rata encoding dari frame
+    yang mirip dengan frame terbaik (lihat face_pipeline.enrollment_template).
+    """
+    encodings, qualities, message = get_face_encodings(image_files)
+    if encodings is None:
+        return None, message
+    template, used = face_pipeline.enrollment_template(encodings)
+    return template, f"Template dari {used} frame."
+
 def get_face_encoding(image_file):
     """
     Mendapatkan encoding wajah (vektor 128-dimensi) dari file gambar
     menggunakan OpenCV DNN.
     `image_file` adalah objek seperti file (mis: BytesIO, st.camera_input).
     """
-    detector_net, encoder_net = load_models()
-    if detector_net is None or encoder_net is None:
-        print("Model DNN tidak dimuat.")
-        return None, "Model DNN tidak dimuat."
-    
-    try:
-        # Baca gambar dari memory (dari st.camera_input)
-        file_bytes = np.asarray(bytearray(image_file.read()), dtype=np.uint8)
-        image = cv2.imdecode(file_bytes, cv2.IMREAD_COLOR)
-        if image is None:
-            return None, "Gagal membaca format gambar."
-            
-        (h, w) = image.shape[:2]
-        
-        # 1. Deteksi Wajah
-        blob = cv2.dnn.blobFromImage(cv2.resize(image, (300, 300)), 1.0,
-                                     (300, 300), (104.0, 177.0, 123.0),
-                                     swapRB=False, crop=False)
-        
-        detector_net.setInput(blob)
-        detections = detector_net.forward()
-        if len(detections) == 0:
-            return None, "Tidak ada wajah yang terdeteksi."
-            
-        best_detection_index = np.argmax(detections[0, 0, :, 2])
-        confidence = detections[0, 0, best_detection_index, 2]
-        
-        if confidence < 0.7: # Threshold kepercayaan
-            return None, "Wajah tidak cukup jelas."
-            
-        box = detections[0, 0, best_detection_index, 3:7] * np.array([w, h, w, h])
-        (startX, startY, endX, endY) = box.astype("int")
-        face = image[startY:endY, startX:endX]
-        
-        if face.shape[0] < 20 or face.shape[1] < 20:
-            return None, "Wajah yang terdeteksi terlalu kecil."
-            
-        # 2. Enkoding Wajah
-        face_blob = cv2.dnn.blobFromImage(face, 1.0 / 255, (96, 96),
-                                         (0, 0, 0), swapRB=True, crop=True)
-        
-        encoder_net.setInput(face_blob)
-        encoding = encoder_net.forward()
-        return encoding.flatten(), "Encoding berhasil." # Flatten menjadi 1D vector
-        
-    except Exception as e:
-        print(f"Error saat memproses gambar OpenCV: {e}")
-        return None, f"Error internal: {e}"
+    encodings, _, message = get_face_encodings([image_file])
+    if encodings is None:
+        return None, message
+    return encodings[0], message # Sudah berupa 1D vector
+
+# --- 3. VERIFIKASI ---
 
-def compare_faces(known_encoding_json, new_image_file):
+def compare_faces_multi(known_encoding, image_files):
     """
-    Membandingkan wajah baru dengan encoding yang tersimpan (JSON string).
+    Membandingkan beberapa frame baru dengan encoding yang tersimpan
+    (bytes/base64 format face_codec, atau JSON string lama); yang dipakai
+    adalah kecocokan terbaik di antara frame.
     Semua proses terjadi di client.
     """
     try:
-        known_encoding = np.array(json.loads(known_encoding_json))
-        
-        # Pastikan file pointer di awal
-        new_image_file.seek(0)
-        new_encoding, message = get_face_encoding(new_image_file)
-        
-        if new_encoding is not None:
-            dot_product = np.dot(known_encoding, new_encoding)
-            norm_known = np.linalg.norm(known_encoding)
-            norm_new = np.linalg.norm(new_encoding)
-            
-            if norm_known == 0 or norm_new == 0:
-                return False, "Error normalisasi encoding."
-                
-            cosine_similarity = dot_product / (norm_known * norm_new)
-            threshold = 0.80 
-            print(f"Cosine Similarity: {cosine_similarity}")
-            
-            if cosine_similarity > threshold:
-                return True, "Wajah cocok."
-            else:
-                return False, "Wajah tidak cocok."
+        known_encoding = face_codec.load_any(known_encoding)
+        if np.linalg.norm(known_encoding) == 0:
+            return False, "Error normalisasi encoding."
+
+        new_encodings, _, message = get_face_encodings(image_files)
+        if new_encodings is None:
+            return False, message # Kembalikan pesan error dari get_face_encodings
+
+        cosine_similarity = face_pipeline.best_similarity(known_encoding, new_encodings)
+        print(f"Cosine Similarity: {cosine_similarity}")
+
+        if cosine_similarity > MATCH_THRESHOLD:
+            return True, "Wajah cocok."
         else:
-            return False, message # Kembalikan pesan error dari get_face_encoding
-            
+            return False, "Wajah tidak cocok."
+
     except Exception as e:
         print(f"Error saat membandingkan wajah: {e}")
-        return False, f"Error perbandingan: {e}"
\ No newline at end of file
+        return False, f"Error perbandingan: {e}"
+
+def compare_faces(known_encoding, new_image_file):
+    """
+    Membandingkan wajah baru dengan encoding yang tersimpan.
+    Semua proses terjadi di client.
+    """
+    return compare_faces_multi(known_encoding, [new_image_file])
@@ -1,12 +1,24 @@
 import bcrypt
 import base64
+import functools
+import hashlib
+import hmac
 import io
+import itertools
+import numpy as np
 from PIL import Image
 from cryptography.hazmat.primitives.ciphers import Cipher, algorithms, modes
+from cryptography.hazmat.primitives.ciphers.aead import AESGCM
 from cryptography.hazmat.primitives.kdf.pbkdf2 import PBKDF2HMAC
 from cryptography.hazmat.primitives import hashes, padding
 from cryptography.hazmat.backends import default_backend
 import os
+import string
+import struct
+import threading
+import time
+import zlib
+from collections import OrderedDict
 
 # --- 1. Login (Bcrypt Hashing) ---
 
@@ -22,20 +34,29 @@ def verify_password_bcrypt(password, stored_hash):
     except ValueError:
         return False
 
+@functools.lru_cache(maxsize=1)
+def dummy_bcrypt_hash():
+    """
+    Hash bcrypt acak (dibuat sekali) dengan cost yang sama seperti hash
+    asli, untuk mengkalibrasi/menyamakan waktu verifikasi.
+    """
+    return hash_password_bcrypt(base64.b64encode(os.urandom(16)).decode('ascii'))
+
 # --- 2. Super Enkripsi Teks (Caesar + XOR) ---
 
+@functools.lru_cache(maxsize=26)
+def _caesar_table(shift):
+    """Tabel translasi Caesar untuk pergeseran 0-25 (dibuat sekali per shift)."""
+    lower = string.ascii_lowercase
+    upper = string.ascii_uppercase
+    return str.maketrans(
+        lower + upper,
+        lower[shift:] + lower[:shift] + upper[shift:] + upper[:shift]
+    )
+
 def encrypt_caesar(text, shift):
     """Enkripsi menggunakan Caesar Cipher (hanya huruf alfabet)."""
-    result = ""
-    for char in text:
-        if 'a' <= char <= 'z':
-            shifted_char = chr(((ord(char) - ord('a') + shift) % 26) + ord('a'))
-        elif 'A' <= char <= 'Z':
-            shifted_char = chr(((ord(char) - ord('A') + shift) % 26) + ord('A'))
-        else:
-            shifted_char = char
-        result += shifted_char
-    return result
+    return text.translate(_caesar_table(shift % 26))
 
 def decrypt_caesar(text, shift):
     """Dekripsi Caesar Cipher."""
@@ -44,14 +65,15 @@ def decrypt_caesar(text, shift):
 def encrypt_decrypt_xor(data_bytes, key):
     """Enkripsi/Dekripsi menggunakan XOR Cipher pada data biner."""
     key_bytes = key.encode('utf-8')
-    key_len = len(key_bytes)
-    output_bytes = bytearray()
+    if len(data_bytes) == 0:
+        return b''
+    if len(key_bytes) == 0:
+        raise ValueError("Kunci XOR tidak boleh kosong.")
     
-    for i in range(len(data_bytes)):
-        xor_byte = data_bytes[i] ^ key_bytes[i % key_len]
-        output_bytes.append(xor_byte)
-        
-    return bytes(output_bytes) # Kembalikan sebagai immutable bytes
+    # Kunci diulang sebagai satu blok sepanjang data, lalu di-XOR sekaligus
+    data = np.frombuffer(data_bytes, dtype=np.uint8)
+    keystream = np.resize(np.frombuffer(key_bytes, dtype=np.uint8), data.size)
+    return np.bitwise_xor(data, keystream).tobytes() # Kembalikan sebagai immutable bytes
 
 def super_encrypt_text(plaintext, caesar_shift, xor_key):
     """Super Enkripsi: Caesar -> XOR -> Base64."""
@@ -64,18 +86,21 @@ def super_encrypt_text(plaintext, caesar_shift, xor_key):
     # 3. Encode ke Base64 (Bytes -> String) untuk ditampilkan
     return base64.b64encode(xor_ciphertext_bytes).decode('utf-8')
 
+def super_decrypt_text_strict(base64_ciphertext, caesar_shift, xor_key):
+    """Super Dekripsi: Base64 -> XOR -> Caesar. Melempar error jika gagal."""
+    # 1. Decode dari Base64 (String -> Bytes)
+    xor_ciphertext_bytes = base64.b64decode(base64_ciphertext.encode('utf-8'))
+    
+    # 2. Dekripsi XOR (Bytes -> Bytes)
+    caesar_ciphertext_bytes = encrypt_decrypt_xor(xor_ciphertext_bytes, xor_key)
+    
+    # 3. Dekripsi Caesar (Bytes -> String)
+    return decrypt_caesar(caesar_ciphertext_bytes.decode('utf-8'), caesar_shift)
+
 def super_decrypt_text(base64_ciphertext, caesar_shift, xor_key):
     """Super Dekripsi: Base64 -> XOR -> Caesar."""
     try:
-        # 1. Decode dari Base64 (String -> Bytes)
-        xor_ciphertext_bytes = base64.b64decode(base64_ciphertext.encode('utf-8'))
-        
-        # 2. Dekripsi XOR (Bytes -> Bytes)
-        caesar_ciphertext_bytes = encrypt_decrypt_xor(xor_ciphertext_bytes, xor_key)
-        
-        # 3. Dekripsi Caesar (Bytes -> String)
-        plaintext = decrypt_caesar(caesar_ciphertext_bytes.decode('utf-8'), caesar_shift)
-        return plaintext
+        return super_decrypt_text_strict(base64_ciphertext, caesar_shift, xor_key)
     except Exception as e:
         print(f"Error dekripsi: {e}")
         return "DEKRIPSI GAGAL: Kunci atau format data salah."
@@ -99,40 +124,149 @@ def binary_to_text(binary_stream):
                 pass # Abaikan jika ada sisa bit yang tidak lengkap
     return text
 
-def stego_hide_message(image_bytes, secret_message):
-    """Menyembunyikan pesan rahasia di dalam gambar menggunakan LSB."""
+# Format header stego versi 2: magic (4 byte) + versi (1 byte) + mode
+# (1 byte) + panjang payload dalam byte (4 byte, big-endian). Payload adalah
+# pesan dalam UTF-8.
+# Header selalu ditulis 1 bit per kanal di R, G, B dari STEGO_HEADER_PIXELS
+# piksel pertama. Payload dimulai di piksel sesudahnya dengan mode yang
+# tercatat di header: 1-4 bit per kanal (bit 0-2), opsional termasuk kanal
+# alpha (bit 4).
+# Versi 1 (tanpa byte mode, payload langsung setelah header 1 bit per kanal
+# RGB) dan format lama '::EOF::' tetap bisa diekstrak.
+STEGO_MAGIC = b'AESG'
+STEGO_VERSION = 2
+STEGO_MAX_BITS_PER_CHANNEL = 4
+_STEGO_PREFIX = struct.Struct('>4sB')
+_STEGO_HEADER_V1 = struct.Struct('>4sBI')
+_STEGO_HEADER = struct.Struct('>4sBBI')
+_STEGO_MODE_ALPHA = 0x10
+STEGO_HEADER_PIXELS = -(-_STEGO_HEADER.size * 8 // 3)
+
+# Delimiter format lama (sebelum ada header), masih didukung saat ekstraksi
+LEGACY_STEGO_DELIMITER = "::EOF::"
+_LEGACY_SCAN_CHUNK_BITS = 1 << 20
+
+# Header PNG: signature (8) + chunk IHDR (panjang 4 + tipe 4 + data 13 + CRC 4)
+PNG_SIGNATURE = b'\x89PNG\r\n\x1a\n'
+PNG_HEADER_SIZE = 33
+_PNG_IHDR = struct.Struct('>I4sIIBBBBB')
+
+def png_read_ihdr(header_bytes):
+    """
+    Membaca dimensi dan mode gambar dari 33 byte pertama file PNG (IHDR)
+    tanpa men-decode piksel apa pun.
+    """
+    if len(header_bytes) < PNG_HEADER_SIZE or header_bytes[:8] != PNG_SIGNATURE:
+        raise ValueError("Bukan file PNG yang valid.")
+    (length, chunk_type, width, height, bit_depth, color_type,
+     _, _, _) = _PNG_IHDR.unpack(header_bytes[8:PNG_HEADER_SIZE - 4])
+    if length != 13 or chunk_type != b'IHDR':
+        raise ValueError("Header PNG (IHDR) rusak.")
+    crc = struct.unpack('>I', header_bytes[PNG_HEADER_SIZE - 4:PNG_HEADER_SIZE])[0]
+    if zlib.crc32(header_bytes[12:PNG_HEADER_SIZE - 4]) != crc:
+        raise ValueError("Header PNG (IHDR) rusak.")
+    if width == 0 or height == 0:
+        raise ValueError("Dimensi gambar tidak valid.")
+    return {
+        "width": width,
+        "height": height,
+        "bit_depth": bit_depth,
+        "color_type": color_type,
+        # 4 = grayscale + alpha, 6 = RGBA
+        "has_alpha": color_type in (4, 6),
+    }
+
+def _stego_mode_byte(bits_per_channel, use_alpha):
+    if not 1 <= bits_per_channel <= STEGO_MAX_BITS_PER_CHANNEL:
+        raise ValueError(f"Bit per kanal harus 1-{STEGO_MAX_BITS_PER_CHANNEL}.")
+    return bits_per_channel | (_STEGO_MODE_ALPHA if use_alpha else 0)
+
+def stego_capacity(width, height, bits_per_channel=1, use_alpha=False):
+    """Jumlah byte pesan (UTF-8) yang muat di gambar berukuran width x height."""
+    _stego_mode_byte(bits_per_channel, use_alpha)
+    payload_pixels = max(0, width * height - STEGO_HEADER_PIXELS)
+    channels = 4 if use_alpha else 3
+    return min(payload_pixels * channels * bits_per_channel // 8, 0xFFFFFFFF)
+
+def stego_capacity_table(width, height):
+    """Kapasitas untuk setiap mode (1-4 bit per kanal, dengan/tanpa alpha)."""
+    return [
+        {
+            "bits_per_channel": bits_per_channel,
+            "use_alpha": use_alpha,
+            "capacity_bytes": stego_capacity(width, height, bits_per_channel, use_alpha),
+        }
+        for use_alpha in (False, True)
+        for bits_per_channel in range(1, STEGO_MAX_BITS_PER_CHANNEL + 1)
+    ]
+
+def _lsb_embed_bits(channels, bits, bits_per_channel=1):
+    """
+    Menulis `bits` ke `bits_per_channel` bit terbawah dari array kanal
+    `channels` (1D, uint8) secara in-place. Hanya prefix yang dibutuhkan
+    yang disentuh.
+    """
+    n_values = -(-bits.size // bits_per_channel)
+    if n_values > channels.size:
+        raise ValueError("Gambar terlalu kecil untuk menyembunyikan pesan ini.")
+    
+    if bits_per_channel == 1:
+        values = bits
+    else:
+        # Kelompokkan bit per `bits_per_channel` (MSB dulu) menjadi satu nilai
+        padded = np.zeros(n_values * bits_per_channel, dtype=np.uint8)
+        padded[:bits.size] = bits
+        weights = 1 << np.arange(bits_per_channel - 1, -1, -1, dtype=np.uint8)
+        values = (padded.reshape(-1, bits_per_channel) * weights).sum(axis=1, dtype=np.uint8)
+    
+    prefix = channels[:n_values]
+    np.bitwise_and(prefix, 0xFF ^ ((1 << bits_per_channel) - 1), out=prefix)
+    np.bitwise_or(prefix, values, out=prefix)
+
+def _lsb_read_bytes(channels, n_bytes, bits_per_channel=1):
+    """Membaca `n_bytes` byte dari bit terbawah kanal-kanal awal `channels`."""
+    n_bits = n_bytes * 8
+    n_values = -(-n_bits // bits_per_channel)
+    if n_values > channels.size:
+        return None
+    values = channels[:n_values] & ((1 << bits_per_channel) - 1)
+    if bits_per_channel == 1:
+        bits = values
+    else:
+        shifts = np.arange(bits_per_channel - 1, -1, -1, dtype=np.uint8)
+        bits = ((values[:, None] >> shifts) & 1).reshape(-1)[:n_bits]
+    return np.packbits(bits).tobytes()
+
+def stego_hide_message(image_bytes, secret_message, bits_per_channel=1, use_alpha=False):
+    """
+    Menyembunyikan pesan rahasia di dalam gambar menggunakan LSB.
+    `bits_per_channel` (1-4) dan `use_alpha` menentukan kapasitas per piksel.
+    """
     try:
-        img = Image.open(io.BytesIO(image_bytes)).convert('RGB')
+        mode = _stego_mode_byte(bits_per_channel, use_alpha)
+        img = Image.open(io.BytesIO(image_bytes)).convert('RGBA' if use_alpha else 'RGB')
         
-        # Tambahkan delimiter unik untuk menandai akhir pesan
-        secret_message += "::EOF::"
-        secret_binary = text_to_binary(secret_message)
+        # Header berisi mode dan panjang payload, jadi ekstraksi tahu persis
+        # berapa bit yang harus dibaca (tanpa delimiter)
+        payload = secret_message.encode('utf-8')
+        header = _STEGO_HEADER.pack(STEGO_MAGIC, STEGO_VERSION, mode, len(payload))
         
-        data_index = 0
-        img_data = list(img.getdata())
-        new_img_data = []
-
-        for pixel in img_data:
-            if data_index < len(secret_binary):
-                new_pixel = []
-                # Ubah LSB dari R, G, B
-                for i in range(3): # R, G, B
-                    if data_index < len(secret_binary):
-                        # Ubah LSB piksel
-                        new_val = (pixel[i] & 0xFE) | int(secret_binary[data_index])
-                        new_pixel.append(new_val)
-                        data_index += 1
-                    else:
-                        new_pixel.append(pixel[i])
-                new_img_data.append(tuple(new_pixel))
-            else:
-                new_img_data.append(pixel) # Salin piksel asli jika pesan sudah selesai
-
-        if data_index < len(secret_binary):
+        # Seluruh piksel sebagai satu buffer uint8, satu baris per piksel
+        pixels = np.array(img, dtype=np.uint8)
+        pixels = pixels.reshape(-1, pixels.shape[-1])
+        if pixels.shape[0] < STEGO_HEADER_PIXELS:
             raise ValueError("Gambar terlalu kecil untuk menyembunyikan pesan ini.")
-            
-        new_img = Image.new(img.mode, img.size)
-        new_img.putdata(new_img_data)
+        
+        # 1. Header: 1 bit per kanal R, G, B
+        header_channels = pixels[:STEGO_HEADER_PIXELS, :3].reshape(-1)
+        _lsb_embed_bits(header_channels, np.unpackbits(np.frombuffer(header, dtype=np.uint8)))
+        pixels[:STEGO_HEADER_PIXELS, :3] = header_channels.reshape(-1, 3)
+        
+        # 2. Payload: sesuai mode, mulai setelah piksel header
+        payload_bits = np.unpackbits(np.frombuffer(payload, dtype=np.uint8))
+        _lsb_embed_bits(pixels[STEGO_HEADER_PIXELS:].reshape(-1), payload_bits, bits_per_channel)
+        
+        new_img = Image.fromarray(pixels.reshape(img.height, img.width, -1))
         
         # Simpan gambar baru ke memory
         output_buffer = io.BytesIO()
@@ -143,90 +277,398 @@ def stego_hide_message(image_bytes, secret_message):
         raise ValueError(f"Error steganografi: {e}")
 
 
+def _stego_extract_legacy(channels):
+    """
+    Ekstraksi format lama (pesan diakhiri '::EOF::'). Bit LSB dibaca per
+    blok dan delimiter dicari secara linear, berhenti di kemunculan pertama.
+    """
+    delimiter_binary = text_to_binary(LEGACY_STEGO_DELIMITER).encode('ascii')
+    overlap = len(delimiter_binary) - 1
+    binary_stream = bytearray()
+    
+    for start in range(0, channels.size, _LEGACY_SCAN_CHUNK_BITS):
+        chunk = channels[start:start + _LEGACY_SCAN_CHUNK_BITS]
+        search_from = max(0, len(binary_stream) - overlap)
+        binary_stream += ((chunk & 1) + ord('0')).astype(np.uint8).tobytes()
+        
+        position = binary_stream.find(delimiter_binary, search_from)
+        if position != -1:
+            # Hapus delimiter dari hasil
+            return binary_to_text(binary_stream[:position].decode('ascii'))
+    
+    return "Pesan tidak ditemukan atau delimiter rusak."
+
 def stego_extract_message(stego_image_bytes):
     """Mengekstrak pesan rahasia dari gambar stego (LSB)."""
     try:
-        img = Image.open(io.BytesIO(stego_image_bytes)).convert('RGB')
-        binary_stream = ""
-        delimiter = "::EOF::"
-        delimiter_binary = text_to_binary(delimiter)
+        img = Image.open(io.BytesIO(stego_image_bytes))
+        if img.mode != 'RGBA':
+            img = img.convert('RGB')
+        pixels = np.asarray(img, dtype=np.uint8)
+        pixels = pixels.reshape(-1, pixels.shape[-1])
+        has_alpha = pixels.shape[1] == 4
         
-        img_data = img.getdata()
-
-        for pixel in img_data:
-            for i in range(3): # R, G, B
-                # Baca LSB (bit terakhir)
-                binary_stream += str(pixel[i] & 1)
+        # 1. Coba format dengan header (versi 2, lalu versi 1)
+        header_channels = pixels[:STEGO_HEADER_PIXELS, :3].reshape(-1)
+        prefix = _lsb_read_bytes(header_channels, _STEGO_PREFIX.size)
+        if prefix is not None:
+            magic, version = _STEGO_PREFIX.unpack(prefix)
+            if magic == STEGO_MAGIC and version == STEGO_VERSION:
+                header = _lsb_read_bytes(header_channels, _STEGO_HEADER.size)
+                if header is None:
+                    return "Pesan tidak ditemukan atau header rusak."
+                _, _, mode, length = _STEGO_HEADER.unpack(header)
+                bits_per_channel = mode & 0x07
+                use_alpha = bool(mode & _STEGO_MODE_ALPHA)
+                if not 1 <= bits_per_channel <= STEGO_MAX_BITS_PER_CHANNEL or (use_alpha and not has_alpha):
+                    return "Pesan tidak ditemukan atau header rusak."
                 
-                # Cek jika delimiter ditemukan
-                if binary_stream.endswith(delimiter_binary):
-                    # Hapus delimiter dari hasil
-                    message_binary = binary_stream[:-len(delimiter_binary)]
-                    return binary_to_text(message_binary)
+                payload_pixels = pixels[STEGO_HEADER_PIXELS:]
+                if has_alpha and not use_alpha:
+                    payload_pixels = payload_pixels[:, :3]
+                payload = _lsb_read_bytes(payload_pixels.reshape(-1), length, bits_per_channel)
+                if payload is None:
+                    return "Pesan tidak ditemukan atau header rusak."
+                return payload.decode('utf-8', errors='replace')
         
-        return "Pesan tidak ditemukan atau delimiter rusak."
+        # Format versi 1 dan format lama hanya memakai kanal R, G, B
+        rgb_channels = pixels[:, :3].reshape(-1) if has_alpha else pixels.reshape(-1)
+        if prefix is not None and prefix == _STEGO_PREFIX.pack(STEGO_MAGIC, 1):
+            header = _lsb_read_bytes(rgb_channels, _STEGO_HEADER_V1.size)
+            length = _STEGO_HEADER_V1.unpack(header)[2]
+            payload = _lsb_read_bytes(rgb_channels[_STEGO_HEADER_V1.size * 8:], length)
+            if payload is None:
+                return "Pesan tidak ditemukan atau header rusak."
+            return payload.decode('utf-8', errors='replace')
+        
+        # 2. Fallback ke format lama dengan delimiter '::EOF::'
+        return _stego_extract_legacy(rgb_channels)
     except Exception as e:
         return f"Error ekstraksi: {e}"
 
 
 # --- 4. Enkripsi File (AES) ---
 
-def get_aes_key_from_password(password_str, salt):
+AES_KDF_ITERATIONS = 100000
+
+class DerivedKeyCache:
+    """
+    Cache LRU (dengan TTL) untuk kunci AES hasil PBKDF2, agar dekripsi
+    berulang dengan password dan salt yang sama tidak menjalankan KDF lagi.
+    Kunci cache adalah HMAC dari (password, salt, iterasi) dengan secret
+    acak per proses, jadi password asli tidak pernah disimpan.
+    """
+
+    def __init__(self, max_entries=128, ttl_seconds=300):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self._entries = OrderedDict() # cache_id -> (bytearray kunci, waktu kedaluwarsa)
+        self._lock = threading.Lock()
+        self._hmac_secret = os.urandom(32)
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def _cache_id(self, password_bytes, salt, iterations):
+        mac = hmac.new(self._hmac_secret, digestmod=hashlib.sha256)
+        for part in (password_bytes, bytes(salt), iterations.to_bytes(4, 'big')):
+            mac.update(len(part).to_bytes(4, 'big'))
+            mac.update(part)
+        return mac.digest()
+
+    @staticmethod
+    def _zeroize(key_buffer):
+        for i in range(len(key_buffer)):
+            key_buffer[i] = 0
+
+    def _drop(self, cache_id):
+        key_buffer, _ = self._entries.pop(cache_id)
+        self._zeroize(key_buffer)
+        self.evictions += 1
+
+    def _sweep_expired(self, now):
+        for cache_id, (_, expires_at) in list(self._entries.items()):
+            if expires_at <= now:
+                self._drop(cache_id)
+
+    def get_or_derive(self, password_bytes, salt, iterations, derive):
+        """Mengembalikan kunci dari cache, atau memanggil `derive()` jika belum ada."""
+        cache_id = self._cache_id(password_bytes, salt, iterations)
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(cache_id)
+            if entry is not None:
+                if entry[1] > now:
+                    self._entries.move_to_end(cache_id)
+                    self.hits += 1
+                    return bytes(entry[0])
+                self._drop(cache_id)
+            self.misses += 1
+        
+        # KDF dijalankan di luar lock supaya thread lain tidak ikut menunggu
+        key = derive()
+        with self._lock:
+            self._sweep_expired(now)
+            if cache_id in self._entries:
+                self._drop(cache_id)
+            self._entries[cache_id] = (bytearray(key), now + self.ttl_seconds)
+            while len(self._entries) > self.max_entries:
+                self._drop(next(iter(self._entries)))
+        return key
+
+    def purge(self):
+        """Menghapus (dan menimpa dengan nol) semua kunci di cache."""
+        with self._lock:
+            for cache_id in list(self._entries):
+                self._drop(cache_id)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+                "ttl_seconds": self.ttl_seconds,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+            }
+
+# Cache kunci bersifat opt-in (None = nonaktif), lihat enable_key_cache()
+_key_cache = None
+
+def enable_key_cache(max_entries=128, ttl_seconds=300):
+    """Mengaktifkan cache kunci PBKDF2 di proses ini."""
+    global _key_cache
+    disable_key_cache()
+    _key_cache = DerivedKeyCache(max_entries, ttl_seconds)
+    return _key_cache
+
+def disable_key_cache():
+    """Menonaktifkan cache kunci dan menghapus semua isinya."""
+    global _key_cache
+    if _key_cache is not None:
+        _key_cache.purge()
+    _key_cache = None
+
+def purge_key_cache():
+    """Menghapus semua kunci di cache tanpa menonaktifkannya."""
+    if _key_cache is not None:
+        _key_cache.purge()
+
+def key_cache_stats():
+    """Statistik cache kunci (None jika cache nonaktif)."""
+    if _key_cache is None:
+        return None
+    return _key_cache.stats()
+
+def get_aes_key_from_password(password_str, salt, iterations=AES_KDF_ITERATIONS):
     """Membuat kunci AES 32-byte dari password menggunakan PBKDF2."""
-    kdf = PBKDF2HMAC(
-        algorithm=hashes.SHA256(),
-        length=32,
-        salt=salt,
-        iterations=100000,
-        backend=default_backend()
+    password_bytes = password_str.encode('utf-8')
+    
+    def derive():
+        kdf = PBKDF2HMAC(
+            algorithm=hashes.SHA256(),
+            length=32,
+            salt=salt,
+            iterations=iterations,
+            backend=default_backend()
+        )
+        return kdf.derive(password_bytes)
+    
+    cache = _key_cache
+    if cache is None:
+        return derive()
+    return cache.get_or_derive(password_bytes, salt, iterations, derive)
+
+# Format kontainer AES streaming (versi 1):
+#   header = magic (4) + versi (1) + ukuran frame (4, big-endian)
+#            + salt (16) + prefix nonce (7)
+#   lalu frame-frame: ciphertext (<= ukuran frame) + tag GCM (16)
+# Nonce tiap frame = prefix (7) + nomor frame (4) + flag frame terakhir (1),
+# dan seluruh header ikut diautentikasi (AAD) di setiap frame. Dengan begitu
+# urutan frame, pemotongan, dan penambahan frame setelah frame terakhir
+# semuanya terdeteksi saat dekripsi.
+AES_STREAM_MAGIC = b'AESF'
+AES_STREAM_VERSION = 1
+AES_STREAM_FRAME_SIZE = 64 * 1024
+AES_STREAM_MAX_FRAME_SIZE = 16 * 1024 * 1024
+_AES_STREAM_HEADER = struct.Struct('>4sBI16s7s')
+_AES_FRAME_NONCE = struct.Struct('>7sIB')
+_AES_TAG_SIZE = 16
+
+# Format lama (single-shot): salt (16) + nonce (12) + tag (16) + ciphertext
+_AES_LEGACY_OVERHEAD = 16 + 12 + 16
+
+def iter_fileobj(file_obj, chunk_size=AES_STREAM_FRAME_SIZE):
+    """Membaca objek file per potongan sampai habis."""
+    while True:
+        chunk = file_obj.read(chunk_size)
+        if not chunk:
+            break
+        yield chunk
+
+class AESStreamHeaderError(ValueError):
+    """Header kontainer AES tidak bisa dibaca (terpotong, versi/ukuran frame salah)."""
+
+def _aes_frame_nonce(nonce_prefix, frame_index, is_last):
+    if frame_index > 0xFFFFFFFF:
+        raise ValueError("File terlalu besar untuk ukuran frame ini.")
+    return _AES_FRAME_NONCE.pack(nonce_prefix, frame_index, 1 if is_last else 0)
+
+def aes_encrypt_stream(chunks, password, frame_size=AES_STREAM_FRAME_SIZE):
+    """
+    Enkripsi streaming AES-256-GCM. `chunks` adalah iterable berisi bytes,
+    hasilnya generator bytes (header lalu frame-frame terenkripsi).
+    Memori yang dipakai hanya sebesar satu frame, berapa pun ukuran file.
+    """
+    if not 0 < frame_size <= AES_STREAM_MAX_FRAME_SIZE:
+        raise ValueError("Ukuran frame tidak valid.")
+    
+    # 1. Hasilkan Salt (untuk KDF) dan prefix Nonce (untuk tiap frame)
+    salt = os.urandom(16)
+    nonce_prefix = os.urandom(7)
+    header = _AES_STREAM_HEADER.pack(
+        AES_STREAM_MAGIC, AES_STREAM_VERSION, frame_size, salt, nonce_prefix
     )
-    return kdf.derive(password_str.encode('utf-8'))
+    
+    # 2. Buat Kunci dari Password
+    aesgcm = AESGCM(get_aes_key_from_password(password, salt))
+    yield header
+    
+    # 3. Enkripsi per frame. Frame hanya dikirim jika sudah pasti ada data
+    # sesudahnya, sehingga frame terakhir selalu diberi flag yang benar.
+    buffer = bytearray()
+    frame_index = 0
+    for chunk in chunks:
+        buffer += chunk
+        while len(buffer) > frame_size:
+            nonce = _aes_frame_nonce(nonce_prefix, frame_index, False)
+            yield aesgcm.encrypt(nonce, bytes(buffer[:frame_size]), header)
+            del buffer[:frame_size]
+            frame_index += 1
+    
+    # 4. Frame terakhir (boleh kosong)
+    nonce = _aes_frame_nonce(nonce_prefix, frame_index, True)
+    yield aesgcm.encrypt(nonce, bytes(buffer), header)
+
+def aes_decrypt_stream(chunks, password):
+    """
+    Dekripsi streaming untuk kontainer AES. Setiap frame baru dikeluarkan
+    setelah tag-nya terverifikasi. Blob format lama (single-shot) juga
+    didukung, tetapi harus dibaca utuh dulu.
+    """
+    chunks = iter(chunks)
+    buffer = bytearray()
+    
+    # 1. Baca header
+    for chunk in chunks:
+        buffer += chunk
+        if len(buffer) >= _AES_STREAM_HEADER.size:
+            break
+    
+    if buffer[:len(AES_STREAM_MAGIC)] != AES_STREAM_MAGIC:
+        for chunk in chunks:
+            buffer += chunk
+        yield _aes_decrypt_legacy(bytes(buffer), password)
+        return
+    if len(buffer) < _AES_STREAM_HEADER.size:
+        raise AESStreamHeaderError("Header kontainer AES terpotong.")
+    
+    header = bytes(buffer[:_AES_STREAM_HEADER.size])
+    _, version, frame_size, salt, nonce_prefix = _AES_STREAM_HEADER.unpack(header)
+    if version != AES_STREAM_VERSION:
+        raise AESStreamHeaderError(f"Versi kontainer AES tidak dikenal: {version}")
+    if not 0 < frame_size <= AES_STREAM_MAX_FRAME_SIZE:
+        raise AESStreamHeaderError("Ukuran frame tidak valid.")
+    del buffer[:_AES_STREAM_HEADER.size]
+    
+    # 2. Buat Ulang Kunci dari Password dan Salt
+    aesgcm = AESGCM(get_aes_key_from_password(password, salt))
+    
+    # 3. Dekripsi per frame (akan gagal jika tag, urutan, atau kunci salah)
+    # Sisa potongan pertama (setelah header) ikut diproses lebih dulu
+    sealed_size = frame_size + _AES_TAG_SIZE
+    frame_index = 0
+    for chunk in itertools.chain((b'',), chunks):
+        buffer += chunk
+        while len(buffer) > sealed_size:
+            nonce = _aes_frame_nonce(nonce_prefix, frame_index, False)
+            yield aesgcm.decrypt(nonce, bytes(buffer[:sealed_size]), header)
+            del buffer[:sealed_size]
+            frame_index += 1
+    
+    # 4. Sisa buffer adalah frame terakhir
+    if len(buffer) < _AES_TAG_SIZE:
+        raise ValueError("Kontainer AES terpotong.")
+    nonce = _aes_frame_nonce(nonce_prefix, frame_index, True)
+    yield aesgcm.decrypt(nonce, bytes(buffer), header)
+
+def aes_encrypt_fileobj(src, dst, password, frame_size=AES_STREAM_FRAME_SIZE):
+    """Enkripsi dari objek file `src` ke objek file `dst` secara streaming."""
+    try:
+        for piece in aes_encrypt_stream(iter_fileobj(src, frame_size), password, frame_size):
+            dst.write(piece)
+    except Exception as e:
+        raise ValueError(f"Error enkripsi file: {e}")
+
+def aes_decrypt_fileobj(src, dst, password):
+    """Dekripsi dari objek file `src` ke objek file `dst` secara streaming."""
+    try:
+        for piece in aes_decrypt_stream(iter_fileobj(src), password):
+            dst.write(piece)
+    except Exception as e:
+        raise ValueError(f"DEKRIPSI GAGAL. Password salah atau file rusak. Error: {e}")
 
 def aes_encrypt_file(file_bytes, password):
-    """Enkripsi file menggunakan AES-256-GCM."""
+    """Enkripsi file menggunakan AES-256-GCM (kontainer streaming)."""
     try:
-        # 1. Hasilkan Salt (untuk KDF) dan Nonce (untuk AES-GCM)
-        salt = os.urandom(16)
-        nonce = os.urandom(12) # GCM direkomendasikan 12 bytes
-        
-        # 2. Buat Kunci dari Password
-        key = get_aes_key_from_password(password, salt)
-        
-        # 3. Inisialisasi Cipher AES-GCM
-        cipher = Cipher(algorithms.AES(key), modes.GCM(nonce), backend=default_backend())
-        encryptor = cipher.encryptor()
-        
-        # 4. Enkripsi Data
-        encrypted_data = encryptor.update(file_bytes) + encryptor.finalize()
-        
-        # 5. Gabungkan: salt + nonce + authentication_tag + encrypted_data
-        # Tag (16 bytes) penting untuk verifikasi integritas
-        return salt + nonce + encryptor.tag + encrypted_data
-        
+        return b''.join(aes_encrypt_stream([file_bytes], password))
     except Exception as e:
         raise ValueError(f"Error enkripsi file: {e}")
 
 
+def _aes_decrypt_legacy(encrypted_file_bytes, password):
+    """Dekripsi blob AES-256-GCM format lama (single-shot)."""
+    if len(encrypted_file_bytes) < _AES_LEGACY_OVERHEAD:
+        raise ValueError("Data terenkripsi terlalu pendek.")
+    
+    # 1. Ekstrak komponen dari file
+    salt = encrypted_file_bytes[0:16]
+    nonce = encrypted_file_bytes[16:28]  # 12 bytes
+    tag = encrypted_file_bytes[28:44]   # 16 bytes
+    encrypted_data = encrypted_file_bytes[44:]
+    
+    # 2. Buat Ulang Kunci dari Password dan Salt
+    key = get_aes_key_from_password(password, salt)
+    
+    # 3. Inisialisasi Cipher AES-GCM
+    cipher = Cipher(algorithms.AES(key), modes.GCM(nonce, tag), backend=default_backend())
+    decryptor = cipher.decryptor()
+    
+    # 4. Dekripsi Data (akan gagal jika tag atau kunci salah)
+    return decryptor.update(encrypted_data) + decryptor.finalize()
+
 def aes_decrypt_file(encrypted_file_bytes, password):
-    """Dekripsi file AES-256-GCM."""
+    """Dekripsi file AES-256-GCM (kontainer streaming atau format lama)."""
     try:
-        # 1. Ekstrak komponen dari file
-        salt = encrypted_file_bytes[0:16]
-        nonce = encrypted_file_bytes[16:28]  # 12 bytes
-        tag = encrypted_file_bytes[28:44]   # 16 bytes
-        encrypted_data = encrypted_file_bytes[44:]
-        
-        # 2. Buat Ulang Kunci dari Password dan Salt
-        key = get_aes_key_from_password(password, salt)
-        
-        # 3. Inisialisasi Cipher AES-GCM
-        cipher = Cipher(algorithms.AES(key), modes.GCM(nonce, tag), backend=default_backend())
-        decryptor = cipher.decryptor()
-        
-        # 4. Dekripsi Data (akan gagal jika tag atau kunci salah)
-        decrypted_data = decryptor.update(encrypted_data) + decryptor.finalize()
-        return decrypted_data
+        try:
+            return b''.join(aes_decrypt_stream([encrypted_file_bytes], password))
+        except AESStreamHeaderError:
+            # Salt acak blob lama bisa saja kebetulan diawali magic kontainer.
+            # Hanya dicoba jika header-nya tidak valid: tag yang gagal
+            # (password salah) tidak diulang dengan derivasi kunci kedua.
+            return _aes_decrypt_legacy(encrypted_file_bytes, password)
         
     except Exception as e:
         # Ini akan gagal (InvalidTag) jika password salah
-        raise ValueError(f"DEKRIPSI GAGAL. Password salah atau file rusak. Error: {e}")
\ No newline at end of file
+        raise ValueError(f"DEKRIPSI GAGAL. Password salah atau file rusak. Error: {e}")
+
+def aes_encrypt_path(src_path, dst_path, password):
+    """Enkripsi file di disk `src_path` ke `dst_path` secara streaming."""
+    with open(src_path, 'rb') as src, open(dst_path, 'wb') as dst:
+        aes_encrypt_fileobj(src, dst, password)
+
+def aes_decrypt_path(src_path, dst_path, password):
+    """Dekripsi file di disk `src_path` ke `dst_path` secara streaming."""
+    with open(src_path, 'rb') as src, open(dst_path, 'wb') as dst:
+        aes_decrypt_fileobj(src, dst, password)
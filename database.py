@@ -2,17 +2,203 @@ import sqlite3
 import bcrypt # Using bcrypt from crypto.py's logic
 import json
 import datetime
+import hashlib
+import os
+import threading
+import time
+from collections import OrderedDict
 
 # Import password functions from your existing crypto file
 from crypto import hash_password_bcrypt, verify_password_bcrypt
+import face_codec
 
 DATABASE_FILE = 'users.db'
 
+# Penyimpanan payload pesan di luar SQLite (lihat blobstore.py). None berarti
+# semua payload disimpan inline di kolom encrypted_data seperti sebelumnya.
+blob_store = None
+# Payload kecil (mis. pesan teks) tetap inline agar tidak membuat banyak file
+INLINE_BLOB_MAX_BYTES = 4096
+# Format biner face encoding di kolom users.face_encoding (lihat face_codec.py).
+# FORMAT_INT8 ~4x lebih kecil dengan sedikit kehilangan presisi.
+FACE_ENCODING_FORMAT = face_codec.FORMAT_FLOAT32
+
+# --- 0. Connection Management ---
+# Setiap thread memakai satu koneksi yang tetap terbuka (bukan connect/close
+# per query). Dengan WAL, pembaca tidak diblok oleh penulis.
+SQLITE_BUSY_TIMEOUT_MS = 5000
+SQLITE_PRAGMAS = (
+    "PRAGMA journal_mode=WAL",
+    "PRAGMA synchronous=NORMAL",      # Aman dengan WAL, fsync hanya saat checkpoint
+    "PRAGMA cache_size=-16000",       # ~16 MB page cache per koneksi
+    "PRAGMA mmap_size=268435456",     # 256 MB memory-mapped I/O
+    f"PRAGMA busy_timeout={SQLITE_BUSY_TIMEOUT_MS}",
+    "PRAGMA foreign_keys=ON",         # Wajib agar ON DELETE CASCADE/SET NULL berjalan
+)
+
+_local = threading.local()
+_connections = {} # thread ident -> koneksi, untuk ditutup saat shutdown
+_connections_lock = threading.Lock()
+# Dinaikkan oleh close_connections; koneksi thread dari generasi lama sudah
+# ditutup dan dibuka ulang saat thread itu memanggil get_connection lagi
+_connection_generation = 0
+
+def _open_connection():
+    conn = sqlite3.connect(
+        DATABASE_FILE,
+        timeout=SQLITE_BUSY_TIMEOUT_MS / 1000,
+        check_same_thread=False # Hanya dipakai oleh thread pemiliknya
+    )
+    for pragma in SQLITE_PRAGMAS:
+        conn.execute(pragma)
+    return conn
+
+def get_connection():
+    """Mengambil koneksi SQLite milik thread ini (dibuat sekali per thread)."""
+    conn = getattr(_local, 'conn', None)
+    if (conn is not None and _local.database_file == DATABASE_FILE
+            and _local.generation == _connection_generation):
+        return conn
+    
+    conn = _open_connection()
+    with _connections_lock:
+        _local.conn = conn
+        _local.database_file = DATABASE_FILE
+        _local.generation = _connection_generation
+        # Tutup koneksi milik thread yang sudah berhenti atau file lama
+        alive = {thread.ident for thread in threading.enumerate()}
+        ident = threading.get_ident()
+        for other_ident in list(_connections):
+            if other_ident not in alive or other_ident == ident:
+                _connections.pop(other_ident).close()
+        _connections[ident] = conn
+    return conn
+
+def close_connections():
+    """
+    Menutup semua koneksi (dipanggil saat aplikasi berhenti). Thread lain
+    yang masih hidup otomatis membuka koneksi baru saat berikutnya memakai
+    database.
+    """
+    global _connection_generation
+    with _connections_lock:
+        _connection_generation += 1
+        for conn in _connections.values():
+            conn.close()
+        _connections.clear()
+    _local.__dict__.clear()
+
+# --- 0b. Cache User ---
+# get_current_user dipanggil di setiap endpoint terproteksi. Record user
+# disimpan sebentar di memori (LRU + TTL) dan langsung dibuang saat user
+# dibuat/dihapus di proses ini. Jika API dijalankan dengan beberapa proses,
+# perubahan dari proses lain terlihat paling lambat setelah TTL habis.
+USER_CACHE_MAX_ENTRIES = 1024
+USER_CACHE_TTL_SECONDS = 30
+
+class _TTLCache:
+    """
+    Cache LRU kecil dengan masa berlaku per entri, aman untuk multi-thread.
+
+    Untuk mencegah "stale set" (pembaca mengambil baris lama dari database,
+    lalu invalidate terjadi, lalu pembaca menyimpan baris lama itu ke cache),
+    pembaca mengambil token lewat `begin(key)` SEBELUM query dan memberikan
+    token itu ke `put`. Setiap invalidate menaikkan generasi key tersebut;
+    `put` dengan token yang lebih lama dari invalidate terakhir diabaikan.
+    """
+
+    def __init__(self, max_entries, ttl_seconds):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self._entries = OrderedDict() # key -> (kedaluwarsa, nilai)
+        self._lock = threading.Lock()
+        self._hits = 0
+        self._misses = 0
+        self._generation = 0
+        # key -> generasi invalidate terakhir (LRU, dibatasi). Generasi
+        # entri yang dibuang dicatat di _floor, sehingga token yang lebih
+        # tua darinya selalu ditolak (aman meskipun riwayatnya hilang).
+        self._invalidated = OrderedDict()
+        self._floor = 0
+
+    def get(self, key):
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[0] <= now:
+                if entry is not None:
+                    del self._entries[key]
+                self._misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self._hits += 1
+            return entry[1]
+
+    def begin(self, key):
+        """Token generasi; ambil sebelum membaca nilai dari sumbernya."""
+        with self._lock:
+            return self._generation
+
+    def put(self, key, value, token):
+        if self.max_entries <= 0 or self.ttl_seconds <= 0:
+            return
+        with self._lock:
+            if token < self._floor or token < self._invalidated.get(key, 0):
+                return # Ada invalidate setelah nilai ini dibaca
+            self._entries[key] = (time.monotonic() + self.ttl_seconds, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, key):
+        with self._lock:
+            self._generation += 1
+            self._entries.pop(key, None)
+            self._invalidated[key] = self._generation
+            self._invalidated.move_to_end(key)
+            while len(self._invalidated) > max(self.max_entries, 1):
+                _, generation = self._invalidated.popitem(last=False)
+                self._floor = max(self._floor, generation)
+
+    def clear(self):
+        with self._lock:
+            self._generation += 1
+            self._floor = self._generation
+            self._invalidated.clear()
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+                "ttl_seconds": self.ttl_seconds,
+                "hits": self._hits,
+                "misses": self._misses,
+            }
+
+_user_cache = _TTLCache(USER_CACHE_MAX_ENTRIES, USER_CACHE_TTL_SECONDS)
+
+def invalidate_user_cache(username=None):
+    """
+    Membuang cache satu user (atau semua jika username None). Hanya berlaku
+    di proses ini; proses API lain melihat perubahan setelah TTL
+    (USER_CACHE_TTL_SECONDS). Token milik akun yang dihapus tetap ditolak
+    lewat revoke_subject.
+    """
+    if username is None:
+        _user_cache.clear()
+    else:
+        _user_cache.invalidate(username)
+
+def user_cache_stats():
+    return _user_cache.stats()
+
 # --- 1. Database Initialization ---
 
 def init_db():
     """Membuat tabel users DAN messages."""
-    conn = sqlite3.connect(DATABASE_FILE)
+    conn = get_connection()
     cursor = conn.cursor()
     
     # Tabel Users (Tetap Sama, field face_encoding_json akan
@@ -46,71 +232,219 @@ def init_db():
     );
     ''')
     
+    # Kolom payload eksternal (ditambahkan belakangan, jadi migrasi manual).
+    # Jika storage_key terisi, encrypted_data dikosongkan (X'').
+    existing_columns = {row[1] for row in cursor.execute("PRAGMA table_info(messages)")}
+    for column, column_type in (("blob_sha256", "TEXT"), ("blob_size", "INTEGER"), ("storage_key", "TEXT")):
+        if column not in existing_columns:
+            cursor.execute(f"ALTER TABLE messages ADD COLUMN {column} {column_type}")
+    
+    # Face encoding biner (menggantikan face_encoding_json). Baris lama
+    # dimigrasikan saat pertama kali dibaca (_face_encoding_blob).
+    user_columns = {row[1] for row in cursor.execute("PRAGMA table_info(users)")}
+    if "face_encoding" not in user_columns:
+        cursor.execute("ALTER TABLE users ADD COLUMN face_encoding BLOB")
+    
+    # Index untuk kotak masuk: filter penerima + urut waktu (keyset pagination)
+    cursor.execute('''
+    CREATE INDEX IF NOT EXISTS idx_messages_recipient_timestamp
+    ON messages (recipient_username, timestamp, id);
+    ''')
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_messages_storage_key ON messages (storage_key);")
+    
+    # Access token yang dicabut (logout), disimpan sampai token itu sendiri
+    # kedaluwarsa
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS revoked_tokens (
+        jti TEXT PRIMARY KEY,
+        expires_at REAL NOT NULL
+    );
+    ''')
+    # Refresh token yang dicabut, beserta alasannya ('rotated' = sudah
+    # ditukar di /token/refresh, 'logout'); terpisah agar tidak ikut dimuat
+    # ke memori untuk pengecekan access token
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS revoked_refresh_tokens (
+        jti TEXT PRIMARY KEY,
+        expires_at REAL NOT NULL,
+        reason TEXT NOT NULL
+    );
+    ''')
+    # Semua token user yang diterbitkan sebelum revoked_before dianggap
+    # tidak berlaku (mis. akun dihapus)
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS revoked_subjects (
+        username TEXT PRIMARY KEY,
+        revoked_before REAL NOT NULL
+    );
+    ''')
+    
     conn.commit()
-    conn.close()
     print("Database 'users.db' dan 'messages.db' berhasil diinisialisasi.")
 
 # --- 2. User & Auth Functions (MODIFIED) ---
 
-def add_user(username, password, face_encoding_json):
+def add_user(username, password, face_encoding):
     """
     Menambahkan pengguna baru dengan HASH password dan 
-    FACE ENCODING (sebagai string) yang sudah jadi.
+    FACE ENCODING (vektor float) yang sudah jadi, disimpan dalam bentuk biner.
     """
-    if not username or not password or not face_encoding_json:
+    if not username or not password or face_encoding is None:
         return False, "Data tidak lengkap."
     try:
         # Client sudah memvalidasi encoding, server hanya menyimpan
         password_hash = hash_password_bcrypt(password)
+        face_encoding_blob = face_codec.encode(face_encoding, FACE_ENCODING_FORMAT)
         
-        conn = sqlite3.connect(DATABASE_FILE)
-        cursor = conn.cursor()
-        cursor.execute("INSERT INTO users (username, password_hash, face_encoding_json) VALUES (?, ?, ?)", 
-                       (username, password_hash, face_encoding_json))
-        conn.commit()
-        conn.close()
+        conn = get_connection()
+        with conn:
+            conn.execute("INSERT INTO users (username, password_hash, face_encoding) VALUES (?, ?, ?)", 
+                         (username, password_hash, face_encoding_blob))
+        invalidate_user_cache(username)
         return True, "Registrasi berhasil."
     except sqlite3.IntegrityError:
         return False, f"Username '{username}' sudah ada."
     except Exception as e:
         return False, f"Error: {e}"
 
+def get_password_hash(username):
+    """
+    Mengambil hash password user TANPA verifikasi (None jika tidak ada).
+    Verifikasi bcrypt bisa dijalankan terpisah, mis. di pool khusus.
+    """
+    result = get_connection().execute(
+        "SELECT password_hash FROM users WHERE username = ?", (username,)
+    ).fetchone()
+    return result[0] if result else None
+
 def authenticate_user(username, password):
     """
     Memverifikasi login pengguna HANYA DENGAN password.
     Mengembalikan data user jika berhasil, None jika gagal.
     """
-    conn = sqlite3.connect(DATABASE_FILE)
-    cursor = conn.cursor()
-    cursor.execute("SELECT password_hash, face_encoding_json FROM users WHERE username = ?", (username,))
-    result = cursor.fetchone()
-    conn.close()
+    result = get_connection().execute(
+        "SELECT password_hash, face_encoding, face_encoding_json FROM users WHERE username = ?", (username,)
+    ).fetchone()
     
     if result:
-        stored_hash, stored_face_encoding_json = result[0], result[1]
+        stored_hash = result[0]
         
         # Verifikasi HANYA password
         if verify_password_bcrypt(password, stored_hash):
             return {
                 "username": username, 
-                "face_encoding_json": stored_face_encoding_json
+                "face_encoding": _face_encoding_blob(username, result[1], result[2])
             }
     return None
 
+def _face_encoding_blob(username, face_encoding, face_encoding_json):
+    """
+    Mengembalikan face encoding biner. Untuk baris lama yang masih JSON,
+    encoding dikonversi dan disimpan sekali (migrasi lazy), lalu kolom
+    JSON dikosongkan. None jika tidak ada encoding yang valid.
+    """
+    if face_encoding is not None or not face_encoding_json:
+        return face_encoding
+    try:
+        face_encoding = face_codec.encode(face_codec.from_json(face_encoding_json), FACE_ENCODING_FORMAT)
+    except ValueError:
+        return None
+    conn = get_connection()
+    with conn:
+        conn.execute(
+            "UPDATE users SET face_encoding = ?, face_encoding_json = NULL WHERE username = ? AND face_encoding IS NULL",
+            (face_encoding, username)
+        )
+    return face_encoding
+
 def get_user_details(username):
     """
     Mengambil detail user berdasarkan username (untuk auth).
+    Hasil disimpan di cache; salinan dict dikembalikan agar cache tidak
+    ikut berubah jika pemanggil mengubahnya.
     """
-    conn = sqlite3.connect(DATABASE_FILE)
-    cursor = conn.cursor()
-    cursor.execute("SELECT username, face_encoding_json FROM users WHERE username = ?", (username,))
-    result = cursor.fetchone()
-    conn.close()
-    
-    if result:
-        return {"username": result[0], "face_encoding_json": result[1]}
+    user = _user_cache.get(username)
+    if user is None:
+        token = _user_cache.begin(username)
+        result = get_connection().execute(
+            "SELECT username, face_encoding, face_encoding_json FROM users WHERE username = ?", (username,)
+        ).fetchone()
+        if not result:
+            return None
+        user = {"username": result[0], "face_encoding": _face_encoding_blob(*result)}
+        _user_cache.put(username, user, token)
+    return dict(user)
+
+def revoke_token(jti, expires_at):
+    """Mencatat satu access token (berdasarkan jti) sebagai dicabut."""
+    conn = get_connection()
+    with conn:
+        conn.execute(
+            "INSERT OR IGNORE INTO revoked_tokens (jti, expires_at) VALUES (?, ?)",
+            (jti, expires_at)
+        )
+
+def revoke_refresh_token(jti, expires_at, reason):
+    """
+    Mencatat satu refresh token sebagai dicabut dengan alasan `reason`.
+    Mengembalikan None jika pemanggil ini yang mencabutnya, atau alasan
+    pencabutan sebelumnya (oleh proses mana pun). INSERT biasa membuat
+    pencabutan sekaligus menjadi klaim atomik, dipakai untuk rotasi.
+    """
+    conn = get_connection()
+    # Refresh token yang dicabut sebelum tabel ini ada tercatat di revoked_tokens
+    if conn.execute("SELECT 1 FROM revoked_tokens WHERE jti = ?", (jti,)).fetchone():
+        return "logout"
+    try:
+        with conn:
+            conn.execute(
+                "INSERT INTO revoked_refresh_tokens (jti, expires_at, reason) VALUES (?, ?, ?)",
+                (jti, expires_at, reason)
+            )
+    except sqlite3.IntegrityError:
+        return refresh_token_revocation(jti) or reason
     return None
 
+def refresh_token_revocation(jti):
+    """Alasan refresh token `jti` dicabut, atau None jika masih berlaku."""
+    conn = get_connection()
+    if conn.execute("SELECT 1 FROM revoked_tokens WHERE jti = ?", (jti,)).fetchone():
+        return "logout"
+    row = conn.execute(
+        "SELECT reason FROM revoked_refresh_tokens WHERE jti = ?", (jti,)
+    ).fetchone()
+    return row[0] if row else None
+
+def revoke_subject(username, revoked_before):
+    """Mencabut semua token user yang diterbitkan sebelum `revoked_before`."""
+    conn = get_connection()
+    with conn:
+        conn.execute(
+            """
+            INSERT INTO revoked_subjects (username, revoked_before) VALUES (?, ?)
+            ON CONFLICT (username) DO UPDATE
+            SET revoked_before = MAX(revoked_before, excluded.revoked_before)
+            """,
+            (username, revoked_before)
+        )
+
+def load_revocations(now, subject_horizon):
+    """
+    Membuang catatan yang sudah tidak relevan lalu mengembalikan
+    ({jti: expires_at} access token, {username: revoked_before}). Catatan
+    per user yang lebih tua dari `subject_horizon` (umur token terpanjang)
+    dibuang, karena token yang diterbitkan sebelumnya pasti sudah
+    kedaluwarsa.
+    """
+    conn = get_connection()
+    with conn:
+        conn.execute("DELETE FROM revoked_tokens WHERE expires_at < ?", (now,))
+        conn.execute("DELETE FROM revoked_refresh_tokens WHERE expires_at < ?", (now,))
+        conn.execute("DELETE FROM revoked_subjects WHERE revoked_before < ?", (now - subject_horizon,))
+    jtis = dict(conn.execute("SELECT jti, expires_at FROM revoked_tokens").fetchall())
+    subjects = dict(conn.execute("SELECT username, revoked_before FROM revoked_subjects").fetchall())
+    return jtis, subjects
+
 def delete_user_account(username, password):
     """
     Memverifikasi password pengguna dan menghapus akun mereka.
@@ -124,83 +458,286 @@ def delete_user_account(username, password):
         
     # Langkah 2: Jika password benar, hapus pengguna
     try:
-        conn = sqlite3.connect(DATABASE_FILE)
-        cursor = conn.cursor()
+        conn = get_connection()
         
         # Cukup hapus dari tabel 'users', 
         # FOREIGN KEY akan menangani sisanya.
-        cursor.execute("DELETE FROM users WHERE username = ?", (username,))
-        
-        conn.commit()
-        conn.close()
+        with conn:
+            conn.execute("DELETE FROM users WHERE username = ?", (username,))
+        invalidate_user_cache(username)
         
         return True, "Akun berhasil dihapus."
     except Exception as e:
         return False, f"Error database: {e}"
     
+def get_all_face_encodings():
+    """Mengambil (username, face_encoding biner) semua user (untuk face_index)."""
+    rows = get_connection().execute(
+        "SELECT username, face_encoding, face_encoding_json FROM users"
+        " WHERE face_encoding IS NOT NULL OR face_encoding_json IS NOT NULL"
+    ).fetchall()
+    return [(row[0], _face_encoding_blob(*row)) for row in rows]
+
 # --- 3. FUNGSI-FUNGSI PESAN  ---
 
 def get_all_usernames(exclude_user=None):
     """Mengambil semua username dari tabel users, kecuali exclude_user."""
-    conn = sqlite3.connect(DATABASE_FILE)
-    cursor = conn.cursor()
+    cursor = get_connection().cursor()
     if exclude_user:
         cursor.execute("SELECT username FROM users WHERE username != ?", (exclude_user,))
     else:
         cursor.execute("SELECT username FROM users")
     
     usernames = [row[0] for row in cursor.fetchall()]
-    conn.close()
     return usernames
 
-def send_message(sender, recipient, msg_type, data, filename=None):
-    """Menyimpan pesan terenkripsi ke database."""
+def configure_blob_store(store):
+    """Mengaktifkan blob store untuk payload pesan (None = simpan inline)."""
+    global blob_store
+    blob_store = store
+
+def send_message(sender, recipient, msg_type, data=None, filename=None, data_path=None):
+    """
+    Menyimpan pesan terenkripsi ke database. Payload diberikan sebagai
+    `data` (str/bytes) atau `data_path` (file di disk, tidak dibaca ke memori
+    jika blob store aktif).
+    """
     try:
-        conn = sqlite3.connect(DATABASE_FILE)
-        cursor = conn.cursor()
+        conn = get_connection()
         
         if isinstance(data, str):
             data_blob = data.encode('utf-8')
         else:
             data_blob = data
+        
+        payload_size = os.path.getsize(data_path) if data_path else len(data_blob)
+        storage_key = blob_sha256 = blob_size = None
+        if blob_store is not None and payload_size > INLINE_BLOB_MAX_BYTES:
+            if data_path:
+                blob_sha256, blob_size, storage_key = blob_store.put_path(data_path)
+            else:
+                blob_sha256, blob_size, storage_key = blob_store.put_bytes(data_blob)
+            data_blob = b''
+        else:
+            if data_path:
+                with open(data_path, 'rb') as payload_file:
+                    data_blob = payload_file.read()
+            # Hash juga dicatat untuk payload inline (dipakai sebagai ETag)
+            blob_sha256 = hashlib.sha256(data_blob).hexdigest()
             
-        cursor.execute(
-            """
-            INSERT INTO messages (sender_username, recipient_username, message_type, encrypted_data, original_filename)
-            VALUES (?, ?, ?, ?, ?)
-            """,
-            (sender, recipient, msg_type, data_blob, filename)
-        )
-        conn.commit()
-        conn.close()
+        with conn:
+            conn.execute(
+                """
+                INSERT INTO messages (sender_username, recipient_username, message_type, encrypted_data, original_filename,
+                                      blob_sha256, blob_size, storage_key)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+                """,
+                (sender, recipient, msg_type, data_blob, filename, blob_sha256, blob_size, storage_key)
+            )
         return True, "Pesan berhasil terkirim."
     except Exception as e:
         return False, f"Gagal mengirim pesan: {e}"
 
-def get_messages_for_user(username):
-    """Mengambil semua pesan untuk (recipient) pengguna."""
-    conn = sqlite3.connect(DATABASE_FILE)
-    conn.row_factory = sqlite3.Row
-    cursor = conn.cursor()
-    cursor.execute(
-        "SELECT id, sender_username, message_type, original_filename, timestamp FROM messages WHERE recipient_username = ? ORDER BY timestamp DESC",
-        (username,)
-    )
+def get_messages_for_user(username, limit=None, before=None):
+    """
+    Mengambil pesan untuk (recipient) pengguna, terbaru lebih dulu.
+    `before` adalah tuple (timestamp, id) pesan terakhir halaman sebelumnya;
+    hanya pesan yang lebih lama dari itu yang dikembalikan (keyset pagination).
+    """
+    query = "SELECT id, sender_username, message_type, original_filename, timestamp FROM messages WHERE recipient_username = ?"
+    params = [username]
+    if before is not None:
+        query += " AND (timestamp, id) < (?, ?)"
+        params.extend(before)
+    query += " ORDER BY timestamp DESC, id DESC"
+    if limit is not None:
+        query += " LIMIT ?"
+        params.append(limit)
+    
+    cursor = get_connection().cursor()
+    cursor.row_factory = sqlite3.Row
+    cursor.execute(query, params)
     messages = [dict(row) for row in cursor.fetchall()]
-    conn.close()
     return messages
 
 def get_message_by_id_for_user(message_id, username):
     """
     Mengambil data blob pesan, TAPI HANYA jika user adalah penerima.
     Ini untuk keamanan endpoint download.
+    Jika payload ada di blob store, encrypted_data kosong dan storage_key terisi.
     """
-    conn = sqlite3.connect(DATABASE_FILE)
-    cursor = conn.cursor()
-    cursor.execute(
-        "SELECT sender_username, message_type, encrypted_data, original_filename FROM messages WHERE id = ? AND recipient_username = ?",
+    message = get_connection().execute(
+        "SELECT sender_username, message_type, encrypted_data, original_filename, storage_key FROM messages WHERE id = ? AND recipient_username = ?",
         (message_id, username)
-    )
-    message = cursor.fetchone()
-    conn.close()
-    return message
\ No newline at end of file
+    ).fetchone()
+    return message
+
+def get_message_info_for_user(message_id, username):
+    """
+    Seperti get_message_by_id_for_user, tetapi hanya metadata dan ukuran
+    payload (tanpa memuat BLOB ke memori). None jika bukan milik user.
+    """
+    cursor = get_connection().cursor()
+    cursor.row_factory = sqlite3.Row
+    row = cursor.execute(
+        """
+        SELECT id, sender_username, message_type, original_filename, storage_key,
+               blob_sha256, length(encrypted_data) AS inline_size
+        FROM messages WHERE id = ? AND recipient_username = ?
+        """,
+        (message_id, username)
+    ).fetchone()
+    return dict(row) if row else None
+
+def _snapshot_connection():
+    """
+    Koneksi baru dengan transaksi baca yang sudah dimulai. Dengan WAL,
+    semua pembacaan (termasuk blobopen) melihat satu snapshot, jadi UPDATE
+    dari koneksi lain (mis. migrate_inline_blobs) tidak mengubah payload
+    yang sedang dibaca.
+    """
+    conn = _open_connection()
+    try:
+        conn.execute("BEGIN")
+        conn.execute("SELECT 1 FROM messages LIMIT 1").fetchall() # Mengunci snapshot sekarang
+    except Exception:
+        conn.close()
+        raise
+    return conn
+
+def _iter_snapshot_blob(conn, message_id, chunk_size, start, length):
+    try:
+        with conn.blobopen("messages", "encrypted_data", message_id, readonly=True) as blob:
+            if length is None:
+                length = len(blob) - start
+            blob.seek(start)
+            remaining = length
+            while remaining > 0:
+                chunk = blob.read(min(chunk_size, remaining))
+                if not chunk:
+                    raise IOError("Payload pesan berubah saat sedang dibaca.")
+                remaining -= len(chunk)
+                yield chunk
+    finally:
+        conn.rollback()
+        conn.close()
+
+class InlinePayload:
+    """
+    Payload inline satu pesan yang dibuka di atas snapshot baca (lihat
+    open_inline_payload). Ukuran dan isi berasal dari snapshot yang sama.
+    """
+
+    def __init__(self, conn, message_id, size):
+        self._conn = conn
+        self.message_id = message_id
+        self.size = size
+
+    def iter_range(self, start, length, chunk_size=64 * 1024):
+        """Generator potongan payload; snapshot ditutup setelah selesai dibaca."""
+        conn, self._conn = self._conn, None
+        return _iter_snapshot_blob(conn, self.message_id, chunk_size, start, length)
+
+    def close(self):
+        """Menutup snapshot jika payload tidak jadi dibaca."""
+        if self._conn is not None:
+            self._conn.rollback()
+            self._conn.close()
+            self._conn = None
+
+def open_inline_payload(message_id):
+    """
+    Membuka payload inline pesan untuk di-stream. Lokasi payload ditentukan
+    di dalam snapshot: None jika pesan tidak ada atau sudah dipindahkan ke
+    blob store (pemanggil lalu melayani dari blob store).
+    """
+    conn = _snapshot_connection()
+    row = conn.execute(
+        "SELECT storage_key, length(encrypted_data) FROM messages WHERE id = ?", (message_id,)
+    ).fetchone()
+    if row is None or row[0]:
+        conn.rollback()
+        conn.close()
+        return None
+    return InlinePayload(conn, message_id, row[1])
+
+def iter_inline_blob(message_id, chunk_size=64 * 1024, start=0, length=None):
+    """
+    Membaca payload inline pesan per potongan langsung dari SQLite
+    (incremental blob I/O), mulai dari byte `start` sebanyak `length` byte.
+    Memakai koneksi sendiri (snapshot baca) karena generator ini bisa
+    dilanjutkan dari thread yang berbeda-beda (mis. oleh StreamingResponse).
+    """
+    return _iter_snapshot_blob(_snapshot_connection(), message_id, chunk_size, start, length)
+
+def compute_inline_blob_sha256(message_id):
+    """
+    Menghitung (secara streaming) dan menyimpan SHA-256 payload inline
+    untuk pesan lama yang belum memilikinya.
+    """
+    sha256 = hashlib.sha256()
+    for chunk in iter_inline_blob(message_id):
+        sha256.update(chunk)
+    digest = sha256.hexdigest()
+    conn = get_connection()
+    with conn:
+        conn.execute(
+            "UPDATE messages SET blob_sha256 = ? WHERE id = ? AND storage_key IS NULL",
+            (digest, message_id)
+        )
+    return digest
+
+# --- 4. Pemeliharaan Blob Store ---
+
+def migrate_inline_blobs(batch_size=20):
+    """
+    Memindahkan sebagian payload inline lama ke blob store. Mengembalikan
+    jumlah pesan yang dipindahkan (0 berarti migrasi selesai). Dipanggil
+    berulang dari thread latar belakang.
+    """
+    if blob_store is None:
+        return 0
+    conn = get_connection()
+    rows = conn.execute(
+        "SELECT id FROM messages WHERE storage_key IS NULL AND length(encrypted_data) > ? LIMIT ?",
+        (INLINE_BLOB_MAX_BYTES, batch_size)
+    ).fetchall()
+    
+    for (message_id,) in rows:
+        # Dibaca bertahap langsung dari SQLite, tanpa memuat seluruh BLOB
+        with conn.blobopen("messages", "encrypted_data", message_id, readonly=True) as blob:
+            blob_sha256, blob_size, storage_key = blob_store.put_fileobj(blob)
+        with conn:
+            conn.execute(
+                """
+                UPDATE messages SET storage_key = ?, blob_sha256 = ?, blob_size = ?, encrypted_data = X''
+                WHERE id = ? AND storage_key IS NULL
+                """,
+                (storage_key, blob_sha256, blob_size, message_id)
+            )
+    return len(rows)
+
+def prune_orphan_blobs(grace_seconds=3600):
+    """
+    Menghapus blob yang tidak lagi dirujuk pesan mana pun (mis. setelah
+    CASCADE saat akun dihapus). Blob yang lebih baru dari `grace_seconds`
+    dilewati. Pengecekan rujukan diulang oleh blob store setelah blob
+    dipindahkan dari tempatnya (lihat delete_unreferenced), sehingga pesan
+    baru dengan isi yang sama tidak kehilangan payload-nya.
+    """
+    if blob_store is None:
+        return 0
+    conn = get_connection()
+    
+    def referenced(key):
+        return conn.execute(
+            "SELECT 1 FROM messages WHERE storage_key = ? LIMIT 1", (key,)
+        ).fetchone() is not None
+    
+    removed = 0
+    for key in blob_store.iter_keys(older_than=grace_seconds):
+        if referenced(key):
+            continue
+        if blob_store.delete_unreferenced(key, grace_seconds, lambda: referenced(key)):
+            removed += 1
+    return removed
\ No newline at end of file
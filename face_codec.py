@@ -0,0 +1,102 @@
+import base64
+import json
+import struct
+
+import numpy as np
+
+# --- Binary Face Encodings ---
+# A face encoding (128-D OpenFace vector) is stored and transferred as a
+# small versioned byte string instead of a JSON list of doubles:
+#
+#   FORMAT_FLOAT32: '<BH' header (format, dim) + dim little-endian float32
+#   FORMAT_INT8:    '<BH' header + float32 scale + dim int8 (value = q * scale)
+#
+# Decoding float32 is a zero-copy np.frombuffer view. Shared by the API
+# server and the Streamlit client.
+
+FACE_ENCODING_DIM = 128
+
+FORMAT_FLOAT32 = 1
+FORMAT_INT8 = 2
+
+_HEADER = struct.Struct('<BH')
+_INT8_SCALE = struct.Struct('<f')
+
+
+def unit_vector(vector, dim=FACE_ENCODING_DIM):
+    """Returns `vector` as a unit float32 array, or None if it is not a valid encoding."""
+    vector = np.asarray(vector, dtype=np.float32).reshape(-1)
+    if vector.shape != (dim,) or not np.all(np.isfinite(vector)):
+        return None
+    norm = np.linalg.norm(vector)
+    if norm == 0:
+        return None
+    return vector / norm
+
+
+def encode(vector, fmt=FORMAT_FLOAT32):
+    """Packs an encoding into bytes in the given format."""
+    vector = np.asarray(vector, dtype=np.float32).reshape(-1)
+    header = _HEADER.pack(fmt, vector.size)
+    if fmt == FORMAT_FLOAT32:
+        return header + vector.astype('<f4').tobytes()
+    if fmt == FORMAT_INT8:
+        peak = float(np.max(np.abs(vector))) if vector.size else 0.0
+        scale = peak / 127 if peak > 0 else 1.0
+        quantized = np.clip(np.rint(vector / scale), -127, 127).astype(np.int8)
+        return header + _INT8_SCALE.pack(scale) + quantized.tobytes()
+    raise ValueError(f"Unknown face encoding format: {fmt}")
+
+
+def decode(blob):
+    """Unpacks bytes from `encode` into a float32 vector (read-only for float32)."""
+    blob = memoryview(blob)
+    if len(blob) < _HEADER.size:
+        raise ValueError("Face encoding is truncated.")
+    fmt, dim = _HEADER.unpack_from(blob)
+    if fmt == FORMAT_FLOAT32:
+        expected = _HEADER.size + 4 * dim
+        if len(blob) != expected:
+            raise ValueError("Face encoding has the wrong length.")
+        return np.frombuffer(blob, dtype='<f4', count=dim, offset=_HEADER.size)
+    if fmt == FORMAT_INT8:
+        expected = _HEADER.size + _INT8_SCALE.size + dim
+        if len(blob) != expected:
+            raise ValueError("Face encoding has the wrong length.")
+        (scale,) = _INT8_SCALE.unpack_from(blob, _HEADER.size)
+        quantized = np.frombuffer(blob, dtype=np.int8, count=dim, offset=_HEADER.size + _INT8_SCALE.size)
+        return quantized.astype(np.float32) * np.float32(scale)
+    raise ValueError(f"Unknown face encoding format: {fmt}")
+
+
+def from_json(face_encoding_json):
+    """Parses the legacy JSON list form into a float32 vector."""
+    return np.asarray(json.loads(face_encoding_json), dtype=np.float32).reshape(-1)
+
+
+def to_json(vector):
+    return json.dumps(np.asarray(vector, dtype=np.float64).tolist())
+
+
+def to_b64(blob):
+    return base64.b64encode(blob).decode('ascii')
+
+
+def from_b64(text):
+    return base64.b64decode(text.encode('ascii'), validate=True)
+
+
+def load_any(value):
+    """
+    Accepts an encoding as bytes (binary form), a base64 string of it, a
+    legacy JSON list string, or an already decoded array/list; returns a
+    float32 vector.
+    """
+    if isinstance(value, (bytes, bytearray, memoryview)):
+        return decode(value)
+    if isinstance(value, (np.ndarray, list, tuple)):
+        return np.asarray(value, dtype=np.float32).reshape(-1)
+    value = value.strip()
+    if value.startswith('['):
+        return from_json(value)
+    return decode(from_b64(value))
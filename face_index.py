@@ -0,0 +1,128 @@
+import threading
+
+import numpy as np
+
+import face_codec
+
+# --- In-Memory Face Index ---
+# All enrolled face encodings in one L2-normalised float32 matrix, so a
+# probe is compared against every user with a single matrix-vector product
+# (cosine similarity = dot product of unit vectors). Rows are added and
+# removed incrementally as users register or delete their account.
+
+
+def _stored_vector(face_encoding, dim):
+    """Decodes a binary encoding from the users table; None if missing or invalid."""
+    if face_encoding is None:
+        return None
+    try:
+        return face_codec.unit_vector(face_codec.decode(face_encoding), dim)
+    except ValueError:
+        return None
+
+
+class FaceIndex:
+    """
+    Username -> unit encoding rows with top-k cosine search. Storage grows
+    by doubling; a removed row is filled with the last row so the live rows
+    stay contiguous.
+    """
+
+    def __init__(self, dim=face_codec.FACE_ENCODING_DIM, initial_capacity=1024):
+        self.dim = dim
+        self._matrix = np.zeros((initial_capacity, dim), dtype=np.float32)
+        self._usernames = []
+        self._rows = {} # username -> row
+        self._skipped = 0
+        self._lock = threading.Lock()
+
+    def load(self, records):
+        """Replaces the index with `records` of (username, binary face encoding)."""
+        usernames, vectors, skipped = [], [], 0
+        for username, face_encoding in records:
+            vector = _stored_vector(face_encoding, self.dim)
+            if vector is None:
+                skipped += 1
+                continue
+            usernames.append(username)
+            vectors.append(vector)
+        capacity = max(1024, 1 << max(0, len(vectors) - 1).bit_length())
+        matrix = np.zeros((capacity, self.dim), dtype=np.float32)
+        if vectors:
+            matrix[:len(vectors)] = np.stack(vectors)
+        with self._lock:
+            self._matrix = matrix
+            self._usernames = usernames
+            self._rows = {username: row for row, username in enumerate(usernames)}
+            self._skipped = skipped
+        return len(usernames)
+
+    def add(self, username, vector):
+        """Adds or replaces a user's row. Returns False if the vector is invalid."""
+        vector = face_codec.unit_vector(vector, self.dim)
+        if vector is None:
+            return False
+        with self._lock:
+            row = self._rows.get(username)
+            if row is None:
+                row = len(self._usernames)
+                if row == len(self._matrix):
+                    grown = np.zeros((2 * len(self._matrix), self.dim), dtype=np.float32)
+                    grown[:row] = self._matrix
+                    self._matrix = grown
+                self._usernames.append(username)
+                self._rows[username] = row
+            self._matrix[row] = vector
+        return True
+
+    def remove(self, username):
+        with self._lock:
+            row = self._rows.pop(username, None)
+            if row is None:
+                return False
+            last = len(self._usernames) - 1
+            if row != last:
+                moved = self._usernames[last]
+                self._matrix[row] = self._matrix[last]
+                self._usernames[row] = moved
+                self._rows[moved] = row
+            self._usernames.pop()
+            return True
+
+    def search(self, probe, k=5, min_similarity=None, exclude=None):
+        """
+        Top-k enrolled users by cosine similarity to `probe` (any non-zero
+        vector). Returns [(username, similarity)] best first.
+        """
+        probe = np.asarray(probe, dtype=np.float32).reshape(-1)
+        norm = np.linalg.norm(probe)
+        if probe.shape != (self.dim,) or norm == 0:
+            raise ValueError(f"Probe must be a non-zero {self.dim}-dim vector.")
+        probe = probe / norm
+
+        with self._lock:
+            count = len(self._usernames)
+            if count == 0:
+                return []
+            similarities = self._matrix[:count] @ probe
+            usernames = list(self._usernames)
+            excluded_row = self._rows.get(exclude) if exclude is not None else None
+
+        if excluded_row is not None:
+            similarities[excluded_row] = -np.inf
+        k = min(k, count)
+        top = np.argpartition(-similarities, k - 1)[:k]
+        top = top[np.argsort(-similarities[top])]
+        return [
+            (usernames[i], float(similarities[i])) for i in top
+            if np.isfinite(similarities[i]) and (min_similarity is None or similarities[i] >= min_similarity)
+        ]
+
+    def stats(self):
+        with self._lock:
+            return {
+                "enrolled": len(self._usernames),
+                "capacity": len(self._matrix),
+                "skipped_invalid": self._skipped,
+                "matrix_bytes": self._matrix.nbytes,
+            }
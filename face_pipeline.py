@@ -0,0 +1,303 @@
+# face_pipeline.py
+# Pipeline wajah (deteksi SSD + encoding OpenFace) tanpa ketergantungan ke
+# Streamlit, sehingga bisa dipakai oleh client_face_auth (in-process) maupun
+# oleh face_service (proses worker terpisah).
+import struct
+import time
+
+import cv2
+import numpy as np
+
+# --- 1. MODEL OpenCV (DNN) ---
+# Pastikan file-file ini ada di dalam folder 'models'
+DETECTOR_PROTO = 'models/deploy.prototxt'
+DETECTOR_MODEL = 'models/res10_300x300_ssd_iter_140000.caffemodel'
+ENCODER_MODEL = 'models/openface.nn4.small2.v1.t7'
+
+DETECTOR_INPUT_SIZE = (300, 300)
+DETECTOR_MEAN = (104.0, 177.0, 123.0)
+DETECTOR_MIN_CONFIDENCE = 0.7 # Threshold kepercayaan
+ENCODER_INPUT_SIZE = (96, 96)
+MIN_FACE_SIZE = 20
+MATCH_THRESHOLD = 0.80 # Cosine similarity minimal agar wajah dianggap cocok
+# Variance of Laplacian di atas nilai ini dianggap tajam (skor 1.0);
+# frame buram mendapat skor kualitas lebih rendah
+SHARPNESS_REFERENCE = 100.0
+# JPEG besar (mis. webcam 4K) di-decode langsung pada skala 1/2, 1/4 atau
+# 1/8 (IMREAD_REDUCED_*), selama sisi terpendek hasilnya masih >= nilai ini
+DECODE_MIN_SIDE = 480
+# ROI = kotak wajah terakhir diperluas sebesar (margin x ukuran kotak) ke
+# tiap sisi; posisi yang lebih tua dari ROI_MAX_AGE_SECONDS diabaikan
+ROI_MARGIN = 1.0
+ROI_MAX_AGE_SECONDS = 30.0
+# ROI yang hampir seluas frame tidak menghemat apa pun -> deteksi full frame
+ROI_MAX_AREA_RATIO = 0.6
+
+def load_nets():
+    """Memuat detector dan encoder. Melempar cv2.error jika file model tidak ada."""
+    detector_net = cv2.dnn.readNetFromCaffe(DETECTOR_PROTO, DETECTOR_MODEL)
+    encoder_net = cv2.dnn.readNetFromTorch(ENCODER_MODEL)
+    return detector_net, encoder_net
+
+def warm_up(detector_net, encoder_net):
+    """
+    Satu forward pass kosong per model, agar alokasi buffer dan inisialisasi
+    backend terjadi sebelum request pertama, bukan saat user menunggu.
+    """
+    dummy = np.zeros(DETECTOR_INPUT_SIZE[::-1] + (3,), dtype=np.uint8)
+    detect_faces(detector_net, [dummy])
+    encode_faces(encoder_net, [dummy[:ENCODER_INPUT_SIZE[1], :ENCODER_INPUT_SIZE[0]]])
+
+# --- 2. PIPELINE BATCH (BANYAK FRAME SEKALIGUS) ---
+
+_REDUCED_DECODE_FLAGS = (
+    (8, cv2.IMREAD_REDUCED_COLOR_8),
+    (4, cv2.IMREAD_REDUCED_COLOR_4),
+    (2, cv2.IMREAD_REDUCED_COLOR_2),
+)
+
+def _jpeg_size(data):
+    """(lebar, tinggi) dari header SOF JPEG tanpa decode; None jika bukan JPEG."""
+    if data[:2] != b'\xff\xd8':
+        return None
+    i = 2
+    while i + 9 <= len(data):
+        if data[i] != 0xFF:
+            return None
+        marker = data[i + 1]
+        if marker == 0xFF: # Byte pengisi
+            i += 1
+            continue
+        if marker == 0x01 or 0xD0 <= marker <= 0xD7: # Marker tanpa panjang
+            i += 2
+            continue
+        if 0xC0 <= marker <= 0xCF and marker not in (0xC4, 0xC8, 0xCC):
+            height, width = struct.unpack_from('>HH', data, i + 5)
+            return width, height
+        (length,) = struct.unpack_from('>H', data, i + 2)
+        i += 2 + length
+    return None
+
+def decode_frame(frame_bytes):
+    """
+    Bytes JPEG/PNG -> gambar BGR (None jika formatnya tidak terbaca).
+    JPEG besar di-decode langsung pada skala lebih kecil (libjpeg melewati
+    sebagian besar kerja IDCT), lihat DECODE_MIN_SIDE.
+    """
+    flag = cv2.IMREAD_COLOR
+    size = _jpeg_size(frame_bytes)
+    if size is not None:
+        for factor, reduced_flag in _REDUCED_DECODE_FLAGS:
+            if min(size) // factor >= DECODE_MIN_SIDE:
+                flag = reduced_flag
+                break
+    return cv2.imdecode(np.frombuffer(frame_bytes, dtype=np.uint8), flag)
+
+class FaceTracker:
+    """
+    Posisi wajah terakhir dalam satu sesi kamera, dalam koordinat relatif
+    (0..1, tidak bergantung skala decode). Frame berikutnya cukup dideteksi
+    di sekitar posisi itu (ROI) alih-alih seluruh frame.
+    """
+
+    def __init__(self, box=None):
+        self.box = None
+        self.updated = None
+        if box is not None:
+            self.remember(box)
+
+    def remember(self, box):
+        """Menyimpan kotak relatif (x1, y1, x2, y2)."""
+        self.box = tuple(float(v) for v in box)
+        self.updated = time.monotonic()
+
+    def current(self):
+        """Kotak relatif terakhir, atau None jika belum ada / sudah kedaluwarsa."""
+        if self.box is None or time.monotonic() - self.updated > ROI_MAX_AGE_SECONDS:
+            return None
+        return self.box
+
+    def update(self, box, shape):
+        """Menyimpan kotak piksel `box` dari gambar berukuran `shape`."""
+        (h, w) = shape[:2]
+        self.remember(np.asarray(box, dtype=np.float64) / [w, h, w, h])
+
+    def roi(self, shape):
+        """Region piksel (x1, y1, x2, y2) untuk gambar `shape`, atau None untuk full frame."""
+        box = self.current()
+        if box is None:
+            return None
+        (h, w) = shape[:2]
+        x1, y1, x2, y2 = box
+        margin_x, margin_y = (x2 - x1) * ROI_MARGIN, (y2 - y1) * ROI_MARGIN
+        x1, x2 = max(0, int((x1 - margin_x) * w)), min(w, int(np.ceil((x2 + margin_x) * w)))
+        y1, y2 = max(0, int((y1 - margin_y) * h)), min(h, int(np.ceil((y2 + margin_y) * h)))
+        if x2 - x1 < MIN_FACE_SIZE or y2 - y1 < MIN_FACE_SIZE:
+            return None
+        if (x2 - x1) * (y2 - y1) > ROI_MAX_AREA_RATIO * w * h:
+            return None
+        return x1, y1, x2, y2
+
+def _face_sharpness(face):
+    gray = cv2.cvtColor(face, cv2.COLOR_BGR2GRAY)
+    return float(cv2.Laplacian(gray, cv2.CV_64F).var())
+
+def detector_blob(images):
+    """Resize + blob untuk detector, semua gambar dalam satu batch."""
+    return cv2.dnn.blobFromImages(
+        [cv2.resize(image, DETECTOR_INPUT_SIZE) for image in images], 1.0,
+        DETECTOR_INPUT_SIZE, DETECTOR_MEAN, swapRB=False, crop=False
+    )
+
+def best_detections(detections, images):
+    """
+    Output SSD (1, 1, K, 7) -> [image_id, label, confidence, x1, y1, x2, y2].
+    Mengembalikan list (per gambar) berisi (box, confidence) deteksi
+    terbaik, atau (None, pesan) jika tidak ada wajah yang layak.
+    """
+    detections = detections.reshape(-1, 7)
+    results = []
+    for image_id, image in enumerate(images):
+        rows = detections[detections[:, 0] == image_id]
+        if len(rows) == 0:
+            results.append((None, "Tidak ada wajah yang terdeteksi."))
+            continue
+        best = rows[np.argmax(rows[:, 2])]
+        confidence = float(best[2])
+        if confidence < DETECTOR_MIN_CONFIDENCE:
+            results.append((None, "Wajah tidak cukup jelas."))
+            continue
+        (h, w) = image.shape[:2]
+        box = np.clip(best[3:7], 0.0, 1.0) * np.array([w, h, w, h])
+        results.append((box.astype("int"), confidence))
+    return results
+
+def detect_faces(detector_net, images):
+    """Deteksi wajah untuk banyak gambar dengan SATU forward pass (lihat best_detections)."""
+    detector_net.setInput(detector_blob(images))
+    return best_detections(detector_net.forward(), images)
+
+def _inside_roi(box, roi, image_shape):
+    """
+    Kotak (koordinat ROI) tidak menyentuh tepi ROI, kecuali tepi yang juga
+    tepi gambar; jika menyentuh, wajah mungkin terpotong oleh ROI.
+    """
+    if box is None:
+        return False
+    (h, w) = image_shape[:2]
+    x1, y1, x2, y2 = roi
+    return ((box[0] > 0 or x1 == 0) and (box[1] > 0 or y1 == 0)
+            and (box[2] < x2 - x1 or x2 == w) and (box[3] < y2 - y1 or y2 == h))
+
+def detect_faces_tracked(detector_net, images, tracker):
+    """
+    Seperti detect_faces, tetapi jika `tracker` punya posisi wajah terakhir,
+    detector hanya menerima potongan ROI (view, tanpa salinan) sehingga
+    resize/blob tidak menyentuh seluruh frame. Frame yang wajahnya tidak
+    ditemukan di ROI, atau terpotong tepi ROI, dideteksi ulang full frame
+    dalam satu batch. Kotak hasil selalu dalam koordinat gambar penuh, dan
+    posisi wajah frame terakhir disimpan ke `tracker`.
+    """
+    rois = [tracker.roi(image.shape) for image in images]
+    regions = [
+        image if roi is None else image[roi[1]:roi[3], roi[0]:roi[2]]
+        for image, roi in zip(images, rois)
+    ]
+    detections = detect_faces(detector_net, regions)
+
+    retry = []
+    for i, roi in enumerate(rois):
+        if roi is None:
+            continue
+        box, info = detections[i]
+        if _inside_roi(box, roi, images[i].shape):
+            detections[i] = (box + np.array([roi[0], roi[1], roi[0], roi[1]]), info)
+        else:
+            retry.append(i)
+    if retry:
+        for i, result in zip(retry, detect_faces(detector_net, [images[i] for i in retry])):
+            detections[i] = result
+
+    for image, (box, _) in reversed(list(zip(images, detections))):
+        if box is not None:
+            tracker.update(box, image.shape)
+            break
+    return detections
+
+def crop_faces(images, detections):
+    """
+    Memotong wajah hasil deteksi dan menilai kualitasnya (confidence x
+    ketajaman). Mengembalikan (faces, qualities, pesan terakhir).
+    """
+    faces, qualities = [], []
+    message = "Tidak ada wajah yang terdeteksi."
+    for image, (box, info) in zip(images, detections):
+        if box is None:
+            message = info
+            continue
+        (startX, startY, endX, endY) = box
+        face = image[startY:endY, startX:endX]
+        if face.shape[0] < MIN_FACE_SIZE or face.shape[1] < MIN_FACE_SIZE:
+            message = "Wajah yang terdeteksi terlalu kecil."
+            continue
+        faces.append(face)
+        qualities.append(info * min(1.0, _face_sharpness(face) / SHARPNESS_REFERENCE))
+    return faces, qualities, message
+
+def encoder_blob(faces):
+    return cv2.dnn.blobFromImages(faces, 1.0 / 255, ENCODER_INPUT_SIZE,
+                                  (0, 0, 0), swapRB=True, crop=True)
+
+def encode_faces(encoder_net, faces):
+    """Encoding banyak wajah dengan SATU forward pass; hasil (N, 128)."""
+    encoder_net.setInput(encoder_blob(faces))
+    return encoder_net.forward().reshape(len(faces), -1)
+
+def encode_frames(detector_net, encoder_net, frames, tracker=None):
+    """
+    Mendapatkan encoding wajah dari beberapa frame (bytes gambar) sekaligus.
+    Mengembalikan (encodings, qualities, pesan): encodings berbentuk (k, 128)
+    untuk frame yang berisi wajah layak, diurutkan dari kualitas terbaik
+    (confidence deteksi x ketajaman). encodings None jika tidak ada.
+    `tracker` (FaceTracker sesi, opsional) mengaktifkan deteksi berbasis ROI.
+    """
+    images = [image for image in map(decode_frame, frames) if image is not None]
+    if not images:
+        return None, [], "Gagal membaca format gambar."
+
+    # 1. Deteksi Wajah (batch)
+    if tracker is None:
+        detections = detect_faces(detector_net, images)
+    else:
+        detections = detect_faces_tracked(detector_net, images, tracker)
+    # Wajah dipotong sebagai view dari gambar (tanpa salinan); blobFromImages
+    # encoder hanya membaca region itu
+    faces, qualities, message = crop_faces(images, detections)
+    if not faces:
+        return None, [], message
+
+    # 2. Enkoding Wajah (batch)
+    encodings = encode_faces(encoder_net, faces)
+    order = np.argsort(qualities)[::-1]
+    return encodings[order], [qualities[i] for i in order], "Encoding berhasil."
+
+# --- 3. TEMPLATE & PERBANDINGAN ---
+
+def normalize(vectors):
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    return vectors / np.where(norms == 0, 1, norms)
+
+def enrollment_template(encodings):
+    """
+    Template registrasi: rata-rata encoding (yang sudah dinormalisasi) dari
+    frame yang mirip dengan frame terbaik (baris pertama), sehingga frame
+    yang salah orang / salah deteksi tidak ikut dirata-rata.
+    Mengembalikan (template, jumlah frame yang dipakai).
+    """
+    unit = normalize(encodings)
+    consistent = unit[unit @ unit[0] >= MATCH_THRESHOLD]
+    return normalize(consistent.mean(axis=0)), len(consistent)
+
+def best_similarity(known_encoding, encodings):
+    """Cosine similarity terbaik antara encoding tersimpan dan frame-frame baru."""
+    return float((normalize(encodings) @ normalize(known_encoding)).max())
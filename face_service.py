@@ -0,0 +1,330 @@
+import argparse
+import os
+import secrets
+import socket
+import stat
+import threading
+import time
+from multiprocessing import AuthenticationError
+from multiprocessing.connection import Client, Listener, answer_challenge, deliver_challenge
+
+import cv2
+
+import face_codec
+import face_pipeline
+import workers
+
+# --- Face Encoding Service ---
+# Loads the detector and encoder once per worker process, warms them up and
+# serves encode / template / compare requests over a local socket, so the
+# Streamlit processes don't each hold their own model copies or run
+# inference in the UI script thread.
+#
+#   python face_service.py --address 127.0.0.1:8765 --workers 2 --cv-threads 2
+#
+# Requests and replies are pickled dicts over multiprocessing.connection,
+# authenticated with an HMAC challenge on connect. Unpickling runs code, so
+# the key is the only thing keeping anyone who can reach the socket from
+# running arbitrary code here: it comes from FACE_SERVICE_AUTHKEY or, if
+# unset, from a random key the service writes to FACE_SERVICE_AUTHKEY_FILE
+# (mode 0600) on first start and clients of the same user read back.
+# A request beyond workers + queue is answered with {"busy": True}.
+
+DEFAULT_ADDRESS = "127.0.0.1:8765"
+DEFAULT_AUTHKEY_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "face_service.key")
+DEFAULT_TIMEOUT_SECONDS = 30
+HANDSHAKE_TIMEOUT_SECONDS = 5
+
+
+def parse_address(address):
+    """'host:port' -> (host, port) for TCP; anything with a '/' is a Unix socket path."""
+    if "/" in address:
+        return address
+    host, _, port = address.rpartition(":")
+    return (host or "127.0.0.1", int(port))
+
+
+def _authkey_file():
+    return os.environ.get("FACE_SERVICE_AUTHKEY_FILE", DEFAULT_AUTHKEY_FILE)
+
+
+def _create_authkey_file(path):
+    fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+    with os.fdopen(fd, "w") as f:
+        f.write(secrets.token_hex(32))
+
+
+def load_authkey(create=False):
+    """
+    FACE_SERVICE_AUTHKEY, else the contents of the key file. The service
+    passes create=True to generate the file on first start; clients only
+    read it, so a missing file raises FileNotFoundError (an OSError, which
+    callers already treat as "service unavailable").
+    """
+    key = os.environ.get("FACE_SERVICE_AUTHKEY")
+    if key:
+        return key.encode("utf-8")
+    path = _authkey_file()
+    if create:
+        try:
+            _create_authkey_file(path)
+        except FileExistsError:
+            pass
+    if os.name == "posix" and stat.S_IMODE(os.stat(path).st_mode) & 0o077:
+        raise PermissionError(f"{path} must not be readable by group/others (chmod 600).")
+    with open(path) as f:
+        key = f.read().strip()
+    if not key:
+        raise ValueError(f"{path} is empty.")
+    return key.encode("utf-8")
+
+
+def _shutdown_socket(conn):
+    """Wakes a thread blocked reading `conn` (shutdown acts on the shared socket)."""
+    try:
+        with socket.socket(fileno=os.dup(conn.fileno())) as sock:
+            sock.shutdown(socket.SHUT_RDWR)
+    except OSError:
+        pass
+
+
+# --- Worker process side ---
+
+_nets = None
+
+
+def _init_worker(cv_threads):
+    global _nets
+    cv2.setNumThreads(cv_threads)
+    _nets = face_pipeline.load_nets()
+    face_pipeline.warm_up(*_nets)
+
+
+def _encode_job(frames, roi_box=None):
+    """encode_frames with the caller's last face position; returns (result, new position)."""
+    tracker = face_pipeline.FaceTracker(roi_box)
+    return face_pipeline.encode_frames(*_nets, frames, tracker=tracker), tracker.box
+
+
+def _template_job(frames):
+    encodings, _, message = face_pipeline.encode_frames(*_nets, frames)
+    if encodings is None:
+        return None, 0, message
+    template, used = face_pipeline.enrollment_template(encodings)
+    return template, used, message
+
+
+def _compare_job(known_encoding, frames):
+    encodings, _, message = face_pipeline.encode_frames(*_nets, frames)
+    if encodings is None:
+        return None, message
+    return face_pipeline.best_similarity(known_encoding, encodings), message
+
+
+_JOBS = {
+    "encode": lambda req: (_encode_job, req["frames"], req.get("roi")),
+    "template": lambda req: (_template_job, req["frames"]),
+    "compare": lambda req: (_compare_job, face_codec.load_any(req["known"]), req["frames"]),
+}
+
+
+# --- Server side ---
+
+class FaceService:
+    def __init__(self, address, workers_count=1, max_queue=8, cv_threads=1):
+        self.address = address
+        self.authkey = load_authkey(create=True)
+        self.executor = workers.BoundedExecutor(
+            "face", kind="process", max_workers=workers_count, max_queue=max_queue,
+            initializer=_init_worker, initargs=(cv_threads,)
+        )
+
+    def handle(self, request):
+        op = request.get("op")
+        if op == "ping":
+            return {"ok": True}
+        if op == "stats":
+            return {"ok": True, "result": self.executor.stats()}
+        job = _JOBS.get(op)
+        if job is None:
+            return {"ok": False, "error": f"Unknown op: {op!r}"}
+        try:
+            fn, *args = job(request)
+            return {"ok": True, "result": self.executor.call(fn, *args)}
+        except workers.ExecutorSaturated as e:
+            return {"ok": False, "busy": True, "error": str(e)}
+        except Exception as e:
+            return {"ok": False, "error": f"{type(e).__name__}: {e}"}
+
+    def _handshake(self, conn):
+        """
+        Mutual HMAC challenge, done here rather than in listener.accept() so
+        a client that connects and stalls only holds its own thread; the
+        socket is shut down if it hasn't finished in HANDSHAKE_TIMEOUT_SECONDS.
+        """
+        lock = threading.Lock()
+        done = False
+
+        def expire():
+            with lock:
+                if not done:
+                    _shutdown_socket(conn)
+
+        timer = threading.Timer(HANDSHAKE_TIMEOUT_SECONDS, expire)
+        timer.daemon = True
+        timer.start()
+        try:
+            deliver_challenge(conn, self.authkey)
+            answer_challenge(conn, self.authkey)
+        finally:
+            with lock:
+                done = True
+            timer.cancel()
+
+    def _serve_connection(self, conn):
+        with conn:
+            try:
+                self._handshake(conn)
+            except (EOFError, OSError, AuthenticationError):
+                return # Wrong authkey, not a face client, or timed out
+            while True:
+                try:
+                    request = conn.recv()
+                    conn.send(self.handle(request))
+                except (EOFError, OSError):
+                    return # Client went away (possibly mid-request)
+
+    def warm_up(self):
+        """
+        Starts every worker (each loads and warms the models in _init_worker)
+        before accepting clients, so missing models fail at startup and the
+        first requests don't pay model load time.
+        """
+        errors = []
+
+        def start_one():
+            try:
+                self.executor.call(time.sleep, 0.05)
+            except Exception as e:
+                errors.append(e)
+
+        threads = [threading.Thread(target=start_one) for _ in range(self.executor.max_workers)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        if errors:
+            raise RuntimeError(f"Face service workers failed to start: {errors[0]}")
+
+    def serve_forever(self, ready=None):
+        self.warm_up()
+        # No authkey here: Listener would run the handshake on this thread
+        with Listener(parse_address(self.address)) as listener:
+            self.listener = listener
+            if ready is not None:
+                ready.set()
+            print(f"Face service listening on {self.address}")
+            while True:
+                try:
+                    conn = listener.accept()
+                except OSError:
+                    if getattr(self, "_closing", False):
+                        return
+                    continue
+                threading.Thread(target=self._serve_connection, args=(conn,), daemon=True).start()
+
+    def close(self):
+        self._closing = True
+        self.listener.close()
+        self.executor.shutdown()
+
+
+# --- Client side ---
+
+class FaceServiceBusy(Exception):
+    """The service queue is full; the caller may retry or run locally."""
+
+
+class FaceServiceClient:
+    """
+    Connection to a running face service. Calls raise OSError/EOFError if
+    the service is unreachable and FaceServiceBusy if it is saturated.
+    """
+
+    def __init__(self, address=DEFAULT_ADDRESS, timeout=DEFAULT_TIMEOUT_SECONDS):
+        self.address = address
+        self.timeout = timeout
+        self._conn = None
+        self._lock = threading.Lock()
+
+    def _request(self, request):
+        with self._lock:
+            if self._conn is None:
+                self._conn = Client(parse_address(self.address), authkey=load_authkey())
+            try:
+                self._conn.send(request)
+                if not self._conn.poll(self.timeout):
+                    raise TimeoutError("Face service did not answer in time.")
+                reply = self._conn.recv()
+            except BaseException:
+                # Drop the connection so the next call reconnects cleanly
+                self._conn.close()
+                self._conn = None
+                raise
+        if reply.get("busy"):
+            raise FaceServiceBusy(reply["error"])
+        if not reply["ok"]:
+            raise RuntimeError(reply["error"])
+        return reply.get("result")
+
+    def ping(self):
+        self._request({"op": "ping"})
+
+    def encode(self, frames, tracker=None):
+        """
+        -> (encodings (k, 128) or None, qualities, message); see
+        face_pipeline.encode_frames. A FaceTracker is sent along and updated
+        so the worker can detect within the last face ROI.
+        """
+        roi_box = tracker.current() if tracker is not None else None
+        result, roi_box = self._request({"op": "encode", "frames": list(frames), "roi": roi_box})
+        if tracker is not None and roi_box is not None:
+            tracker.remember(roi_box)
+        return result
+
+    def template(self, frames):
+        """-> (template or None, frames used, message)."""
+        return self._request({"op": "template", "frames": list(frames)})
+
+    def compare(self, known_encoding, frames):
+        """-> (best cosine similarity or None, message)."""
+        return self._request({"op": "compare", "known": known_encoding, "frames": list(frames)})
+
+    def stats(self):
+        return self._request({"op": "stats"})
+
+    def close(self):
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Local face-encoding service.")
+    parser.add_argument("--address", default=os.environ.get("FACE_SERVICE_ADDRESS", DEFAULT_ADDRESS),
+                        help="host:port or a Unix socket path")
+    parser.add_argument("--workers", type=int, default=1, help="worker processes (one model copy each)")
+    parser.add_argument("--queue", type=int, default=8, help="requests allowed to wait for a worker")
+    parser.add_argument("--cv-threads", type=int, default=1, help="cv2.setNumThreads per worker")
+    args = parser.parse_args()
+
+    service = FaceService(args.address, args.workers, args.queue, args.cv_threads)
+    try:
+        service.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
@@ -1,20 +1,104 @@
 import uvicorn
 from fastapi import (
-    FastAPI, Depends, HTTPException, status, UploadFile, File, Form
+    FastAPI, Depends, HTTPException, status, UploadFile, File, Form, Query,
+    Request, Response
 )
 import models
 from fastapi.security import OAuth2PasswordRequestForm
-from fastapi.responses import StreamingResponse, FileResponse
-from typing import List, Dict, Any
+from fastapi.responses import StreamingResponse, FileResponse, JSONResponse
+from starlette.background import BackgroundTask
+from starlette.concurrency import run_in_threadpool
+from typing import List, Dict, Any, Optional
+import base64
 import io
 import os
+import shutil
+import tempfile
+import threading
 
 # Import your modules
 import database
 import crypto
 import auth
+import blobstore
+import face_codec
+import face_index
+import throttle
+import uploads
+import workers
 
 
+# --- CONFIGURATION ---
+TEMP_DIR = "temp_files"
+STREAM_CHUNK_SIZE = 64 * 1024
+# Pool for CPU-bound crypto (stego, PBKDF2, AES): "thread" or "process".
+# Requests beyond workers + queue are rejected with 503.
+CRYPTO_EXECUTOR_KIND = "thread"
+CRYPTO_EXECUTOR_WORKERS = os.cpu_count() or 4
+CRYPTO_EXECUTOR_MAX_QUEUE = 32
+# Dedicated pool for bcrypt password checks on /token, so a login burst
+# cannot starve the threadpool used by every other endpoint
+PASSWORD_HASH_MAX_CONCURRENCY = 2
+PASSWORD_HASH_MAX_QUEUE = 64
+# Login throttling (per client IP and per username) in front of every
+# password check; see throttle.py. Behind a reverse proxy, run uvicorn with
+# --proxy-headers so request.client is the real client address.
+LOGIN_IP_RATE_PER_MINUTE = 30
+LOGIN_IP_BURST = 10
+LOGIN_USER_RATE_PER_MINUTE = 10
+LOGIN_USER_BURST = 5
+LOGIN_LOCKOUT_THRESHOLD = 5
+LOGIN_LOCKOUT_BASE_SECONDS = 2
+LOGIN_LOCKOUT_MAX_SECONDS = 900
+LOGIN_IP_LOCKOUT_THRESHOLD = 20
+LOGIN_IP_FAILURE_WINDOW_SECONDS = 900
+# Opt-in in-process cache for PBKDF2-derived AES keys (0 disables it)
+AES_KEY_CACHE_SIZE = 0
+AES_KEY_CACHE_TTL_SECONDS = 300
+# Stego carriers above this size are rejected from the PNG header alone,
+# before any pixel is decoded (decompression-bomb guard)
+STEGO_MAX_MEGAPIXELS = 40
+# Message payloads are kept as content-addressed files under this directory
+# (None keeps them inline in SQLite). Old inline payloads are migrated in the
+# background, BLOB_MIGRATION_BATCH_SIZE messages at a time.
+BLOB_STORE_DIR = "blobs"
+BLOB_MIGRATION_BATCH_SIZE = 20
+BLOB_MAINTENANCE_INTERVAL_SECONDS = 600
+# Inbox page sizes for /messages/inbox?limit=
+INBOX_DEFAULT_PAGE_SIZE = 50
+INBOX_MAX_PAGE_SIZE = 200
+# 1:N face search (/faces/identify). With REJECT_DUPLICATE_FACES, /register
+# refuses an encoding this similar to an already enrolled user; it is off by
+# default because the answer reveals (unauthenticated) that a face is enrolled.
+# The index is per process: with several API workers, users registered via
+# another worker are only seen after that worker's restart.
+REJECT_DUPLICATE_FACES = False
+DUPLICATE_FACE_SIMILARITY = 0.92
+# /faces/identify only reports accounts at or above this similarity (the
+# face_pipeline.MATCH_THRESHOLD), whatever min_similarity the caller asks
+# for, with scores rounded to FACE_IDENTIFY_SIMILARITY_DECIMALS; raw scores
+# for arbitrary probes (e.g. unit basis vectors) would let any user rebuild
+# another user's template. Searches are rate limited per IP and per user.
+FACE_IDENTIFY_MIN_SIMILARITY = 0.80
+FACE_IDENTIFY_SIMILARITY_DECIMALS = 2
+FACE_IDENTIFY_RATE_PER_MINUTE = 10
+FACE_IDENTIFY_BURST = 5
+# Limits for the text :batch endpoints. The item count is enforced by the
+# request models while parsing (422) and is set by MAX_TEXT_BATCH_ITEMS in
+# models.py, since it is fixed when the models are defined; bodies larger
+# than MAX_TEXT_BATCH_BODY_BYTES are refused with 413 before they are parsed.
+MAX_TEXT_BATCH_BODY_BYTES = 8 * 1024 * 1024
+# Resumable chunked uploads (/uploads): chunks are spooled under
+# UPLOAD_DIR and sessions idle for longer than the TTL are deleted
+UPLOAD_DIR = os.path.join(TEMP_DIR, "uploads")
+UPLOAD_CHUNK_SIZE = 8 * 1024 * 1024
+UPLOAD_MIN_CHUNK_SIZE = 1024 * 1024 # Bounds the chunk count per session
+UPLOAD_MAX_CHUNK_SIZE = 32 * 1024 * 1024
+UPLOAD_WRITE_BUFFER_SIZE = 1024 * 1024
+UPLOAD_MAX_TOTAL_SIZE = 4 * 1024 * 1024 * 1024
+UPLOAD_SESSION_TTL_SECONDS = 24 * 3600
+UPLOAD_EXPIRY_INTERVAL_SECONDS = 900
+
 # --- App Initialization ---
 app = FastAPI(
     title="AetherSecure API",
@@ -22,44 +106,288 @@ app = FastAPI(
     version="1.0.0"
 )
 
+class BatchBodyLimitMiddleware:
+    """
+    Refuses :batch request bodies larger than MAX_TEXT_BATCH_BODY_BYTES with
+    413, from Content-Length up front or while the body is being received,
+    so an oversized batch is never buffered whole or parsed.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not scope["path"].endswith(":batch"):
+            await self.app(scope, receive, send)
+            return
+
+        detail = f"Request body too large. Maximum is {MAX_TEXT_BATCH_BODY_BYTES} bytes."
+        declared = dict(scope["headers"]).get(b"content-length", b"")
+        if declared.isdigit() and int(declared) > MAX_TEXT_BATCH_BODY_BYTES:
+            response = JSONResponse({"detail": detail}, status_code=413)
+            await response(scope, receive, send)
+            return
+
+        received = 0
+
+        async def limited_receive():
+            nonlocal received
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                if received > MAX_TEXT_BATCH_BODY_BYTES:
+                    raise HTTPException(status_code=413, detail=detail)
+            return message
+
+        await self.app(scope, limited_receive, send)
+
+app.add_middleware(BatchBodyLimitMiddleware)
+
+crypto_executor = None
+password_executor = None
+login_throttle = None
+face_identify_throttle = None
+enrolled_faces = face_index.FaceIndex()
+blob_maintenance_stop = threading.Event()
+blob_maintenance_thread = None
+upload_store = None
+upload_expiry_thread = None
+revocation_reload_thread = None
+
 # Initialize database on startup
 @app.on_event("startup")
 def on_startup():
+    global crypto_executor, password_executor, login_throttle, face_identify_throttle
+    global blob_maintenance_thread, upload_store, upload_expiry_thread, revocation_reload_thread
     database.init_db()
+    auth.load_revocations()
+    enrolled_faces.load(database.get_all_face_encodings())
     # Create a directory for temporary file responses
-    if not os.path.exists("temp_files"):
-        os.makedirs("temp_files")
+    if not os.path.exists(TEMP_DIR):
+        os.makedirs(TEMP_DIR)
+    upload_store = uploads.UploadSessionStore(
+        UPLOAD_DIR,
+        ttl_seconds=UPLOAD_SESSION_TTL_SECONDS,
+        max_total_size=UPLOAD_MAX_TOTAL_SIZE,
+        min_chunk_size=UPLOAD_MIN_CHUNK_SIZE,
+        max_chunk_size=UPLOAD_MAX_CHUNK_SIZE
+    )
+    if AES_KEY_CACHE_SIZE > 0:
+        crypto.enable_key_cache(AES_KEY_CACHE_SIZE, AES_KEY_CACHE_TTL_SECONDS)
+    crypto_executor = workers.BoundedExecutor(
+        "crypto",
+        kind=CRYPTO_EXECUTOR_KIND,
+        max_workers=CRYPTO_EXECUTOR_WORKERS,
+        max_queue=CRYPTO_EXECUTOR_MAX_QUEUE
+    )
+    password_executor = workers.BoundedExecutor(
+        "bcrypt",
+        max_workers=PASSWORD_HASH_MAX_CONCURRENCY,
+        max_queue=PASSWORD_HASH_MAX_QUEUE
+    )
+    login_throttle = throttle.LoginThrottle(
+        ip_rate_per_minute=LOGIN_IP_RATE_PER_MINUTE,
+        ip_burst=LOGIN_IP_BURST,
+        user_rate_per_minute=LOGIN_USER_RATE_PER_MINUTE,
+        user_burst=LOGIN_USER_BURST,
+        lockout_threshold=LOGIN_LOCKOUT_THRESHOLD,
+        lockout_base_seconds=LOGIN_LOCKOUT_BASE_SECONDS,
+        lockout_max_seconds=LOGIN_LOCKOUT_MAX_SECONDS,
+        ip_lockout_threshold=LOGIN_IP_LOCKOUT_THRESHOLD,
+        ip_failure_window_seconds=LOGIN_IP_FAILURE_WINDOW_SECONDS
+    )
+    face_identify_throttle = throttle.LoginThrottle(
+        ip_rate_per_minute=FACE_IDENTIFY_RATE_PER_MINUTE,
+        ip_burst=FACE_IDENTIFY_BURST,
+        user_rate_per_minute=FACE_IDENTIFY_RATE_PER_MINUTE,
+        user_burst=FACE_IDENTIFY_BURST
+    )
+    # Unknown usernames are checked against this hash; create it now rather
+    # than on the first such login
+    crypto.dummy_bcrypt_hash()
+    if BLOB_STORE_DIR:
+        database.configure_blob_store(blobstore.FileSystemBlobStore(BLOB_STORE_DIR))
+        blob_maintenance_stop.clear()
+        blob_maintenance_thread = threading.Thread(
+            target=_blob_maintenance_loop, name="blob-maintenance", daemon=True
+        )
+        blob_maintenance_thread.start()
+    upload_expiry_thread = threading.Thread(
+        target=_upload_expiry_loop, name="upload-expiry", daemon=True
+    )
+    upload_expiry_thread.start()
+    revocation_reload_thread = threading.Thread(
+        target=_revocation_reload_loop, name="revocation-reload", daemon=True
+    )
+    revocation_reload_thread.start()
+
+@app.on_event("shutdown")
+def on_shutdown():
+    blob_maintenance_stop.set()
+    if blob_maintenance_thread is not None:
+        blob_maintenance_thread.join(timeout=5)
+    if upload_expiry_thread is not None:
+        upload_expiry_thread.join(timeout=5)
+    if revocation_reload_thread is not None:
+        revocation_reload_thread.join(timeout=5)
+    database.close_connections()
+    crypto_executor.shutdown()
+    password_executor.shutdown()
+    crypto.disable_key_cache()
+
+def _revocation_reload_loop():
+    """Purges expired revocations and picks up those made by other workers."""
+    while not blob_maintenance_stop.wait(auth.REVOCATION_RELOAD_SECONDS):
+        try:
+            auth.load_revocations()
+        except Exception as e:
+            print(f"Revocation reload error: {e}")
+
+def _blob_maintenance_loop():
+    """
+    Moves old inline payloads into the blob store a batch at a time, then
+    periodically deletes blobs no message references anymore.
+    """
+    while not blob_maintenance_stop.is_set():
+        wait_seconds = BLOB_MAINTENANCE_INTERVAL_SECONDS
+        try:
+            if database.migrate_inline_blobs(BLOB_MIGRATION_BATCH_SIZE) > 0:
+                wait_seconds = 0.1 # More to migrate; yield briefly to requests
+            else:
+                database.prune_orphan_blobs()
+        except Exception as e:
+            print(f"Blob maintenance error: {e}")
+        blob_maintenance_stop.wait(wait_seconds)
+
+def _upload_expiry_loop():
+    """Deletes abandoned upload sessions (and their spooled chunks)."""
+    while not blob_maintenance_stop.is_set():
+        try:
+            upload_store.expire()
+        except Exception as e:
+            print(f"Upload expiry error: {e}")
+        blob_maintenance_stop.wait(UPLOAD_EXPIRY_INTERVAL_SECONDS)
+
+# --- Helpers ---
+
+def _temp_path(suffix=""):
+    """Creates an empty file in TEMP_DIR and returns its path."""
+    fd, path = tempfile.mkstemp(suffix=suffix, dir=TEMP_DIR)
+    os.close(fd)
+    return path
+
+def _remove_quietly(path):
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+def _copy_to_path(file_obj, path):
+    with open(path, "wb") as out:
+        shutil.copyfileobj(file_obj, out, STREAM_CHUNK_SIZE)
+
+async def _save_upload(upload: UploadFile):
+    """Copies an upload to a temp file so worker processes can read it by path."""
+    path = _temp_path()
+    try:
+        await run_in_threadpool(_copy_to_path, upload.file, path)
+    except Exception:
+        _remove_quietly(path)
+        raise
+    return path
+
+def _client_ip(request: Request):
+    return request.client.host if request.client else "unknown"
+
+def _check_login_throttle(ip, username):
+    """Rejects a password attempt with 429 before any hashing if throttled."""
+    _check_throttle(login_throttle, ip, username)
+
+def _check_throttle(limiter, ip, username):
+    wait_seconds = limiter.check(ip, username)
+    if wait_seconds > 0:
+        raise HTTPException(
+            status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+            detail="Too many attempts. Please retry later.",
+            headers={"Retry-After": throttle.retry_after_header(wait_seconds)}
+        )
+
+async def _run_crypto(fn, *args):
+    """Runs a CPU-bound crypto function on the crypto executor."""
+    try:
+        return await crypto_executor.run(fn, *args)
+    except workers.ExecutorSaturated:
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="Server is busy. Please retry shortly.",
+            headers={"Retry-After": "1"}
+        )
 
 # --- 1. Authentication Endpoints ---
 
-@app.post("/register", response_model=models.UserInDB)
+@app.post("/register", response_model=models.UserInDB, response_model_exclude_none=True)
 def register_user(user_in: models.UserCreate):
     """
     Register a new user.
     The client is expected to generate the face encoding and send it
     as a JSON string.
     """
+    face_encoding = _face_encoding_from_request(
+        user_in.face_encoding_json, user_in.face_encoding_b64
+    )
+    if REJECT_DUPLICATE_FACES:
+        if enrolled_faces.search(
+            face_encoding, k=1, min_similarity=DUPLICATE_FACE_SIMILARITY
+        ):
+            raise HTTPException(
+                status_code=status.HTTP_409_CONFLICT,
+                detail="This face is already enrolled."
+            )
     success, message = database.add_user(
         username=user_in.username,
         password=user_in.password,
-        face_encoding_json=user_in.face_encoding_json
+        face_encoding=face_encoding
     )
     if not success:
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
             detail=message
         )
+    enrolled_faces.add(user_in.username, face_encoding)
     
     # Return the created user info (excluding password)
     user_dict = {
         "username": user_in.username,
-        "face_encoding_json": user_in.face_encoding_json
+        "face_encoding_json": user_in.face_encoding_json,
+        "face_encoding_b64": user_in.face_encoding_b64
     }
     return user_dict
 
+def _face_encoding_from_request(face_encoding_json, face_encoding_b64):
+    """
+    Decodes a client-supplied face encoding (legacy JSON list or base64 of
+    the face_codec binary form) into a float32 vector, or raises 400.
+    """
+    try:
+        if face_encoding_b64:
+            vector = face_codec.decode(face_codec.from_b64(face_encoding_b64))
+        elif face_encoding_json:
+            vector = face_codec.from_json(face_encoding_json)
+        else:
+            vector = None
+    except (ValueError, TypeError):
+        vector = None
+    if vector is None or face_codec.unit_vector(vector) is None:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"A valid {face_codec.FACE_ENCODING_DIM}-dim face encoding is required."
+        )
+    return vector
+
 
 @app.post("/token", response_model=models.Token)
-def login_for_access_token(
+async def login_for_access_token(
+    request: Request,
     form_data: OAuth2PasswordRequestForm = Depends()
 ):
     """
@@ -69,39 +397,125 @@ def login_for_access_token(
     performed here. The server trusts the client to have
     handled face verification *before* calling this endpoint.
     """
-    user = database.authenticate_user(
-        form_data.username, 
-        form_data.password
+    login_failed = HTTPException(
+        status_code=status.HTTP_401_UNAUTHORIZED,
+        detail="Incorrect username or password",
+        headers={"WWW-Authenticate": "Bearer"},
+    )
+    client_ip = _client_ip(request)
+    _check_login_throttle(client_ip, form_data.username)
+    stored_hash = await run_in_threadpool(
+        database.get_password_hash, form_data.username
     )
-    if not user:
+    # Unknown usernames are verified against a dummy hash on the same pool,
+    # so admission (503 when saturated) and latency under load are the same
+    # whether or not the account exists
+    user_exists = stored_hash is not None
+    if not user_exists:
+        stored_hash = crypto.dummy_bcrypt_hash()
+    
+    try:
+        password_ok = await password_executor.run(
+            crypto.verify_password_bcrypt, form_data.password, stored_hash
+        ) and user_exists
+    except workers.ExecutorSaturated:
         raise HTTPException(
-            status_code=status.HTTP_401_UNAUTHORIZED,
-            detail="Incorrect username or password",
-            headers={"WWW-Authenticate": "Bearer"},
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="Too many logins in progress. Please retry shortly.",
+            headers={"Retry-After": "1"}
         )
-    access_token = auth.create_access_token(
-        data={"sub": user['username']}
+    if not password_ok:
+        login_throttle.record_failure(client_ip, form_data.username)
+        raise login_failed
+    login_throttle.record_success(client_ip, form_data.username)
+    return _issue_tokens(form_data.username)
+
+def _issue_tokens(username):
+    return {
+        "access_token": auth.create_access_token(data={"sub": username}),
+        "token_type": "bearer",
+        "refresh_token": auth.create_refresh_token(username),
+        "expires_in": auth.ACCESS_TOKEN_EXPIRE_MINUTES * 60
+    }
+
+@app.post("/token/refresh", response_model=models.Token)
+def refresh_access_token(req: models.TokenRefreshRequest):
+    """
+    Exchanges a refresh token for a new access token. The refresh token is
+    rotated: the one presented is revoked and a new one is returned.
+    Revoking it is an atomic claim in SQLite, so of two concurrent refreshes
+    (in any worker process) only one succeeds. Presenting an already rotated
+    refresh token is treated as token theft and revokes every token of
+    that user; one revoked by /logout is simply rejected.
+    """
+    credentials_error = HTTPException(
+        status_code=status.HTTP_401_UNAUTHORIZED,
+        detail="Could not validate credentials",
+        headers={"WWW-Authenticate": "Bearer"},
     )
-    return {"access_token": access_token, "token_type": "bearer"}
+    payload = auth.decode_token(req.refresh_token, token_type="refresh", check_revoked=False)
+    if auth.is_subject_revoked(payload) or database.get_user_details(payload["sub"]) is None:
+        raise credentials_error
+    previous_revocation = auth.revoke_refresh_token(payload, auth.REFRESH_ROTATED)
+    if previous_revocation is not None:
+        if previous_revocation == auth.REFRESH_ROTATED:
+            auth.revoke_subject(payload["sub"])
+        raise credentials_error
+    return _issue_tokens(payload["sub"])
+
+@app.post("/logout", response_model=Dict[str, str])
+def logout(
+    req: Optional[models.LogoutRequest] = None,
+    token: str = Depends(auth.oauth2_scheme)
+):
+    """
+    Revokes the current access token and, if given, the refresh token.
+    """
+    payload = auth.decode_token(token)
+    auth.revoke_token(payload)
+    if req and req.refresh_token:
+        try:
+            refresh_payload = auth.decode_token(
+                req.refresh_token, token_type="refresh", check_revoked=False
+            )
+        except HTTPException:
+            refresh_payload = None # Invalid or already expired
+        if refresh_payload and refresh_payload["sub"] == payload["sub"]:
+            # No-op if it was already rotated, which keeps reuse detection
+            auth.revoke_refresh_token(refresh_payload)
+    return {"detail": "Logged out."}
 
 
-@app.get("/users/me", response_model=models.UserInDB)
+@app.get("/users/me", response_model=models.UserInDB, response_model_exclude_none=True)
 def read_users_me(
+    face_encoding_format: str = Query("json", pattern="^(json|base64)$"),
     current_user: models.UserInDB = Depends(auth.get_current_user)
 ):
     """
     Get information about the currently authenticated user.
+    `face_encoding_format=base64` returns the compact binary encoding
+    (`face_encoding_b64`) instead of the JSON list.
     """
-    return current_user
+    user = {"username": current_user['username']}
+    face_encoding = current_user['face_encoding']
+    if face_encoding is not None:
+        if face_encoding_format == "base64":
+            user["face_encoding_b64"] = face_codec.to_b64(face_encoding)
+        else:
+            user["face_encoding_json"] = face_codec.to_json(face_codec.decode(face_encoding))
+    return user
 
 @app.delete("/users/me", response_model=Dict[str, str])
 def delete_self_user(
+    request: Request,
     delete_request: models.UserDeleteConfirm,
-    current_user: models.UserInDB = Depends(auth.get_current_user)
+    current_user: models.Principal = Depends(auth.get_current_principal)
 ):
     """
     Menghapus akun pengguna yang sedang login setelah verifikasi password.
     """
+    client_ip = _client_ip(request)
+    _check_login_throttle(client_ip, current_user['username'])
     success, msg = database.delete_user_account(
         current_user['username'], 
         delete_request.password
@@ -109,6 +523,7 @@ def delete_self_user(
     
     if not success:
         if "Password salah" in msg:
+            login_throttle.record_failure(client_ip, current_user['username'])
             raise HTTPException(
                 status_code=status.HTTP_401_UNAUTHORIZED, 
                 detail=msg
@@ -118,15 +533,38 @@ def delete_self_user(
                 status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, 
                 detail=msg
             )
-            
+    
+    # Cut off every outstanding access/refresh token of the deleted account
+    auth.revoke_subject(current_user['username'])
+    enrolled_faces.remove(current_user['username'])
     return {"detail": msg}
 
+@app.post("/faces/identify", response_model=models.FaceIdentifyResponse)
+def identify_face(
+    request: Request,
+    req: models.FaceIdentifyRequest,
+    current_user: models.Principal = Depends(auth.get_current_principal)
+):
+    """
+    Compares a face encoding against every enrolled user and returns up to
+    `top_k` matching accounts (cosine similarity, best first). Only matches
+    at or above FACE_IDENTIFY_MIN_SIMILARITY are reported.
+    """
+    _check_throttle(face_identify_throttle, _client_ip(request), current_user['username'])
+    probe = _face_encoding_from_request(req.face_encoding_json, req.face_encoding_b64)
+    min_similarity = max(FACE_IDENTIFY_MIN_SIMILARITY, req.min_similarity or 0.0)
+    matches = enrolled_faces.search(probe, k=req.top_k, min_similarity=min_similarity)
+    return {"matches": [
+        {"username": u, "similarity": round(sim, FACE_IDENTIFY_SIMILARITY_DECIMALS)}
+        for u, sim in matches
+    ]}
+
 # --- 2. Crypto Tool Endpoints (Protected) ---
 
 @app.post("/crypto/text/encrypt", response_model=Dict[str, str])
 def encrypt_text(
     req: models.TextEncryptRequest,
-    current_user: models.UserInDB = Depends(auth.get_current_user)
+    current_user: models.Principal = Depends(auth.get_current_principal)
 ):
     """
     Encrypts plaintext using Super Encryption (Caesar + XOR + Base64).
@@ -142,7 +580,7 @@ def encrypt_text(
 @app.post("/crypto/text/decrypt", response_model=Dict[str, str])
 def decrypt_text(
     req: models.TextDecryptRequest,
-    current_user: models.UserInDB = Depends(auth.get_current_user)
+    current_user: models.Principal = Depends(auth.get_current_principal)
 ):
     """
     Decrypts Super Encrypted text.
@@ -155,22 +593,126 @@ def decrypt_text(
     except Exception as e:
         raise HTTPException(status_code=400, detail=f"Decryption failed: {e}")
 
+@app.post("/crypto/text/encrypt:batch", response_model=models.TextEncryptBatchResponse)
+def encrypt_text_batch(
+    req: models.TextEncryptBatchRequest,
+    current_user: models.Principal = Depends(auth.get_current_principal)
+):
+    """
+    Encrypts many plaintexts in one request, each with its own keys.
+    Results (or per-item errors) are returned in the same order.
+    """
+    results = []
+    for item in req.items:
+        try:
+            ciphertext = crypto.super_encrypt_text(
+                item.plaintext, item.caesar_shift, item.xor_key
+            )
+            results.append({"ciphertext": ciphertext})
+        except Exception as e:
+            results.append({"error": str(e)})
+    return {"results": results}
+
+@app.post("/crypto/text/decrypt:batch", response_model=models.TextDecryptBatchResponse)
+def decrypt_text_batch(
+    req: models.TextDecryptBatchRequest,
+    current_user: models.Principal = Depends(auth.get_current_principal)
+):
+    """
+    Decrypts many Super Encrypted texts in one request, each with its own keys.
+    Results (or per-item errors) are returned in the same order.
+    """
+    results = []
+    for item in req.items:
+        try:
+            plaintext = crypto.super_decrypt_text_strict(
+                item.base64_ciphertext, item.caesar_shift, item.xor_key
+            )
+            results.append({"plaintext": plaintext})
+        except Exception as e:
+            results.append({"error": f"Decryption failed: {e}"})
+    return {"results": results}
+
+def _check_stego_mode(bits_per_channel):
+    if not 1 <= bits_per_channel <= crypto.STEGO_MAX_BITS_PER_CHANNEL:
+        raise HTTPException(
+            status_code=400,
+            detail=f"bits_per_channel must be between 1 and {crypto.STEGO_MAX_BITS_PER_CHANNEL}."
+        )
+
+async def _inspect_png(image: UploadFile, require_png=True):
+    """
+    Reads only the PNG IHDR of an upload and enforces STEGO_MAX_MEGAPIXELS.
+    The upload is rewound so it can still be read in full afterwards.
+    With `require_png=False` other formats pass unchecked (returns None).
+    """
+    header = await image.read(crypto.PNG_HEADER_SIZE)
+    await image.seek(0)
+    if not require_png and not header.startswith(crypto.PNG_SIGNATURE):
+        return None
+    try:
+        info = crypto.png_read_ihdr(header)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if info["width"] * info["height"] > STEGO_MAX_MEGAPIXELS * 1000000:
+        raise HTTPException(
+            status_code=413,
+            detail=f"Image too large. Maximum is {STEGO_MAX_MEGAPIXELS} megapixels."
+        )
+    return info
+
+async def _preflight_stego_carrier(image: UploadFile, message, bits_per_channel, use_alpha):
+    """Rejects carriers that cannot hold `message` before decoding them."""
+    info = await _inspect_png(image)
+    capacity = crypto.stego_capacity(
+        info["width"], info["height"], bits_per_channel, use_alpha
+    )
+    if len(message.encode("utf-8")) > capacity:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Gambar terlalu kecil untuk menyembunyikan pesan ini (kapasitas {capacity} byte)."
+        )
+
+@app.post("/crypto/image/capacity", response_model=models.StegoCapacityResponse)
+async def get_stego_capacity(
+    image: UploadFile = File(...),
+    current_user: models.Principal = Depends(auth.get_current_principal)
+):
+    """
+    Reports how many message bytes fit in a PNG for every stego mode.
+    Only the PNG header (IHDR) is read; pixels are not decoded.
+    """
+    info = await _inspect_png(image)
+    return {
+        "width": info["width"],
+        "height": info["height"],
+        "modes": crypto.stego_capacity_table(info["width"], info["height"])
+    }
+
 @app.post("/crypto/image/hide")
 async def hide_stego_message(
     message: str = Form(...),
     image: UploadFile = File(...),
-    current_user: models.UserInDB = Depends(auth.get_current_user)
+    bits_per_channel: int = Form(1),
+    use_alpha: bool = Form(False),
+    current_user: models.Principal = Depends(auth.get_current_principal)
 ):
     """
     Hides a secret message in an image (LSB Steganography).
+    `bits_per_channel` (1-4) and `use_alpha` trade invisibility for capacity.
     Returns the new stego image.
     """
     if not image.filename.endswith(".png"):
         raise HTTPException(status_code=400, detail="Only PNG images are supported.")
+    _check_stego_mode(bits_per_channel)
+    await _preflight_stego_carrier(image, message, bits_per_channel, use_alpha)
     
     try:
         image_bytes = await image.read()
-        stego_image_bytes = crypto.stego_hide_message(image_bytes, message)
+        stego_image_bytes = await _run_crypto(
+            crypto.stego_hide_message, image_bytes, message,
+            bits_per_channel, use_alpha
+        )
         
         # Return as a file stream
         return StreamingResponse(
@@ -178,21 +720,29 @@ async def hide_stego_message(
             media_type="image/png",
             headers={"Content-Disposition": "attachment; filename=stego_image.png"}
         )
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 @app.post("/crypto/image/extract", response_model=Dict[str, str])
 async def extract_stego_message(
     image: UploadFile = File(...),
-    current_user: models.UserInDB = Depends(auth.get_current_user)
+    current_user: models.Principal = Depends(auth.get_current_principal)
 ):
     """
-    Extracts a secret message from a stego image.
+    Extracts a secret message from a stego image. Any format PIL reads is
+    accepted; PNG input is size-checked from its header first.
     """
+    await _inspect_png(image, require_png=False)
     try:
         stego_bytes = await image.read()
-        extracted_message = crypto.stego_extract_message(stego_bytes)
+        extracted_message = await _run_crypto(
+            crypto.stego_extract_message, stego_bytes
+        )
         return {"message": extracted_message}
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
@@ -200,80 +750,119 @@ async def extract_stego_message(
 async def encrypt_file_aes(
     password: str = Form(...),
     file: UploadFile = File(...),
-    current_user: models.UserInDB = Depends(auth.get_current_user)
+    current_user: models.Principal = Depends(auth.get_current_principal)
 ):
     """
     Encrypts a file using AES-256-GCM.
     Returns the encrypted file.
     """
+    src_path = await _save_upload(file)
+    dst_path = _temp_path(".enc")
     try:
-        file_bytes = await file.read()
-        encrypted_bytes = crypto.aes_encrypt_file(file_bytes, password)
+        await _run_crypto(crypto.aes_encrypt_path, src_path, dst_path, password)
         new_filename = f"{file.filename}.enc"
         
-        return StreamingResponse(
-            io.BytesIO(encrypted_bytes),
+        return FileResponse(
+            dst_path,
             media_type="application/octet-stream",
-            headers={"Content-Disposition": f"attachment; filename={new_filename}"}
+            headers={"Content-Disposition": f"attachment; filename={new_filename}"},
+            background=BackgroundTask(_remove_quietly, dst_path)
         )
+    except HTTPException:
+        _remove_quietly(dst_path)
+        raise
     except Exception as e:
+        _remove_quietly(dst_path)
         raise HTTPException(status_code=500, detail=str(e))
+    finally:
+        _remove_quietly(src_path)
 
 @app.post("/crypto/file/decrypt")
 async def decrypt_file_aes(
     password: str = Form(...),
     file: UploadFile = File(...),
-    current_user: models.UserInDB = Depends(auth.get_current_user)
+    current_user: models.Principal = Depends(auth.get_current_principal)
 ):
     """
     Decrypts an AES-256-GCM encrypted file.
     Returns the original file.
     """
+    src_path = await _save_upload(file)
+    dst_path = _temp_path()
     try:
-        encrypted_file_bytes = await file.read()
-        decrypted_bytes = crypto.aes_decrypt_file(encrypted_file_bytes, password)
+        await _run_crypto(crypto.aes_decrypt_path, src_path, dst_path, password)
         
         if file.filename.endswith(".enc"):
             new_filename = file.filename[:-4]
         else:
             new_filename = f"decrypted_{file.filename}"
             
-        return StreamingResponse(
-            io.BytesIO(decrypted_bytes),
+        return FileResponse(
+            dst_path,
             media_type="application/octet-stream",
-            headers={"Content-Disposition": f"attachment; filename={new_filename}"}
+            headers={"Content-Disposition": f"attachment; filename={new_filename}"},
+            background=BackgroundTask(_remove_quietly, dst_path)
         )
+    except HTTPException:
+        _remove_quietly(dst_path)
+        raise
     except Exception as e:
+        _remove_quietly(dst_path)
         raise HTTPException(
             status_code=400, 
             detail="DECRYPTION FAILED. Password wrong or file corrupted."
         )
+    finally:
+        _remove_quietly(src_path)
 
 # --- 3. Secure Messaging Endpoints (Protected) ---
 
 @app.get("/users", response_model=List[str])
 def get_all_users(
-    current_user: models.UserInDB = Depends(auth.get_current_user)
+    current_user: models.Principal = Depends(auth.get_current_principal)
 ):
     """
     Gets a list of all usernames, excluding the current user.
     """
     return database.get_all_usernames(exclude_user=current_user['username'])
 
-@app.get("/messages/inbox", response_model=List[models.MessageInDB])
+def _encode_inbox_cursor(message):
+    raw = f"{message['timestamp']}|{message['id']}".encode("utf-8")
+    return base64.urlsafe_b64encode(raw).decode("ascii")
+
+def _decode_inbox_cursor(cursor):
+    try:
+        timestamp, message_id = base64.urlsafe_b64decode(cursor.encode("ascii")).decode("utf-8").rsplit("|", 1)
+        return timestamp, int(message_id)
+    except Exception:
+        raise HTTPException(status_code=400, detail="Invalid inbox cursor.")
+
+@app.get("/messages/inbox", response_model=models.InboxPage)
 def get_inbox(
-    current_user: models.UserInDB = Depends(auth.get_current_user)
+    limit: int = Query(INBOX_DEFAULT_PAGE_SIZE, ge=1, le=INBOX_MAX_PAGE_SIZE),
+    before: Optional[str] = None,
+    current_user: models.Principal = Depends(auth.get_current_principal)
 ):
     """
-    Gets the current user's message inbox (metadata only).
+    Gets one page of the current user's message inbox (metadata only),
+    newest first. Pass the returned `next_cursor` as `before` to get the
+    next (older) page; it is null on the last page.
     """
-    messages = database.get_messages_for_user(current_user['username'])
-    return messages
+    before_key = _decode_inbox_cursor(before) if before else None
+    # Fetch one extra row to know whether another page exists
+    messages = database.get_messages_for_user(
+        current_user['username'], limit=limit + 1, before=before_key
+    )
+    next_cursor = None
+    if len(messages) > limit:
+        messages = messages[:limit]
+        next_cursor = _encode_inbox_cursor(messages[-1])
+    return {"messages": messages, "next_cursor": next_cursor}
 
 @app.post("/messages/send/text", response_model=Dict[str, str])
 def send_text_message(
     req: models.MessageSendText,
-    current_user: models.UserInDB = Depends(auth.get_current_user)
+    current_user: models.Principal = Depends(auth.get_current_principal)
 ):
     """
     Encrypts and sends a 'Super Encrypted Text' message.
@@ -300,18 +889,26 @@ async def send_stego_message(
     recipient: str = Form(...),
     message: str = Form(...),
     image: UploadFile = File(...),
-    current_user: models.UserInDB = Depends(auth.get_current_user)
+    bits_per_channel: int = Form(1),
+    use_alpha: bool = Form(False),
+    current_user: models.Principal = Depends(auth.get_current_principal)
 ):
     """
     Creates and sends a Steganography image message.
     """
     if not image.filename.endswith(".png"):
         raise HTTPException(status_code=400, detail="Only PNG images are supported.")
+    _check_stego_mode(bits_per_channel)
+    await _preflight_stego_carrier(image, message, bits_per_channel, use_alpha)
     try:
         image_bytes = await image.read()
-        stego_image_bytes = crypto.stego_hide_message(image_bytes, message)
+        stego_image_bytes = await _run_crypto(
+            crypto.stego_hide_message, image_bytes, message,
+            bits_per_channel, use_alpha
+        )
         
-        success, msg = database.send_message(
+        success, msg = await run_in_threadpool(
+            database.send_message,
             sender=current_user['username'],
             recipient=recipient,
             msg_type="Gambar Steganografi",
@@ -321,6 +918,8 @@ async def send_stego_message(
         if not success:
             raise HTTPException(status_code=500, detail=msg)
         return {"detail": msg}
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
@@ -329,57 +928,378 @@ async def send_aes_message(
     recipient: str = Form(...),
     password: str = Form(...),
     file: UploadFile = File(...),
-    current_user: models.UserInDB = Depends(auth.get_current_user)
+    current_user: models.Principal = Depends(auth.get_current_principal)
 ):
     """
     Encrypts and sends an AES file message.
     """
+    src_path = await _save_upload(file)
+    dst_path = _temp_path(".enc")
     try:
-        file_bytes = await file.read()
-        encrypted_bytes = crypto.aes_encrypt_file(file_bytes, password)
+        await _run_crypto(crypto.aes_encrypt_path, src_path, dst_path, password)
         
-        success, msg = database.send_message(
+        success, msg = await run_in_threadpool(
+            database.send_message,
             sender=current_user['username'],
             recipient=recipient,
             msg_type="File AES",
-            data=encrypted_bytes,
+            data_path=dst_path,
             filename=f"{file.filename}.enc"
         )
         if not success:
             raise HTTPException(status_code=500, detail=msg)
         return {"detail": msg}
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
+    finally:
+        _remove_quietly(src_path)
+        _remove_quietly(dst_path)
+
+def _parse_byte_range(range_header, size):
+    """
+    Parses a single `bytes=` range into (start, end_exclusive).
+    Returns None when the header should be ignored (other units, multiple
+    ranges, bad syntax) and raises 416 when the range is unsatisfiable.
+    """
+    units, _, spec = range_header.partition("=")
+    if units.strip().lower() != "bytes" or "," in spec:
+        return None
+    first, separator, last = spec.strip().partition("-")
+    if not separator:
+        return None
+    try:
+        if first == "":
+            # Suffix range: the last N bytes
+            start, end = max(0, size - int(last)), size
+            if int(last) <= 0:
+                start = size
+        else:
+            start = int(first)
+            end = min(int(last) + 1, size) if last else size
+            if last and int(last) < start:
+                return None
+    except ValueError:
+        return None
+    if start >= size or start >= end:
+        raise HTTPException(
+            status_code=416,
+            detail="Requested range not satisfiable.",
+            headers={"Content-Range": f"bytes */{size}"}
+        )
+    return start, end
+
+def _iter_file_range(file_obj, start, length):
+    try:
+        file_obj.seek(start)
+        remaining = length
+        while remaining > 0:
+            chunk = file_obj.read(min(STREAM_CHUNK_SIZE, remaining))
+            if not chunk:
+                break
+            remaining -= len(chunk)
+            yield chunk
+    finally:
+        file_obj.close()
 
 @app.get("/messages/{message_id}/data")
 async def get_message_data(
     message_id: int,
-    current_user: models.UserInDB = Depends(auth.get_current_user)
+    request: Request,
+    current_user: models.Principal = Depends(auth.get_current_principal)
 ):
     """
     Downloads the raw encrypted data/file for a specific message.
     The client is responsible for decrypting this.
+    Supports `Range` / `If-Range` (206 Partial Content) against a strong
+    ETag derived from the payload's SHA-256, so downloads can be resumed.
     """
-    message = database.get_message_by_id_for_user(
-        message_id, current_user['username']
+    message = await run_in_threadpool(
+        database.get_message_info_for_user, message_id, current_user['username']
     )
     if not message:
         raise HTTPException(status_code=404, detail="Message not found or unauthorized.")
 
-    sender, msg_type, encrypted_data_blob, filename = message
-    
+    msg_type = message['message_type']
     mime_type = "application/octet-stream"
     if msg_type == "Gambar Steganografi":
         mime_type = "image/png"
     elif msg_type == "Teks Super Enkripsi":
         mime_type = "text/plain"
 
+    storage_key = message['storage_key']
+    blob_sha256 = message['blob_sha256']
+    if blob_sha256 is None and not storage_key:
+        # Older inline rows: hash once, then it is stored with the row
+        blob_sha256 = await run_in_threadpool(
+            database.compute_inline_blob_sha256, message['id']
+        )
+    etag = f'"{blob_sha256}"'
+    headers = {
+        "Content-Disposition": f"attachment; filename={message['original_filename']}",
+        "ETag": etag,
+        "Accept-Ranges": "bytes"
+    }
+
+    if etag in (tag.strip() for tag in request.headers.get("if-none-match", "").split(",")):
+        return Response(status_code=304, headers={"ETag": etag})
+
+    inline_payload = None
+    if not storage_key:
+        # Size and content come from one SQLite read snapshot, so a
+        # concurrent migration to the blob store can't truncate the stream
+        inline_payload = await run_in_threadpool(database.open_inline_payload, message['id'])
+        if inline_payload is None:
+            # Migrated since the metadata was read: serve from the blob store
+            message = await run_in_threadpool(
+                database.get_message_info_for_user, message_id, current_user['username']
+            )
+            if not message or not message['storage_key']:
+                raise HTTPException(status_code=404, detail="Message not found or unauthorized.")
+            storage_key = message['storage_key']
+
+    if storage_key:
+        blob_path = database.blob_store.local_path(storage_key)
+        if blob_path is not None:
+            # Served straight from disk (sendfile where the server supports
+            # it); FileResponse handles Range / If-Range against our ETag
+            return FileResponse(blob_path, media_type=mime_type, headers=headers)
+        size = database.blob_store.size(storage_key)
+    else:
+        size = inline_payload.size
+
+    byte_range = None
+    range_header = request.headers.get("range")
+    if_range = request.headers.get("if-range")
+    if range_header and (if_range is None or if_range == etag):
+        try:
+            byte_range = _parse_byte_range(range_header, size)
+        except HTTPException:
+            if inline_payload is not None:
+                inline_payload.close()
+            raise
+    start, end = byte_range if byte_range else (0, size)
+    headers["Content-Length"] = str(end - start)
+    status_code = 200
+    if byte_range:
+        status_code = 206
+        headers["Content-Range"] = f"bytes {start}-{end - 1}/{size}"
+
+    if storage_key:
+        body = _iter_file_range(database.blob_store.open(storage_key), start, end - start)
+    else:
+        # Inline payload: streamed from SQLite in fixed-size chunks, so memory
+        # per download is one chunk regardless of payload size
+        body = inline_payload.iter_range(start, end - start, STREAM_CHUNK_SIZE)
     return StreamingResponse(
-        io.BytesIO(encrypted_data_blob),
+        body,
+        status_code=status_code,
         media_type=mime_type,
-        headers={"Content-Disposition": f"attachment; filename={filename}"}
+        headers=headers
     )
 
+# --- 4. Resumable Uploads (Protected) ---
+# Create a session, PUT numbered chunks (0-based, raw request body) in any
+# order, check GET /uploads/{id} after a dropped connection to see which
+# chunks are missing, then finalize to encrypt and send or download.
+
+def _upload_status(manifest):
+    return {
+        "upload_id": manifest["upload_id"],
+        "filename": manifest["filename"],
+        "total_size": manifest["total_size"],
+        "chunk_size": manifest["chunk_size"],
+        "chunk_count": manifest["chunk_count"],
+        "received_ranges": uploads.chunk_ranges(manifest["received"]),
+        "missing_ranges": uploads.missing_chunk_ranges(manifest),
+        "missing_count": uploads.missing_chunk_count(manifest),
+        "expires_at": manifest["updated_at"] + UPLOAD_SESSION_TTL_SECONDS
+    }
+
+def _upload_http_error(e):
+    if isinstance(e, uploads.UploadNotFound):
+        return HTTPException(status_code=404, detail=str(e))
+    if isinstance(e, uploads.UploadConflict):
+        return HTTPException(status_code=409, detail=str(e))
+    return HTTPException(status_code=400, detail=str(e))
+
+@app.post("/uploads", response_model=models.UploadStatus)
+def create_upload(
+    req: models.UploadCreateRequest,
+    current_user: models.Principal = Depends(auth.get_current_principal)
+):
+    """
+    Starts a resumable upload session for a file of `total_size` bytes.
+    """
+    try:
+        manifest = upload_store.create(
+            current_user['username'], req.filename, req.total_size,
+            req.chunk_size or UPLOAD_CHUNK_SIZE
+        )
+    except uploads.UploadError as e:
+        raise _upload_http_error(e)
+    return _upload_status(manifest)
+
+@app.put("/uploads/{upload_id}/chunks/{index}", response_model=models.UploadStatus)
+async def put_upload_chunk(
+    upload_id: str,
+    index: int,
+    request: Request,
+    current_user: models.Principal = Depends(auth.get_current_principal)
+):
+    """
+    Stores one chunk (the raw request body). Every chunk but the last must
+    be exactly `chunk_size` bytes. Re-sending a chunk replaces it.
+    """
+    try:
+        manifest, expected_size, tmp_path = await run_in_threadpool(
+            upload_store.open_chunk, upload_id, current_user['username'], index
+        )
+    except uploads.UploadError as e:
+        raise _upload_http_error(e)
+
+    # File I/O runs in the threadpool, never on the event loop; the body is
+    # gathered into UPLOAD_WRITE_BUFFER_SIZE writes to keep hand-offs few
+    received = 0
+    try:
+        out = await run_in_threadpool(open, tmp_path, "wb")
+        try:
+            buffer = bytearray()
+            async for piece in request.stream():
+                received += len(piece)
+                if received > expected_size:
+                    break
+                buffer += piece
+                if len(buffer) >= UPLOAD_WRITE_BUFFER_SIZE:
+                    await run_in_threadpool(out.write, buffer)
+                    buffer.clear()
+            if buffer and received <= expected_size:
+                await run_in_threadpool(out.write, buffer)
+        finally:
+            await run_in_threadpool(out.close)
+        if received != expected_size:
+            raise HTTPException(
+                status_code=400,
+                detail=f"Chunk {index} must be {expected_size} bytes, got {received}."
+            )
+        manifest = await run_in_threadpool(
+            upload_store.commit_chunk, upload_id, current_user['username'], index, tmp_path
+        )
+    except uploads.UploadError as e:
+        raise _upload_http_error(e)
+    finally:
+        await run_in_threadpool(uploads.discard_file, tmp_path)
+    return _upload_status(manifest)
+
+@app.get("/uploads/{upload_id}", response_model=models.UploadStatus)
+def get_upload_status(
+    upload_id: str,
+    current_user: models.Principal = Depends(auth.get_current_principal)
+):
+    """
+    Reports which chunks have been received, so an interrupted upload can
+    resume with only the missing ones.
+    """
+    try:
+        return _upload_status(upload_store.status(upload_id, current_user['username']))
+    except uploads.UploadError as e:
+        raise _upload_http_error(e)
+
+@app.delete("/uploads/{upload_id}", response_model=Dict[str, str])
+def delete_upload(
+    upload_id: str,
+    current_user: models.Principal = Depends(auth.get_current_principal)
+):
+    """
+    Cancels an upload session and deletes its chunks.
+    """
+    try:
+        upload_store.delete(upload_id, current_user['username'])
+    except uploads.UploadError as e:
+        raise _upload_http_error(e)
+    return {"detail": "Upload cancelled."}
+
+@app.post("/uploads/{upload_id}/finalize")
+async def finalize_upload(
+    upload_id: str,
+    req: models.UploadFinalizeRequest,
+    current_user: models.Principal = Depends(auth.get_current_principal)
+):
+    """
+    Encrypts the completed upload with AES-256-GCM. With `recipient` it is
+    sent as an AES file message; without it the encrypted file is returned.
+    The session is deleted on success.
+    """
+    username = current_user['username']
+    try:
+        session_dir, manifest = await run_in_threadpool(
+            upload_store.begin_finalize, upload_id, username
+        )
+    except uploads.UploadError as e:
+        raise _upload_http_error(e)
+
+    try:
+        dst_path = await run_in_threadpool(_temp_path, ".enc")
+    except Exception:
+        await run_in_threadpool(upload_store.abort_finalize, upload_id, username)
+        raise
+    new_filename = f"{manifest['filename']}.enc"
+    try:
+        await _run_crypto(
+            uploads.encrypt_session, session_dir, manifest["chunk_count"],
+            dst_path, req.password
+        )
+        if req.recipient:
+            success, msg = await run_in_threadpool(
+                database.send_message,
+                sender=username,
+                recipient=req.recipient,
+                msg_type="File AES",
+                data_path=dst_path,
+                filename=new_filename
+            )
+            if not success:
+                raise HTTPException(status_code=500, detail=msg)
+            await run_in_threadpool(_remove_quietly, dst_path)
+            await run_in_threadpool(upload_store.delete, upload_id)
+            return {"detail": msg}
+
+        await run_in_threadpool(upload_store.delete, upload_id)
+        return FileResponse(
+            dst_path,
+            media_type="application/octet-stream",
+            headers={"Content-Disposition": f"attachment; filename={new_filename}"},
+            background=BackgroundTask(_remove_quietly, dst_path)
+        )
+    except Exception as e:
+        # Keep the chunks so the client can retry the finalize
+        await run_in_threadpool(_remove_quietly, dst_path)
+        await run_in_threadpool(upload_store.abort_finalize, upload_id, username)
+        if isinstance(e, HTTPException):
+            raise
+        raise HTTPException(status_code=500, detail=str(e))
+
+# --- 5. Metrics (Protected) ---
+
+@app.get("/metrics", response_model=Dict[str, Any])
+def get_metrics(
+    current_user: models.Principal = Depends(auth.get_current_principal)
+):
+    """
+    In-process performance counters of this API worker.
+    """
+    return {
+        "aes_key_cache": crypto.key_cache_stats(),
+        "user_cache": database.user_cache_stats(),
+        "token_revocations": auth.revocation_stats(),
+        "crypto_executor": crypto_executor.stats(),
+        "password_hashing": password_executor.stats(),
+        "login_throttle": login_throttle.stats(),
+        "face_identify_throttle": face_identify_throttle.stats(),
+        "face_index": enrolled_faces.stats()
+    }
+
 # --- Run the app (for debugging) ---
 if __name__ == "__main__":
     uvicorn.run("main:app", host="127.0.0.1", port=8000, reload=True)
\ No newline at end of file
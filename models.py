@@ -1,5 +1,5 @@
 # schemas.py
-from pydantic import BaseModel
+from pydantic import BaseModel, Field
 from typing import Optional, List
 
 # --- User & Auth Models ---
@@ -9,21 +9,50 @@ class UserBase(BaseModel):
 
 class UserCreate(UserBase):
     password: str
-    face_encoding_json: str # Client sends pre-computed encoding
+    # Client sends pre-computed encoding: JSON list (lama) atau base64 dari
+    # format biner face_codec. Salah satu wajib diisi.
+    face_encoding_json: Optional[str] = None
+    face_encoding_b64: Optional[str] = None
 
 class UserInDB(UserBase):
-    face_encoding_json: str
+    face_encoding_json: Optional[str] = None
+    face_encoding_b64: Optional[str] = None
 
 class Token(BaseModel):
     access_token: str
     token_type: str
+    refresh_token: Optional[str] = None
+    expires_in: Optional[int] = None # Umur access token (detik)
+
+class TokenRefreshRequest(BaseModel):
+    refresh_token: str
+
+class LogoutRequest(BaseModel):
+    refresh_token: Optional[str] = None
 
 class TokenData(BaseModel):
     username: Optional[str] = None
 
+class Principal(UserBase):
+    pass # Identitas pemanggil tanpa face encoding (auth.get_current_principal)
+
 class UserDeleteConfirm(BaseModel):
     password: str
 
+class FaceIdentifyRequest(BaseModel):
+    # Encoding probe, dihitung di client (JSON list atau base64 biner)
+    face_encoding_json: Optional[str] = None
+    face_encoding_b64: Optional[str] = None
+    top_k: int = Field(5, ge=1, le=50)
+    min_similarity: Optional[float] = None # Tidak bisa di bawah batas minimal server
+
+class FaceMatch(BaseModel):
+    username: str
+    similarity: float
+
+class FaceIdentifyResponse(BaseModel):
+    matches: List[FaceMatch]
+
 # --- Crypto Tool Models ---
 
 class TextEncryptRequest(BaseModel):
@@ -36,6 +65,42 @@ class TextDecryptRequest(BaseModel):
     caesar_shift: int
     xor_key: str
 
+# Jumlah item maksimum per request :batch; divalidasi saat parsing, jadi
+# request yang melebihi batas tidak sempat dibangun menjadi ribuan model.
+# Ini satu-satunya tempat batas ini diatur: nilainya terkunci saat model di
+# bawah didefinisikan, jadi mengubahnya setelah import tidak berpengaruh.
+MAX_TEXT_BATCH_ITEMS = 1000
+
+class TextEncryptBatchRequest(BaseModel):
+    items: List[TextEncryptRequest] = Field(..., max_length=MAX_TEXT_BATCH_ITEMS)
+
+class TextDecryptBatchRequest(BaseModel):
+    items: List[TextDecryptRequest] = Field(..., max_length=MAX_TEXT_BATCH_ITEMS)
+
+class TextEncryptBatchResult(BaseModel):
+    ciphertext: Optional[str] = None
+    error: Optional[str] = None
+
+class TextDecryptBatchResult(BaseModel):
+    plaintext: Optional[str] = None
+    error: Optional[str] = None
+
+class TextEncryptBatchResponse(BaseModel):
+    results: List[TextEncryptBatchResult]
+
+class TextDecryptBatchResponse(BaseModel):
+    results: List[TextDecryptBatchResult]
+
+class StegoCapacityMode(BaseModel):
+    bits_per_channel: int
+    use_alpha: bool
+    capacity_bytes: int
+
+class StegoCapacityResponse(BaseModel):
+    width: int
+    height: int
+    modes: List[StegoCapacityMode]
+
 # --- Messaging Models ---
 
 class MessageSendText(BaseModel):
@@ -46,7 +111,32 @@ class MessageSendText(BaseModel):
 
 class MessageInDB(BaseModel):
     id: int
-    sender_username: str
+    sender_username: Optional[str] = None # NULL jika pengirim sudah dihapus
     message_type: str
     original_filename: Optional[str] = None
-    timestamp: str
\ No newline at end of file
+    timestamp: str
+
+class InboxPage(BaseModel):
+    messages: List[MessageInDB]
+    next_cursor: Optional[str] = None
+# --- Chunked Upload Models ---
+
+class UploadCreateRequest(BaseModel):
+    filename: str
+    total_size: int
+    chunk_size: Optional[int] = None # Default: UPLOAD_CHUNK_SIZE di server
+
+class UploadStatus(BaseModel):
+    upload_id: str
+    filename: str
+    total_size: int
+    chunk_size: int
+    chunk_count: int
+    received_ranges: List[List[int]] # Rentang indeks [awal, akhir] inklusif
+    missing_ranges: List[List[int]]
+    missing_count: int
+    expires_at: float
+
+class UploadFinalizeRequest(BaseModel):
+    password: str
+    recipient: Optional[str] = None # Kosong: file terenkripsi dikembalikan langsung
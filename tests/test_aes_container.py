@@ -0,0 +1,155 @@
+# Regresi untuk format kontainer AES streaming (lihat crypto.aes_encrypt_stream):
+# round-trip, deteksi frame yang ditukar / dipotong / ditambah, header yang
+# diubah, password salah, dan kompatibilitas dengan blob format lama
+# (encoder lama disalin di bawah sebagai referensi).
+import io
+import os
+
+import pytest
+from cryptography.hazmat.backends import default_backend
+from cryptography.hazmat.primitives.ciphers import Cipher, algorithms, modes
+
+import crypto
+
+PASSWORD = "kata sandi"
+FRAME_SIZE = 64 # Kecil agar banyak frame tanpa data besar
+HEADER_SIZE = crypto._AES_STREAM_HEADER.size
+SEALED_SIZE = FRAME_SIZE + crypto._AES_TAG_SIZE
+
+
+def reference_aes_encrypt_legacy(file_bytes, password, salt=None):
+    salt = os.urandom(16) if salt is None else salt
+    nonce = os.urandom(12)
+    key = crypto.get_aes_key_from_password(password, salt)
+    encryptor = Cipher(algorithms.AES(key), modes.GCM(nonce), backend=default_backend()).encryptor()
+    encrypted_data = encryptor.update(file_bytes) + encryptor.finalize()
+    return salt + nonce + encryptor.tag + encrypted_data
+
+
+def encrypt(data, password=PASSWORD, frame_size=FRAME_SIZE):
+    return b''.join(crypto.aes_encrypt_stream([data], password, frame_size))
+
+
+def split_frames(blob):
+    """-> (header, [frame terenkripsi, ...])"""
+    body = blob[HEADER_SIZE:]
+    return blob[:HEADER_SIZE], [body[i:i + SEALED_SIZE] for i in range(0, len(body), SEALED_SIZE)]
+
+
+def assert_rejected(blob, password=PASSWORD):
+    with pytest.raises(ValueError):
+        crypto.aes_decrypt_file(blob, password)
+
+
+@pytest.mark.parametrize("size", [0, 1, FRAME_SIZE - 1, FRAME_SIZE, FRAME_SIZE + 1, 5 * FRAME_SIZE, 5 * FRAME_SIZE + 7])
+def test_round_trip(size):
+    data = os.urandom(size)
+    blob = encrypt(data)
+    assert blob[:4] == crypto.AES_STREAM_MAGIC
+    # Frame terakhir selalu ada (boleh kosong)
+    frame_count = max(1, -(-size // FRAME_SIZE))
+    assert len(blob) == HEADER_SIZE + size + frame_count * crypto._AES_TAG_SIZE
+    assert crypto.aes_decrypt_file(blob, PASSWORD) == data
+
+
+@pytest.mark.parametrize("piece_size", [1, 7, SEALED_SIZE, 1000])
+def test_stream_decrypt_independent_of_chunking(piece_size):
+    data = os.urandom(3 * FRAME_SIZE + 5)
+    blob = encrypt(data)
+    pieces = [blob[i:i + piece_size] for i in range(0, len(blob), piece_size)]
+    assert b''.join(crypto.aes_decrypt_stream(pieces, PASSWORD)) == data
+
+
+def test_fileobj_round_trip_default_frame_size():
+    data = os.urandom(2 * crypto.AES_STREAM_FRAME_SIZE + 3)
+    encrypted, decrypted = io.BytesIO(), io.BytesIO()
+    crypto.aes_encrypt_fileobj(io.BytesIO(data), encrypted, PASSWORD)
+    encrypted.seek(0)
+    crypto.aes_decrypt_fileobj(encrypted, decrypted, PASSWORD)
+    assert decrypted.getvalue() == data
+
+
+def test_reordered_frames_are_rejected():
+    header, frames = split_frames(encrypt(os.urandom(4 * FRAME_SIZE + 1)))
+    frames[0], frames[1] = frames[1], frames[0]
+    assert_rejected(header + b''.join(frames))
+
+
+def test_truncated_frame_is_rejected():
+    blob = encrypt(os.urandom(3 * FRAME_SIZE + 10))
+    assert_rejected(blob[:-1])
+    assert_rejected(blob[:HEADER_SIZE + crypto._AES_TAG_SIZE - 1])
+
+
+def test_dropping_the_final_frame_is_rejected():
+    # Setiap frame yang tersisa utuh, tetapi tidak ada yang bertanda terakhir
+    header, frames = split_frames(encrypt(os.urandom(3 * FRAME_SIZE + 10)))
+    assert_rejected(header + b''.join(frames[:-1]))
+    header, frames = split_frames(encrypt(os.urandom(3 * FRAME_SIZE)))
+    assert_rejected(header + b''.join(frames[:-1]))
+
+
+def test_data_after_the_final_frame_is_rejected():
+    blob = encrypt(os.urandom(2 * FRAME_SIZE + 10))
+    _, frames = split_frames(blob)
+    assert_rejected(blob + frames[0])
+    assert_rejected(blob + b'\x00')
+
+
+def test_header_is_authenticated():
+    blob = bytearray(encrypt(os.urandom(FRAME_SIZE + 1)))
+    blob[HEADER_SIZE - 1] ^= 1 # Byte terakhir prefix nonce
+    assert_rejected(bytes(blob))
+
+
+def test_frames_cannot_be_spliced_between_containers():
+    data = os.urandom(2 * FRAME_SIZE + 1)
+    header_a, frames_a = split_frames(encrypt(data))
+    _, frames_b = split_frames(encrypt(data))
+    assert_rejected(header_a + frames_b[0] + b''.join(frames_a[1:]))
+
+
+@pytest.mark.parametrize("field, value", [
+    ("version", 99),
+    ("frame_size", 0),
+    ("frame_size", crypto.AES_STREAM_MAX_FRAME_SIZE + 1),
+])
+def test_invalid_header_fields_are_rejected(field, value):
+    magic, version, frame_size, salt, prefix = crypto._AES_STREAM_HEADER.unpack(encrypt(b'abc')[:HEADER_SIZE])
+    fields = {"version": version, "frame_size": frame_size}
+    fields[field] = value
+    header = crypto._AES_STREAM_HEADER.pack(magic, fields["version"], fields["frame_size"], salt, prefix)
+    with pytest.raises(crypto.AESStreamHeaderError):
+        b''.join(crypto.aes_decrypt_stream([header + b'\x00' * 32], PASSWORD))
+
+
+@pytest.mark.parametrize("size", [0, 1, 1000])
+def test_legacy_blobs_still_decrypt(size):
+    data = os.urandom(size)
+    legacy = reference_aes_encrypt_legacy(data, PASSWORD)
+    assert crypto.aes_decrypt_file(legacy, PASSWORD) == data
+    assert b''.join(crypto.aes_decrypt_stream([legacy], PASSWORD)) == data
+
+
+def test_legacy_blob_whose_salt_looks_like_the_magic():
+    data = b'isi file lama'
+    legacy = reference_aes_encrypt_legacy(data, PASSWORD, salt=crypto.AES_STREAM_MAGIC + b'\xff' * 12)
+    assert crypto.aes_decrypt_file(legacy, PASSWORD) == data
+
+
+def test_legacy_blob_with_wrong_password_is_rejected():
+    assert_rejected(reference_aes_encrypt_legacy(b'data', PASSWORD), "salah")
+
+
+def test_wrong_password_derives_the_key_once(monkeypatch):
+    blob = encrypt(os.urandom(FRAME_SIZE + 1))
+    calls = []
+    derive = crypto.get_aes_key_from_password
+
+    def counting_derive(password, salt, *args, **kwargs):
+        calls.append(salt)
+        return derive(password, salt, *args, **kwargs)
+
+    monkeypatch.setattr(crypto, "get_aes_key_from_password", counting_derive)
+    assert_rejected(blob, "salah")
+    assert len(calls) == 1
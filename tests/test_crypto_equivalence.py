@@ -0,0 +1,128 @@
+# Membuktikan bahwa encrypt_caesar / encrypt_decrypt_xor versi tabel dan
+# NumPy menghasilkan output yang identik byte-per-byte dengan implementasi
+# loop lama (disalin di bawah sebagai oracle referensi).
+import base64
+import random
+
+import pytest
+
+import crypto
+
+
+def reference_encrypt_caesar(text, shift):
+    result = ""
+    for char in text:
+        if 'a' <= char <= 'z':
+            shifted_char = chr(((ord(char) - ord('a') + shift) % 26) + ord('a'))
+        elif 'A' <= char <= 'Z':
+            shifted_char = chr(((ord(char) - ord('A') + shift) % 26) + ord('A'))
+        else:
+            shifted_char = char
+        result += shifted_char
+    return result
+
+
+def reference_encrypt_decrypt_xor(data_bytes, key):
+    key_bytes = key.encode('utf-8')
+    key_len = len(key_bytes)
+    output_bytes = bytearray()
+    for i in range(len(data_bytes)):
+        output_bytes.append(data_bytes[i] ^ key_bytes[i % key_len])
+    return bytes(output_bytes)
+
+
+ALPHABET = (
+    "abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZ0123456789 .,!?\n\t"
+    "äöüßéèñçÄÖÜÉ" # Latin non-ASCII
+    "ŁżźśĆ" "αβγΩ" "абвЖ" "日本語한국어" "😀🔐" # Multi-byte UTF-8
+)
+
+TEXTS = [
+    "",
+    "a",
+    "Hello, World!",
+    "The quick brown fox jumps over the lazy dog",
+    "Zebra zOo yAk",
+    "Grüße aus München — ça va? 日本語 😀",
+    "\x00\x7f\u0080￿",
+]
+
+SHIFTS = [0, 1, 3, 13, 25, 26, 27, -1, -3, -26, -27, 52, 1000, -1000, 10**9 + 7, -(10**12)]
+
+KEYS = ["k", "key", "kunci rahasia", "ключ", "🔑", "x" * 1000]
+
+
+def random_text(rng, max_length=200):
+    return "".join(rng.choice(ALPHABET) for _ in range(rng.randrange(max_length)))
+
+
+@pytest.mark.parametrize("shift", SHIFTS)
+@pytest.mark.parametrize("text", TEXTS)
+def test_caesar_matches_reference(text, shift):
+    assert crypto.encrypt_caesar(text, shift) == reference_encrypt_caesar(text, shift)
+    assert crypto.decrypt_caesar(text, shift) == reference_encrypt_caesar(text, -shift)
+
+
+def test_caesar_matches_reference_randomized():
+    rng = random.Random(20240501)
+    for _ in range(500):
+        text = random_text(rng)
+        shift = rng.randint(-10**6, 10**6)
+        assert crypto.encrypt_caesar(text, shift) == reference_encrypt_caesar(text, shift)
+        assert crypto.decrypt_caesar(crypto.encrypt_caesar(text, shift), shift) == text
+
+
+@pytest.mark.parametrize("key", KEYS)
+@pytest.mark.parametrize("text", TEXTS)
+def test_xor_matches_reference(text, key):
+    data = text.encode('utf-8')
+    result = crypto.encrypt_decrypt_xor(data, key)
+    assert type(result) is bytes
+    assert result == reference_encrypt_decrypt_xor(data, key)
+
+
+def test_xor_key_longer_than_data():
+    data = b"abc"
+    key = "a much longer key than the data"
+    assert crypto.encrypt_decrypt_xor(data, key) == reference_encrypt_decrypt_xor(data, key)
+
+
+def test_xor_accepts_bytes_like_input():
+    data = bytes(range(256)) * 3
+    expected = reference_encrypt_decrypt_xor(data, "kunci")
+    assert crypto.encrypt_decrypt_xor(bytearray(data), "kunci") == expected
+    assert crypto.encrypt_decrypt_xor(memoryview(data), "kunci") == expected
+
+
+def test_xor_matches_reference_randomized():
+    rng = random.Random(1337)
+    for _ in range(500):
+        data = bytes(rng.randrange(256) for _ in range(rng.randrange(300)))
+        key = random_text(rng, 40) or "k"
+        assert crypto.encrypt_decrypt_xor(data, key) == reference_encrypt_decrypt_xor(data, key)
+
+
+def test_xor_empty_input():
+    assert crypto.encrypt_decrypt_xor(b"", "key") == b""
+    # Data kosong dengan kunci kosong: loop lama tidak pernah membagi dengan nol
+    assert crypto.encrypt_decrypt_xor(b"", "") == reference_encrypt_decrypt_xor(b"", "") == b""
+
+
+def test_xor_empty_key_raises_value_error():
+    # Implementasi lama melempar ZeroDivisionError di sini
+    with pytest.raises(ZeroDivisionError):
+        reference_encrypt_decrypt_xor(b"data", "")
+    with pytest.raises(ValueError):
+        crypto.encrypt_decrypt_xor(b"data", "")
+
+
+@pytest.mark.parametrize("key", KEYS)
+@pytest.mark.parametrize("text", TEXTS)
+def test_super_encrypt_matches_reference(text, key):
+    shift = 7
+    expected_bytes = reference_encrypt_decrypt_xor(
+        reference_encrypt_caesar(text, shift).encode('utf-8'), key
+    )
+    ciphertext = crypto.super_encrypt_text(text, shift, key)
+    assert ciphertext == base64.b64encode(expected_bytes).decode('utf-8')
+    assert crypto.super_decrypt_text(ciphertext, shift, key) == text
@@ -0,0 +1,198 @@
+import math
+import threading
+import time
+from collections import OrderedDict
+
+# --- Login Throttling ---
+# Every password check costs a full bcrypt run. Attempts are rate limited
+# per client IP and per username with token buckets, and repeated failures
+# lock out for an exponentially growing time. A throttled attempt is
+# rejected before any database read or hash, so abusive traffic is cheap
+# to shed while normal logins are unaffected.
+#
+# Lockouts are deliberately scoped so they can't be turned against others:
+# - A failure streak locks the (username, IP) pair, not the username
+#   everywhere, so an attacker who knows a username cannot lock its owner
+#   out from the owner's own address. Guessing one account from many IPs
+#   is still bounded by the per-username token bucket; draining that bucket
+#   delays the owner's logins by at most one refill interval while the
+#   attack lasts, but never causes a long lockout.
+# - IP failures decay over `ip_failure_window_seconds` instead of counting
+#   forever, so a busy shared (NAT / office) address is only locked when
+#   failures arrive faster than `ip_lockout_threshold` per window.
+
+
+class _Bucket:
+    __slots__ = ("tokens", "updated", "failures", "failures_at", "locked_until")
+
+    def __init__(self, tokens, now):
+        self.tokens = tokens
+        self.updated = now
+        self.failures = 0
+        self.failures_at = now
+        self.locked_until = 0.0
+
+
+class _BucketTable:
+    """Token buckets for one kind of key (IP, username or pair), in LRU order."""
+
+    def __init__(self, rate_per_second, burst, max_entries):
+        self.rate = rate_per_second
+        self.burst = burst
+        self.max_entries = max_entries
+        self._buckets = OrderedDict()
+
+    def get(self, key, now):
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            bucket = _Bucket(self.burst, now)
+            self._buckets[key] = bucket
+            if len(self._buckets) > self.max_entries:
+                self._buckets.popitem(last=False)
+        else:
+            bucket.tokens = min(self.burst, bucket.tokens + (now - bucket.updated) * self.rate)
+            bucket.updated = now
+            self._buckets.move_to_end(key)
+        return bucket
+
+    def peek(self, key):
+        return self._buckets.get(key)
+
+    def wait_time(self, bucket, now):
+        """Seconds until `bucket` may be used (lockout or empty bucket)."""
+        if bucket.locked_until > now:
+            return bucket.locked_until - now
+        if bucket.tokens < 1:
+            return (1 - bucket.tokens) / self.rate
+        return 0.0
+
+    def evict_idle(self, now, idle_seconds):
+        """Drops buckets that are full again, not failing and idle; returns the count."""
+        removed = 0
+        for key in list(self._buckets):
+            bucket = self._buckets[key]
+            if now - bucket.updated < idle_seconds:
+                break # LRU order: everything after this is more recent
+            refilled = bucket.tokens + (now - bucket.updated) * self.rate
+            if refilled >= self.burst and bucket.locked_until <= now:
+                del self._buckets[key]
+                removed += 1
+        return removed
+
+    def __len__(self):
+        return len(self._buckets)
+
+
+class LoginThrottle:
+    """
+    Per-IP and per-username login limiter. Call `check()` before verifying
+    a password, then `record_failure()` or `record_success()` with the result.
+
+    After `lockout_threshold` consecutive failures for one username from one
+    IP, that pair is locked for `lockout_base_seconds`, doubling with each
+    further failure up to `lockout_max_seconds`; a success clears the streak.
+    An IP is locked the same way once its failures, decaying linearly to
+    zero over `ip_failure_window_seconds`, reach `ip_lockout_threshold`.
+    """
+
+    def __init__(
+        self,
+        ip_rate_per_minute=30, ip_burst=10,
+        user_rate_per_minute=10, user_burst=5,
+        lockout_threshold=5, lockout_base_seconds=2, lockout_max_seconds=900,
+        ip_lockout_threshold=20, ip_failure_window_seconds=900,
+        max_entries=100000, idle_seconds=3600, evict_interval_seconds=60
+    ):
+        self._ips = _BucketTable(ip_rate_per_minute / 60, ip_burst, max_entries)
+        self._users = _BucketTable(user_rate_per_minute / 60, user_burst, max_entries)
+        # (username, ip) failure streaks; only the lockout fields are used
+        self._pairs = _BucketTable(1.0, 1, max_entries)
+        self.lockout_threshold = lockout_threshold
+        self.ip_lockout_threshold = ip_lockout_threshold
+        self.ip_failure_window_seconds = ip_failure_window_seconds
+        self.lockout_base_seconds = lockout_base_seconds
+        self.lockout_max_seconds = lockout_max_seconds
+        self.idle_seconds = idle_seconds
+        self.evict_interval_seconds = evict_interval_seconds
+        self._lock = threading.Lock()
+        self._next_evict = time.monotonic() + evict_interval_seconds
+        self._allowed = 0
+        self._throttled = 0
+        self._lockouts = 0
+        self._evicted = 0
+
+    def check(self, ip, username):
+        """
+        Consumes one attempt for both keys. Returns 0 if the attempt may go
+        ahead, otherwise the number of seconds to wait (nothing is consumed).
+        """
+        now = time.monotonic()
+        with self._lock:
+            if now >= self._next_evict:
+                self._evict(now)
+            ip_bucket = self._ips.get(ip, now)
+            user_bucket = self._users.get(username, now)
+            wait = max(self._ips.wait_time(ip_bucket, now), self._users.wait_time(user_bucket, now))
+            pair = self._pairs.peek((username, ip))
+            if pair is not None and pair.locked_until > now:
+                wait = max(wait, pair.locked_until - now)
+            if wait > 0:
+                self._throttled += 1
+                return wait
+            ip_bucket.tokens -= 1
+            user_bucket.tokens -= 1
+            self._allowed += 1
+            return 0.0
+
+    def _lock_out(self, bucket, failures, threshold, now):
+        excess = math.ceil(failures) - threshold
+        if excess >= 0:
+            bucket.locked_until = now + min(
+                self.lockout_max_seconds, self.lockout_base_seconds * 2 ** min(excess, 32)
+            )
+            self._lockouts += 1
+
+    def record_failure(self, ip, username):
+        now = time.monotonic()
+        with self._lock:
+            ip_bucket = self._ips.get(ip, now)
+            decay = (now - ip_bucket.failures_at) * self.ip_lockout_threshold / self.ip_failure_window_seconds
+            ip_bucket.failures = max(0.0, ip_bucket.failures - decay) + 1
+            ip_bucket.failures_at = now
+            self._lock_out(ip_bucket, ip_bucket.failures, self.ip_lockout_threshold, now)
+
+            pair = self._pairs.get((username, ip), now)
+            pair.failures += 1
+            self._lock_out(pair, pair.failures, self.lockout_threshold, now)
+
+    def record_success(self, ip, username):
+        """Clears the (username, IP) failure streak. The IP's decaying count
+        is kept, so one valid account cannot be used to unlock guessing
+        against others."""
+        with self._lock:
+            pair = self._pairs.peek((username, ip))
+            if pair is not None:
+                pair.failures = 0
+                pair.locked_until = 0.0
+
+    def _evict(self, now):
+        self._evicted += self._ips.evict_idle(now, self.idle_seconds)
+        self._evicted += self._users.evict_idle(now, self.idle_seconds)
+        self._evicted += self._pairs.evict_idle(now, self.idle_seconds)
+        self._next_evict = now + self.evict_interval_seconds
+
+    def stats(self):
+        with self._lock:
+            return {
+                "allowed": self._allowed,
+                "throttled": self._throttled,
+                "lockouts": self._lockouts,
+                "evicted": self._evicted,
+                "tracked_ips": len(self._ips),
+                "tracked_usernames": len(self._users),
+                "tracked_username_ips": len(self._pairs),
+            }
+
+
+def retry_after_header(wait_seconds):
+    return str(max(1, math.ceil(wait_seconds)))
@@ -0,0 +1,290 @@
+import bisect
+import json
+import os
+import shutil
+import threading
+import time
+import uuid
+
+import crypto
+
+# --- Resumable Chunked Uploads ---
+# Large files are uploaded as numbered chunks into a session directory
+# (`<root>/<upload_id>/`) instead of one multipart request. A client that
+# loses its connection asks for the session status and re-sends only the
+# missing chunks. At finalize the chunks are read back in order and fed to
+# the streaming AES encryptor, so the whole file is never held in memory.
+#
+# A chunk file on disk is the record that it arrived; the manifest is only
+# written at create / finalize, so a chunk PUT costs the same whatever the
+# session size. A minimum chunk size keeps the chunk count (and with it
+# every status reply) small.
+
+MANIFEST_NAME = "manifest.json"
+COPY_CHUNK_SIZE = 64 * 1024
+
+
+class UploadError(Exception):
+    """Invalid request against an upload session (bad index, size, state)."""
+
+
+class UploadNotFound(UploadError):
+    """Unknown or expired session, or one owned by another user."""
+
+
+class UploadConflict(UploadError):
+    """The session is being finalized and no longer accepts changes."""
+
+
+CHUNK_PREFIX = "chunk_"
+
+
+def _chunk_path(session_dir, index):
+    return os.path.join(session_dir, f"{CHUNK_PREFIX}{index:08d}")
+
+
+def _received_chunks(session_dir):
+    """Sorted indices of the chunks committed in `session_dir`."""
+    received = []
+    for name in os.listdir(session_dir):
+        suffix = name[len(CHUNK_PREFIX):]
+        if name.startswith(CHUNK_PREFIX) and suffix.isdigit():
+            received.append(int(suffix))
+    return sorted(received)
+
+
+def iter_session_chunks(session_dir, chunk_count, read_size=COPY_CHUNK_SIZE):
+    """Yields the session's data in upload order, `read_size` bytes at a time."""
+    for index in range(chunk_count):
+        with open(_chunk_path(session_dir, index), "rb") as chunk_file:
+            while True:
+                data = chunk_file.read(read_size)
+                if not data:
+                    break
+                yield data
+
+
+def encrypt_session(session_dir, chunk_count, dst_path, password):
+    """
+    Encrypts the uploaded chunks into `dst_path` (AES stream container).
+    Module-level so it can run in a process pool.
+    """
+    with open(dst_path, "wb") as dst:
+        for frame in crypto.aes_encrypt_stream(
+            iter_session_chunks(session_dir, chunk_count), password
+        ):
+            dst.write(frame)
+
+
+class UploadSessionStore:
+    """
+    Upload sessions kept on disk. Each session directory holds one file per
+    received chunk and a JSON manifest; sessions untouched for longer than
+    `ttl_seconds` are removed by `expire()`.
+    """
+
+    def __init__(
+        self, root, ttl_seconds=24 * 3600, max_total_size=None,
+        min_chunk_size=1, max_chunk_size=None
+    ):
+        self.root = root
+        self.ttl_seconds = ttl_seconds
+        self.max_total_size = max_total_size
+        self.min_chunk_size = max(1, min_chunk_size)
+        self.max_chunk_size = max_chunk_size
+        self._lock = threading.Lock()
+        os.makedirs(root, exist_ok=True)
+
+    def _session_dir(self, upload_id):
+        try:
+            upload_id = uuid.UUID(upload_id).hex
+        except (ValueError, AttributeError):
+            raise UploadNotFound("Upload session not found.")
+        return os.path.join(self.root, upload_id)
+
+    def _read_manifest(self, session_dir):
+        """The manifest, with `updated_at` taken from its mtime (see _touch)."""
+        try:
+            with open(os.path.join(session_dir, MANIFEST_NAME), "r", encoding="utf-8") as f:
+                manifest = json.load(f)
+                manifest["updated_at"] = os.fstat(f.fileno()).st_mtime
+                return manifest
+        except (FileNotFoundError, ValueError):
+            raise UploadNotFound("Upload session not found.")
+
+    def _write_manifest(self, session_dir, manifest):
+        manifest["updated_at"] = time.time()
+        stored = {key: value for key, value in manifest.items() if key != "received"}
+        tmp_path = os.path.join(session_dir, MANIFEST_NAME + ".tmp")
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(stored, f)
+        os.replace(tmp_path, os.path.join(session_dir, MANIFEST_NAME))
+
+    def _touch(self, session_dir, manifest):
+        """Marks the session active without rewriting the manifest."""
+        now = time.time()
+        os.utime(os.path.join(session_dir, MANIFEST_NAME), (now, now))
+        manifest["updated_at"] = now
+
+    def _load(self, upload_id, owner):
+        session_dir = self._session_dir(upload_id)
+        manifest = self._read_manifest(session_dir)
+        if manifest["owner"] != owner:
+            raise UploadNotFound("Upload session not found.")
+        manifest["received"] = _received_chunks(session_dir)
+        return session_dir, manifest
+
+    def create(self, owner, filename, total_size, chunk_size):
+        """
+        Starts a session for a file of `total_size` bytes sent in `chunk_size`
+        pieces. `chunk_size` must be at least `min_chunk_size` unless the file
+        fits in one chunk; only the last chunk may be smaller.
+        """
+        if total_size <= 0:
+            raise UploadError("total_size must be positive.")
+        if chunk_size < min(self.min_chunk_size, total_size) or (
+            self.max_chunk_size and chunk_size > self.max_chunk_size
+        ):
+            raise UploadError(
+                f"chunk_size must be between {self.min_chunk_size} and {self.max_chunk_size} bytes "
+                "(or the whole file, if smaller)."
+            )
+        if self.max_total_size and total_size > self.max_total_size:
+            raise UploadError(f"File exceeds the maximum upload size of {self.max_total_size} bytes.")
+
+        upload_id = uuid.uuid4().hex
+        session_dir = os.path.join(self.root, upload_id)
+        os.makedirs(session_dir)
+        manifest = {
+            "upload_id": upload_id,
+            "owner": owner,
+            "filename": os.path.basename(filename) or "upload",
+            "total_size": total_size,
+            "chunk_size": chunk_size,
+            "chunk_count": -(-total_size // chunk_size),
+            "received": [],
+            "state": "open",
+            "created_at": time.time(),
+        }
+        self._write_manifest(session_dir, manifest)
+        return manifest
+
+    def expected_chunk_size(self, manifest, index):
+        if not 0 <= index < manifest["chunk_count"]:
+            raise UploadError(f"Chunk index must be between 0 and {manifest['chunk_count'] - 1}.")
+        if index == manifest["chunk_count"] - 1:
+            return manifest["total_size"] - index * manifest["chunk_size"]
+        return manifest["chunk_size"]
+
+    def open_chunk(self, upload_id, owner, index):
+        """
+        Validates a chunk upload and returns (manifest, expected_size, tmp_path).
+        The caller writes the body to `tmp_path` and then calls `commit_chunk`.
+        """
+        with self._lock:
+            session_dir, manifest = self._load(upload_id, owner)
+            if manifest["state"] != "open":
+                raise UploadConflict("Upload session is already being finalized.")
+            expected = self.expected_chunk_size(manifest, index)
+        tmp_path = _chunk_path(session_dir, index) + f".{uuid.uuid4().hex}.tmp"
+        return manifest, expected, tmp_path
+
+    def commit_chunk(self, upload_id, owner, index, tmp_path):
+        """Moves a fully written chunk into place (re-sending a chunk replaces it)."""
+        with self._lock:
+            try:
+                session_dir, manifest = self._load(upload_id, owner)
+                if manifest["state"] != "open":
+                    raise UploadConflict("Upload session is already being finalized.")
+                os.replace(tmp_path, _chunk_path(session_dir, index))
+            except BaseException:
+                discard_file(tmp_path)
+                raise
+            if index not in manifest["received"]:
+                bisect.insort(manifest["received"], index)
+            self._touch(session_dir, manifest)
+            return manifest
+
+    def status(self, upload_id, owner):
+        with self._lock:
+            return self._load(upload_id, owner)[1]
+
+    def begin_finalize(self, upload_id, owner):
+        """Locks the session against further chunks; returns (session_dir, manifest)."""
+        with self._lock:
+            session_dir, manifest = self._load(upload_id, owner)
+            if manifest["state"] != "open":
+                raise UploadConflict("Upload session is already being finalized.")
+            missing = missing_chunk_count(manifest)
+            if missing:
+                raise UploadError(f"Upload incomplete; {missing} chunk(s) missing.")
+            manifest["state"] = "finalizing"
+            self._write_manifest(session_dir, manifest)
+            return session_dir, manifest
+
+    def abort_finalize(self, upload_id, owner):
+        """Re-opens a session whose finalize failed (e.g. server busy)."""
+        with self._lock:
+            session_dir, manifest = self._load(upload_id, owner)
+            manifest["state"] = "open"
+            self._write_manifest(session_dir, manifest)
+
+    def delete(self, upload_id, owner=None):
+        with self._lock:
+            session_dir = self._session_dir(upload_id)
+            if owner is not None:
+                self._load(upload_id, owner)
+            shutil.rmtree(session_dir, ignore_errors=True)
+
+    def expire(self):
+        """Removes sessions not updated within the TTL. Returns how many were removed."""
+        cutoff = time.time() - self.ttl_seconds
+        removed = 0
+        with self._lock:
+            for name in os.listdir(self.root):
+                session_dir = os.path.join(self.root, name)
+                if not os.path.isdir(session_dir):
+                    continue
+                try:
+                    manifest = self._read_manifest(session_dir)
+                    last_update = manifest.get("updated_at", 0)
+                except UploadNotFound:
+                    # Half-created session: judge by directory age instead
+                    last_update = os.path.getmtime(session_dir)
+                if last_update < cutoff:
+                    shutil.rmtree(session_dir, ignore_errors=True)
+                    removed += 1
+        return removed
+
+
+def chunk_ranges(indices):
+    """Sorted chunk indices -> [[first, last], ...] runs (inclusive)."""
+    ranges = []
+    for index in indices:
+        if ranges and ranges[-1][1] == index - 1:
+            ranges[-1][1] = index
+        else:
+            ranges.append([index, index])
+    return ranges
+
+
+def missing_chunk_ranges(manifest):
+    """Gaps between the received chunks, as inclusive [first, last] runs."""
+    ranges = []
+    expected = 0
+    for index in manifest["received"] + [manifest["chunk_count"]]:
+        if index > expected:
+            ranges.append([expected, index - 1])
+        expected = index + 1
+    return ranges
+
+
+def missing_chunk_count(manifest):
+    return manifest["chunk_count"] - len(manifest["received"])
+
+
+def discard_file(path):
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
@@ -0,0 +1,143 @@
+import asyncio
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+
+# --- Bounded Worker Pools ---
+# CPU-bound work (stego, PBKDF2, AES, bcrypt) must not run on the asyncio
+# event loop. A BoundedExecutor wraps a thread or process pool and limits how
+# many jobs may be running or waiting at once, so overload is rejected
+# immediately (ExecutorSaturated -> HTTP 503) instead of piling up.
+
+# Number of recent jobs kept for percentile statistics
+_STATS_WINDOW = 1024
+
+
+class ExecutorSaturated(Exception):
+    """Raised when a pool already has its maximum of running + queued jobs."""
+
+
+def _timed_call(fn, args, kwargs):
+    """Runs inside the worker; reports when execution actually started."""
+    started = time.monotonic()
+    result = fn(*args, **kwargs)
+    return result, started, time.monotonic()
+
+
+def _percentiles(samples):
+    if not samples:
+        return {"p50": None, "p95": None, "max": None}
+    ordered = sorted(samples)
+    last = len(ordered) - 1
+    return {
+        "p50": ordered[int(last * 0.50)],
+        "p95": ordered[int(last * 0.95)],
+        "max": ordered[last],
+    }
+
+
+class BoundedExecutor:
+    """
+    Thread or process pool with a bounded queue and latency metrics.
+    `kind` is "thread" or "process"; with "process", jobs and their
+    arguments must be picklable (module-level functions, bytes, paths).
+    `initializer(*initargs)` runs once in each worker (e.g. to load models).
+    """
+
+    def __init__(self, name, kind="thread", max_workers=4, max_queue=16,
+                 initializer=None, initargs=()):
+        if kind == "thread":
+            self._pool = ThreadPoolExecutor(
+                max_workers=max_workers, thread_name_prefix=name,
+                initializer=initializer, initargs=initargs
+            )
+        elif kind == "process":
+            self._pool = ProcessPoolExecutor(
+                max_workers=max_workers, initializer=initializer, initargs=initargs
+            )
+        else:
+            raise ValueError(f"Unknown executor kind: {kind}")
+        self.name = name
+        self.kind = kind
+        self.max_workers = max_workers
+        self.max_queue = max_queue
+        self._slots = threading.BoundedSemaphore(max_workers + max_queue)
+        self._lock = threading.Lock()
+        self._in_flight = 0
+        self._completed = 0
+        self._failed = 0
+        self._rejected = 0
+        self._queue_wait = deque(maxlen=_STATS_WINDOW)
+        self._run_time = deque(maxlen=_STATS_WINDOW)
+        self._total_time = deque(maxlen=_STATS_WINDOW)
+
+    def _admit(self):
+        if not self._slots.acquire(blocking=False):
+            with self._lock:
+                self._rejected += 1
+            raise ExecutorSaturated(f"{self.name} pool is saturated.")
+        with self._lock:
+            self._in_flight += 1
+        return time.monotonic()
+
+    def _submit(self, fn, args, kwargs):
+        """
+        Admits and submits one job. The slot is released by a done callback
+        on the pool future, i.e. only once the job has actually finished (or
+        was cancelled before it started), never when a caller stops waiting.
+        """
+        submitted = self._admit()
+        try:
+            future = self._pool.submit(_timed_call, fn, args, kwargs)
+        except BaseException:
+            self._finish(submitted, None)
+            raise
+        future.add_done_callback(lambda done: self._finish(submitted, done))
+        return future
+
+    def _finish(self, submitted, future):
+        self._slots.release()
+        with self._lock:
+            self._in_flight -= 1
+            if future is None or future.cancelled() or future.exception() is not None:
+                self._failed += 1
+                return
+            _, started, finished = future.result()
+            self._completed += 1
+            self._queue_wait.append(max(0.0, started - submitted))
+            self._run_time.append(finished - started)
+            self._total_time.append(time.monotonic() - submitted)
+
+    async def run(self, fn, *args, **kwargs):
+        """
+        Runs `fn(*args, **kwargs)` in the pool and awaits its result. If the
+        awaiting task is cancelled, a job that has not started yet is
+        cancelled too; a running one keeps its slot until it finishes.
+        """
+        future = self._submit(fn, args, kwargs)
+        result, _, _ = await asyncio.wrap_future(future)
+        return result
+
+    def call(self, fn, *args, **kwargs):
+        """Blocking variant of `run` for callers without an event loop."""
+        result, _, _ = self._submit(fn, args, kwargs).result()
+        return result
+
+    def stats(self):
+        with self._lock:
+            return {
+                "kind": self.kind,
+                "max_workers": self.max_workers,
+                "max_queue": self.max_queue,
+                "in_flight": self._in_flight,
+                "completed": self._completed,
+                "failed": self._failed,
+                "rejected": self._rejected,
+                "queue_wait_seconds": _percentiles(self._queue_wait),
+                "run_seconds": _percentiles(self._run_time),
+                "total_seconds": _percentiles(self._total_time),
+            }
+
+    def shutdown(self):
+        self._pool.shutdown(wait=False, cancel_futures=True)